@@ -0,0 +1,69 @@
+"""
+Overdue and due-soon task alerts.
+
+refresh_alerts() reads open tasks through the (status, commitment date)
+index on tasks_v2 and flags each one overdue (commitment before today) or
+due soon (within PORTAL_ALERT_DUE_DAYS). It rewrites task_alerts (one row per
+flagged task) and alert_counts (totals per pilot, per lead and overall) in
+one transaction. The scheduler refreshes them every
+PORTAL_ALERT_INTERVAL_MINUTES, so a page load only does a primary-key read.
+
+    PORTAL_ALERT_DUE_DAYS          3
+    PORTAL_ALERT_INTERVAL_MINUTES  15   (0 disables the scheduled refresh)
+"""
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import scheduler
+from analytics import OPEN_STATUSES
+from storage import cached_by_generation, get_backend, parse_dates, read_sharded, register_aggregate
+
+DUE_SOON_DAYS = int(os.environ.get("PORTAL_ALERT_DUE_DAYS", 3))
+ALERT_INTERVAL_MINUTES = float(os.environ.get("PORTAL_ALERT_INTERVAL_MINUTES", 15))
+
+@register_aggregate("task_alerts")
+def refresh_alerts(today=None, due_days=None):
+    """Rebuilds task_alerts and alert_counts; returns the overall {'overdue', 'due_soon'} counts."""
+    today = pd.Timestamp(today or date.today()).normalize()
+    due_days = DUE_SOON_DAYS if due_days is None else due_days
+    df = read_sharded(
+        f"SELECT id, pilot_user_id, project_lead, commitment_date_to_customer FROM tasks_v2 "
+        f"WHERE status IN ({','.join(['?'] * len(OPEN_STATUSES))})", OPEN_STATUSES, reader=False)
+    due = parse_dates(df['commitment_date_to_customer'])
+    df['kind'] = np.select([due < today, due <= today + timedelta(days=due_days)], ['overdue', 'due_soon'], None)
+    df['days'] = (due - today).dt.days
+    df = df[df['kind'].notna()]
+
+    stamp = datetime.now().isoformat(timespec="seconds")
+    counts = [('all', '', df)]
+    counts += [('pilot', str(int(k)), g) for k, g in df.groupby('pilot_user_id')]
+    counts += [('lead', str(k), g) for k, g in df.groupby(df['project_lead'].fillna(''))]
+    with get_backend().connect() as c:
+        c.execute("DELETE FROM task_alerts")
+        c.execute("DELETE FROM alert_counts")
+        c.executemany("INSERT INTO task_alerts (task_id, pilot_user_id, project_lead, kind, days_to_due) VALUES (?,?,?,?,?)",
+                      [(r.id, None if pd.isna(r.pilot_user_id) else int(r.pilot_user_id), r.project_lead, r.kind, int(r.days))
+                       for r in df.itertuples()])
+        c.executemany("INSERT INTO alert_counts (scope, key, overdue, due_soon, refreshed_at) VALUES (?,?,?,?,?)",
+                      [(scope, key, int((g['kind'] == 'overdue').sum()), int((g['kind'] == 'due_soon').sum()), stamp)
+                       for scope, key, g in counts])
+    return {'overdue': int((df['kind'] == 'overdue').sum()), 'due_soon': int((df['kind'] == 'due_soon').sum())}
+
+def alert_counts(scope='all', key=''):
+    """(overdue, due_soon) for 'all', a 'pilot' (user_id) or a 'lead' (project lead name)."""
+    with get_backend().connect() as c:
+        row = c.execute("SELECT overdue, due_soon FROM alert_counts WHERE scope=? AND key=?", (scope, str(key))).fetchone()
+    return tuple(row) if row else (0, 0)
+
+@cached_by_generation('task_alerts')
+def task_alert_kinds():
+    """task id -> 'overdue' | 'due_soon' for the flagged tasks."""
+    df = get_backend().read_df("SELECT task_id, kind FROM task_alerts")
+    return dict(zip(df['task_id'], df['kind']))
+
+@scheduler.every("alerts", ALERT_INTERVAL_MINUTES * 60)
+def scheduled_alerts():
+    return refresh_alerts()
@@ -0,0 +1,253 @@
+"""
+Workforce analytics: resource headcount, pilot workload and task cost.
+
+headcount_timeline() turns every resource into two events, +1 in its
+onboarding month and -1 in its exit month, counts events per (group, month)
+and takes a running sum, so the cost is one pass over the rows however many
+years the timeline covers. workload_index() applies the same idea to open
+tasks per pilot. Results are cached per data generation of their table and
+read through the backend's reader (see storage), off the write path,
+and from every shard when PORTAL_SHARD_BY is set.
+task_costs() joins tasks, live and archived, to resource rates through the pilot's user_id (or
+the employee id on their resource row) with vectorized pandas/numpy.
+cycle_time_stats() summarizes the per-day histograms that storage keeps in
+step with every task status change, so it never scans the status history.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from storage import (CYCLE_MAX_DAYS, STINT_METRICS, cached_by_generation, cycle_scopes, get_backend, parse_dates,
+                     read_sharded, register_aggregate)
+
+HEADCOUNT_GROUPS = ('department', 'location')
+
+def _month(series):
+    return parse_dates(series).dt.to_period('M')
+
+def _monthly(months, keys, periods):
+    """Event counts per month (rows) and group (columns) over the full month range."""
+    hit = periods.notna()
+    counts = pd.crosstab(periods[hit], keys[hit])
+    return counts.reindex(index=months, columns=keys.unique(), fill_value=0)
+
+@cached_by_generation('resource_tracker_v4', reader=True)
+def headcount_timeline(by=None, end=None):
+    """
+    Monthly headcount per group (by = 'department' | 'location' | None for all).
+    Columns: month, group, headcount (active at month end), joiners, leavers,
+    attrition_pct (leavers / average headcount) and open_backfills (leavers
+    flagged for backfill up to that month whose entry still says "Yes").
+    """
+    if by is not None and by not in HEADCOUNT_GROUPS: raise ValueError(f"Unknown group: {by}")
+    df = read_sharded("SELECT department, location, onboarding_date, effective_exit_date, backfill_status "
+                      "FROM resource_tracker_v4")
+    start = _month(df['onboarding_date'])
+    if start.notna().sum() == 0:
+        return pd.DataFrame(columns=['month', 'group', 'headcount', 'joiners', 'leavers', 'attrition_pct', 'open_backfills'])
+    exit_ = _month(df['effective_exit_date']).where(start.notna())
+    keys = (df[by].fillna('Unassigned').replace('', 'Unassigned') if by else pd.Series('All', index=df.index)).astype(str)
+
+    last = pd.Period(end or pd.Timestamp.today(), freq='M')
+    months = pd.period_range(start.min(), last, freq='M')
+    joiners = _monthly(months, keys, start)
+    leavers = _monthly(months, keys, exit_)
+    backfills = _monthly(months, keys, exit_.where(df['backfill_status'].eq('Yes')))
+
+    headcount = joiners.cumsum() - leavers.cumsum()
+    avg = (headcount + headcount.shift(1, fill_value=0)) / 2
+    attrition = (leavers / avg.where(avg > 0)).fillna(0) * 100
+
+    out = pd.concat({'headcount': headcount, 'joiners': joiners, 'leavers': leavers,
+                     'attrition_pct': attrition.round(1), 'open_backfills': backfills.cumsum()}, axis=1)
+    out = out.stack(level=1).rename_axis(['month', 'group']).reset_index()
+    out['month'] = out['month'].dt.to_timestamp()
+    return out.sort_values(['month', 'group'], kind='stable').reset_index(drop=True)
+
+# --- PILOT WORKLOAD ---
+# Open tasks a pilot can carry at once before the editor flags them as overloaded
+PILOT_CAPACITY = int(os.environ.get("PORTAL_PILOT_CAPACITY", 5))
+OPEN_STATUSES = ("Inprogress", "Hold")
+
+def _days(dt):
+    return dt.values.astype('datetime64[D]').astype(np.int64)
+
+class WorkloadIndex:
+    """
+    Open tasks as [start, commitment] day intervals, held as two sorted key
+    arrays (pilot block * span + day): one for starts, one for ends. Tasks
+    open on day d = starts <= d minus ends < d, so a query for every pilot
+    is a pair of vectorized searchsorted calls.
+    """
+    def __init__(self, user_ids, start, end, capacity=PILOT_CAPACITY):
+        codes, self.user_ids = pd.factorize(user_ids, sort=True)
+        self.capacity = capacity
+        s, e = _days(start), _days(end)
+        self._base = int(s.min()) if len(s) else 0
+        self._span = (int(e.max()) - self._base + 2) if len(s) else 1
+        self._starts = np.sort(codes * self._span + (s - self._base))
+        self._ends = np.sort(codes * self._span + (e - self._base))
+        self._blocks = np.arange(len(self.user_ids), dtype=np.int64) * self._span
+        self._s_lo = np.searchsorted(self._starts, self._blocks)
+        self._e_lo = np.searchsorted(self._ends, self._blocks)
+
+    def _key(self, day):
+        return np.clip(_days(pd.Series(pd.to_datetime(day))) - self._base, -1, self._span - 1)
+
+    def overlapping(self, start, end):
+        """Open tasks per pilot (Series by user_id) whose interval overlaps [start, end]."""
+        started = np.searchsorted(self._starts, self._blocks + self._key(end)[0], side='right') - self._s_lo
+        ended = np.searchsorted(self._ends, self._blocks + self._key(start)[0] - 1, side='right') - self._e_lo
+        return pd.Series(started - ended, index=self.user_ids, name='open_tasks')
+
+    def timeline(self, user_id, start, end):
+        """Concurrent open tasks per day for one pilot."""
+        days = pd.date_range(start, end, freq='D')
+        if user_id not in self.user_ids: return pd.DataFrame({'day': days, 'open_tasks': 0})
+        i = self.user_ids.get_loc(user_id)
+        keys = self._blocks[i] + self._key(days)
+        started = np.searchsorted(self._starts, keys, side='right') - self._s_lo[i]
+        ended = np.searchsorted(self._ends, keys - 1, side='right') - self._e_lo[i]
+        return pd.DataFrame({'day': days, 'open_tasks': started - ended})
+
+    def load(self, pilots, start, end):
+        """pilots (user_id, name frame) with open_tasks in the window and an overloaded flag, least loaded first."""
+        out = pilots[['user_id', 'name']].copy()
+        out['open_tasks'] = out['user_id'].map(self.overlapping(start, end)).fillna(0).astype(int)
+        out['overloaded'] = out['open_tasks'] >= self.capacity
+        return out.sort_values(['open_tasks', 'name'], kind='stable').reset_index(drop=True)
+
+@cached_by_generation('tasks_v2', reader=True)
+def workload_index():
+    """WorkloadIndex over open tasks. A missing start falls back to date of receipt, a missing commitment to the start."""
+    df = read_sharded(
+        f"SELECT pilot_user_id, start_date, date_of_receipt, commitment_date_to_customer FROM tasks_v2 "
+        f"WHERE pilot_user_id IS NOT NULL AND status IN ({','.join(['?'] * len(OPEN_STATUSES))})", OPEN_STATUSES)
+    start = parse_dates(df['start_date']).fillna(parse_dates(df['date_of_receipt']))
+    end = parse_dates(df['commitment_date_to_customer']).fillna(start)
+    start = start.fillna(end)
+    keep = start.notna()
+    start, end = start[keep], end[keep]
+    return WorkloadIndex(df.loc[keep, 'pilot_user_id'].astype('int64'), start, end.where(end >= start, start))
+
+# --- COST PER TASK ---
+# Working hours billed per day at the resource's hourly_rate
+HOURS_PER_DAY = float(os.environ.get("PORTAL_HOURS_PER_DAY", 8))
+COST_GROUPS = ('project_lead', 'customer_manager_name', 'name_activity_pilot')
+
+def _daily_rates():
+    """Daily cost per user_id (hourly_rate * HOURS_PER_DAY + hardware_daily_cost); the latest onboarding wins."""
+    df = read_sharded(
+        "SELECT COALESCE(r.user_id, (SELECT MIN(u.user_id) FROM users u WHERE u.emp_id=r.employee_id)) AS user_id, "
+        "r.hourly_rate, r.hardware_daily_cost, r.onboarding_date FROM resource_tracker_v4 r")
+    df = df[df['user_id'].notna()]
+    rate = (pd.to_numeric(df['hourly_rate'], errors='coerce').fillna(0) * HOURS_PER_DAY
+            + pd.to_numeric(df['hardware_daily_cost'], errors='coerce').fillna(0))
+    df = df.assign(rate=rate, k=parse_dates(df['onboarding_date'])).sort_values('k', kind='stable', na_position='first')
+    return df.drop_duplicates('user_id', keep='last').set_index(df['user_id'].astype('int64').rename(None))['rate']
+
+def _work_days(start, end):
+    """Business days in [start, end] for datetime64[D] arrays; 0 where either is NaT or end < start."""
+    ok = ~(np.isnat(start) | np.isnat(end)) & (end >= start)
+    out = np.zeros(len(start), dtype=np.int64)
+    out[ok] = np.busday_count(start[ok], end[ok] + np.timedelta64(1, 'D'))
+    return out
+
+@cached_by_generation('tasks_v2', 'tasks_archive', 'resource_tracker_v4', 'users', reader=True)
+def task_costs(end=None):
+    """
+    Cost of every task: business days from start (or receipt) to actual
+    delivery, times the pilot's daily rate. Open tasks run to `end` (default
+    today), finished ones without a delivery date to their commitment date.
+    priced is False where the pilot has no resource row. Archived tasks are
+    included, so their cost doesn't vanish from the totals once they're moved.
+    """
+    cols = ("id, task_name, pilot_user_id, name_activity_pilot, project_lead, customer_manager_name, status, "
+            "date_of_receipt, start_date, actual_delivery_date, commitment_date_to_customer")
+    df = read_sharded(f"SELECT {cols} FROM tasks_v2 UNION ALL SELECT {cols} FROM tasks_archive")
+    today = pd.Timestamp(end or pd.Timestamp.today()).normalize()
+    start = parse_dates(df['start_date']).fillna(parse_dates(df['date_of_receipt']))
+    finish = parse_dates(df['actual_delivery_date']).fillna(parse_dates(df['commitment_date_to_customer']))
+    finish = finish.where(~df['status'].isin(OPEN_STATUSES), today)
+
+    out = df[['id', 'task_name', 'pilot_user_id', *COST_GROUPS, 'status']].copy()
+    out['start'], out['finish'] = start, finish
+    out['work_days'] = _work_days(start.values.astype('datetime64[D]'), finish.values.astype('datetime64[D]'))
+    rate = pd.to_numeric(df['pilot_user_id'], errors='coerce').map(_daily_rates())
+    out['priced'] = rate.notna()
+    out['daily_rate'] = rate.fillna(0)
+    out['cost'] = out['work_days'] * out['daily_rate']
+    return out
+
+@cached_by_generation('tasks_v2', 'tasks_archive', 'resource_tracker_v4', 'users', reader=True)
+def cost_by(by='project_lead', end=None):
+    """tasks, work_days and cost per project lead / customer manager / pilot, most expensive first."""
+    if by not in COST_GROUPS: raise ValueError(f"Unknown group: {by}")
+    tc = task_costs(end)
+    out = tc.groupby(tc[by].fillna('').astype(str).replace('', 'Unassigned'), observed=True).agg(
+        tasks=('id', 'size'), work_days=('work_days', 'sum'), cost=('cost', 'sum'))
+    return out.rename_axis('group').reset_index().sort_values('cost', ascending=False, kind='stable').reset_index(drop=True)
+
+@cached_by_generation('tasks_v2', 'tasks_archive', 'resource_tracker_v4', 'users', reader=True)
+def monthly_costs(by=None, end=None):
+    """
+    Cost per calendar month (and group): each task is split into one row per
+    month it spans, with the business days falling in that month, so the work
+    is proportional to task-months rather than task-days.
+    """
+    if by is not None and by not in COST_GROUPS: raise ValueError(f"Unknown group: {by}")
+    tc = task_costs(end)
+    tc = tc[tc['work_days'] > 0]
+    start, finish = tc['start'].values.astype('datetime64[D]'), tc['finish'].values.astype('datetime64[D]')
+    first_m = start.astype('datetime64[M]').astype(np.int64)
+    n = finish.astype('datetime64[M]').astype(np.int64) - first_m + 1
+    row = np.repeat(np.arange(len(tc)), n)
+    month = first_m[row] + np.arange(len(row)) - np.repeat(np.cumsum(n) - n, n)
+    m_start = month.astype('datetime64[M]').astype('datetime64[D]')
+    m_end = (month + 1).astype('datetime64[M]').astype('datetime64[D]') - np.timedelta64(1, 'D')
+    days = _work_days(np.maximum(start[row], m_start), np.minimum(finish[row], m_end))
+    parts = pd.DataFrame({'month': m_start.astype('datetime64[ns]'),
+                          'group': tc[by].fillna('').astype(str).replace('', 'Unassigned').values[row] if by else 'All',
+                          'work_days': days, 'cost': days * tc['daily_rate'].values[row]})
+    return parts.groupby(['month', 'group'], as_index=False)[['work_days', 'cost']].sum()
+
+# --- CYCLE TIME ---
+CYCLE_PERCENTILES = (50, 90)
+
+@cached_by_generation('cycle_time_hist', reader=True)
+def cycle_time_stats(scope='pilot'):
+    """
+    Per key of a scope ('all' | 'pilot' | 'lead') and metric ('lead_time',
+    'in_progress', 'hold'): samples, total and mean days, and p50/p90 in whole
+    days, read from the cycle_time_hist buckets rather than the history.
+    """
+    if scope not in ('all', 'pilot', 'lead'): raise ValueError(f"Unknown scope: {scope}")
+    df = get_backend().reader().read_df("SELECT key, metric, days, n, total FROM cycle_time_hist WHERE scope=? ORDER BY key, metric, days",
+                                        (scope,)).astype({'days': 'int64', 'n': 'int64', 'total': 'float64'})
+    out = df.groupby(['key', 'metric'], as_index=False).agg(n=('n', 'sum'), total_days=('total', 'sum'))
+    out['mean_days'] = out['total_days'] / out['n']
+    cum = df.groupby(['key', 'metric'])['n'].cumsum()
+    need = df.groupby(['key', 'metric'])['n'].transform('sum')
+    for q in CYCLE_PERCENTILES:
+        first = df[cum >= need * q / 100].groupby(['key', 'metric'], as_index=False)['days'].first()
+        out = out.merge(first.rename(columns={'days': f'p{q}_days'}), on=['key', 'metric'], how='left')
+    return out
+
+@register_aggregate("cycle_time")
+def rebuild_cycle_times():
+    """Rebuilds cycle_time_hist from task_status_history (after a restore or import); returns samples counted."""
+    h = get_backend().read_df("SELECT from_status, pilot_user_id, project_lead, stint_days, lead_days FROM task_status_history "
+                              "WHERE stint_days IS NOT NULL OR lead_days IS NOT NULL")
+    samples = pd.concat([h.assign(metric=h['from_status'].map(STINT_METRICS), d=h['stint_days']),
+                         h.assign(metric='lead_time', d=h['lead_days'])])
+    samples = samples[samples['metric'].notna() & samples['d'].notna()]
+    rows = [(scope, key, r.metric, min(int(r.d), CYCLE_MAX_DAYS), r.d) for r in samples.itertuples()
+            for scope, key in cycle_scopes(None if pd.isna(r.pilot_user_id) else r.pilot_user_id, r.project_lead)]
+    hist = pd.DataFrame(rows, columns=['scope', 'key', 'metric', 'days', 'total'])
+    hist = hist.groupby(['scope', 'key', 'metric', 'days'], as_index=False).agg(n=('total', 'size'), total=('total', 'sum'))
+    with get_backend().connect() as c:
+        c.execute("DELETE FROM cycle_time_hist")
+        c.executemany("INSERT INTO cycle_time_hist (scope, key, metric, days, n, total) VALUES (?,?,?,?,?,?)",
+                      [(r.scope, r.key, r.metric, int(r.days), int(r.n), float(r.total)) for r in hist.itertuples()])
+    return len(samples)
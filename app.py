@@ -1,12 +1,25 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-import uuid
 from datetime import date, datetime, timedelta
-import random
 import plotly.express as px
 import plotly.graph_objects as go
-import string
+
+from storage import (
+    init_db, generate_temp_password, get_all_users, get_pilots, authenticate, check_password,
+    session_user, session_secret, save_user_entry, delete_user, get_user_resource_details,
+    update_user_credentials, get_kpi_data, get_pilot_tasks, save_kpi_task, update_task_status,
+    add_training, delete_training, delete_all_trainings, get_trainings, update_training_statuses,
+    get_resource_list, get_resource, get_task, save_resource_entry, search_archive, ARCHIVE_AFTER_DAYS,
+)
+from jobs import submit_import, get_job, list_jobs, eta_seconds, is_stale
+from auth import issue_token, read_token
+from analytics import (headcount_timeline, workload_index, task_costs, cost_by, monthly_costs, cycle_time_stats,
+                       OPEN_STATUSES, PILOT_CAPACITY, HOURS_PER_DAY)
+from avatars import avatar_src
+from alerts import alert_counts, task_alert_kinds, DUE_SOON_DAYS
+import backup
+import maintenance
+import scheduler
 
 # ---------- CONFIG ----------
 st.set_page_config(page_title="Corporate Portal", layout="wide", page_icon="🏢")
@@ -57,354 +70,54 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# ---------- DATABASE & SEEDING ----------
-DB_FILE = "portal_v23_fixed.db"
-
-def seed_data(c):
-    """
-    CHANGED: Uses INSERT OR IGNORE so we don't overwrite passwords if a user 
-    has changed them. Only inserts if the user does NOT exist.
-    """
-    
-    # 1. CREATE FIXED USERS (Only if they don't exist)
-    mandatory_users = [
-        ("admin", "admin123", "Super Admin", "System Admin", "ADM-000"),
-        ("leader", "123", "Team Leader", "Sarah Jenkins", "LDR-001"),
-        ("member", "123", "Team Member", "David Chen", "EMP-101")
-    ]
-
-    for u_user, u_pass, u_role, u_name, u_id in mandatory_users:
-        img = f"https://ui-avatars.com/api/?name={u_name.replace(' ','+')}&background=random"
-        # INSERT OR IGNORE ensures we DO NOT reset the password if user exists
-        c.execute("INSERT OR IGNORE INTO users (username, password, role, name, emp_id, img, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", 
-                  (u_user, u_pass, u_role, u_name, u_id, img, str(date.today())))
-
-    # 2. FILL RANDOM KPI TASKS (Only if table empty)
-    c.execute("SELECT count(*) FROM tasks_v2")
-    if c.fetchone()[0] == 0:
-        c.execute("SELECT name FROM users WHERE role='Team Member'")
-        pilots = [row[0] for row in c.fetchall()]
-        if not pilots: pilots = ["David Chen"]
-
-        for i in range(1, 21):
-            pilot = random.choice(pilots)
-            status = random.choice(["Completed", "Inprogress", "Hold", "Cancelled"])
-            start = date.today() - timedelta(days=random.randint(10, 60))
-            due = start + timedelta(days=random.randint(5, 20))
-            
-            actual, otd = "", "N/A"
-            if status == "Completed":
-                delay = random.choice([-2, -1, 0, 1, 5])
-                actual_dt = due + timedelta(days=delay)
-                actual = str(actual_dt)
-                otd = "OK" if actual_dt <= due else "NOT OK"
-
-            c.execute("INSERT INTO tasks_v2 VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                      (str(uuid.uuid4())[:8], pilot, f"Project Task {i:02d}", str(start), actual, str(due),
-                       status, "Yes", f"REF-{1000+i}", "Yes", otd, 
-                       f"Description for task {i}", "Standard", 
-                       "Yes", str(start), str(start), otd, "None", "QA-Ref", "Lead-X", "Mgr-Y"))
-
-    # 3. FILL TRAINING (Only if empty)
-    c.execute("SELECT count(*) FROM training_repo")
-    if c.fetchone()[0] == 0:
-        topics = ["Python Basics", "Safety Protocols", "Leadership 101", "Agile", "Communication", "Data Privacy", "Cyber Security", "Excel Advanced", "Power BI", "SQL Funda"]
-        for t in topics:
-            c.execute("INSERT INTO training_repo VALUES (?,?,?,?,?,?,?)",
-                      (str(uuid.uuid4())[:8], t, f"Learn about {t}", "http://example.com", 
-                       random.choice(["All", "Team Leader", "Team Member"]), random.choice([0, 1]), "System"))
-
-    # 4. FILL RESOURCES (Only if empty)
-    c.execute("SELECT count(*) FROM resource_tracker_v4")
-    if c.fetchone()[0] == 0:
-        depts = ["Engineering", "Quality", "Manufacturing"]
-        locs = ["Chennai", "Bangalore", "Pune"]
-        for i in range(10):
-            status = random.choice(["Active", "Active", "Inactive"])
-            exit_date = str(date.today()) if status == "Inactive" else ""
-            reason = "Resigned" if status == "Inactive" else ""
-            c.execute("INSERT INTO resource_tracker_v4 VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", 
-                      (str(uuid.uuid4())[:8], f"Resource {i}", f"RES-{i}", "001", 
-                       random.choice(depts), random.choice(locs), "Sarah Jenkins", str(date.today()),
-                       "MID", status, "PO-123", "", exit_date, "No", reason, 
-                       str(random.randint(20, 50)), "5"))
-
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Create Tables
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY, password TEXT, role TEXT, name TEXT, 
-        emp_id TEXT, img TEXT, created_at TEXT)''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS tasks_v2 (
-        id TEXT PRIMARY KEY, name_activity_pilot TEXT, task_name TEXT, date_of_receipt TEXT,
-        actual_delivery_date TEXT, commitment_date_to_customer TEXT, status TEXT,
-        ftr_customer TEXT, reference_part_number TEXT, ftr_internal TEXT, otd_internal TEXT,
-        description_of_activity TEXT, activity_type TEXT, ftr_quality_gate_internal TEXT,
-        date_of_clarity_in_input TEXT, start_date TEXT, otd_customer TEXT, customer_remarks TEXT,
-        name_quality_gate_referent TEXT, project_lead TEXT, customer_manager_name TEXT)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS training_repo (
-        id TEXT PRIMARY KEY, title TEXT, description TEXT, link TEXT, 
-        role_target TEXT, mandatory INTEGER, created_by TEXT)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS training_progress (
-        user_name TEXT, training_id TEXT, status TEXT, 
-        last_updated TEXT, PRIMARY KEY (user_name, training_id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS resource_tracker_v4 (
-        id TEXT PRIMARY KEY, employee_name TEXT, employee_id TEXT, dev_code TEXT,
-        department TEXT, location TEXT, reporting_manager TEXT, onboarding_date TEXT,
-        experience_level TEXT, status TEXT, po_details TEXT, remarks TEXT,
-        effective_exit_date TEXT, backfill_status TEXT, reason_for_leaving TEXT,
-        hourly_rate TEXT, hardware_daily_cost TEXT)''')
-    
-    seed_data(c)
-    conn.commit()
-    conn.close()
-
-# ---------- UTILS & HELPERS ----------
-
-def generate_temp_password(length=8):
-    chars = string.ascii_letters + string.digits
-    return ''.join(random.choice(chars) for i in range(length))
-
-def get_all_users():
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM users", conn)
-    conn.close()
-    return df
-
-def save_user_entry(data, is_update=False):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    if is_update:
-        c.execute("UPDATE users SET password=?, role=?, name=?, emp_id=?, img=? WHERE username=?",
-                  (data['password'], data['role'], data['name'], data['emp_id'], data['img'], data['username']))
-    else:
-        c.execute("INSERT OR REPLACE INTO users VALUES (?,?,?,?,?,?,?)",
-                  (data['username'], data['password'], data['role'], data['name'], data['emp_id'], data['img'], str(date.today())))
-    conn.commit()
-    conn.close()
-
-def delete_user(username):
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("DELETE FROM users WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
-
-def import_users_csv(file):
-    try:
-        df = pd.read_csv(file)
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        for _, row in df.iterrows():
-            c.execute("INSERT OR REPLACE INTO users VALUES (?,?,?,?,?,?,?)",
-                      (row['username'], row['password'], row['role'], row['name'], 
-                       row.get('emp_id',''), row.get('img',''), str(date.today())))
-        conn.commit()
-        conn.close()
-        return True
-    except: return False
-
-# --- NEW HELPERS FOR PROFILE ---
-def get_user_resource_details(emp_id):
-    """Fetches details from resource_tracker based on Employee ID (excluding costs)"""
-    conn = sqlite3.connect(DB_FILE)
-    try:
-        df = pd.read_sql_query("SELECT * FROM resource_tracker_v4 WHERE employee_id=?", conn, params=(emp_id,))
-    except: 
-        df = pd.DataFrame()
-    conn.close()
-    return df
-
-def update_user_credentials(username, new_password=None, new_img=None):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    if new_password:
-        c.execute("UPDATE users SET password=? WHERE username=?", (new_password, username))
-    if new_img:
-        c.execute("UPDATE users SET img=? WHERE username=?", (new_img, username))
-    conn.commit()
-    conn.close()
-
-# --- KPI HELPERS ---
-def get_kpi_data():
-    conn = sqlite3.connect(DB_FILE)
-    try: df = pd.read_sql_query("SELECT * FROM tasks_v2", conn)
-    except: df = pd.DataFrame()
-    conn.close()
-    return df
-
-def save_kpi_task(data, task_id=None):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    otd_val = "N/A"
-    try:
-        ad = data.get("actual_delivery_date")
-        cd = data.get("commitment_date_to_customer")
-        if ad and cd and ad != 'None' and cd != 'None':
-            a_dt = pd.to_datetime(ad, dayfirst=True, errors='coerce')
-            c_dt = pd.to_datetime(cd, dayfirst=True, errors='coerce')
-            if not pd.isna(a_dt) and not pd.isna(c_dt):
-                otd_val = "OK" if a_dt <= c_dt else "NOT OK"
-    except: pass
-
-    cols = ['name_activity_pilot', 'task_name', 'date_of_receipt', 'actual_delivery_date', 
-            'commitment_date_to_customer', 'status', 'ftr_customer', 'reference_part_number', 
-            'ftr_internal', 'otd_internal', 'description_of_activity', 'activity_type', 
-            'ftr_quality_gate_internal', 'date_of_clarity_in_input', 'start_date', 'otd_customer', 
-            'customer_remarks', 'name_quality_gate_referent', 'project_lead', 'customer_manager_name']
-    
-    data['otd_internal'] = otd_val; data['otd_customer'] = otd_val
-    vals = [str(data.get(k, '')) if data.get(k) is not None else '' for k in cols]
-
-    if task_id:
-        set_clause = ", ".join([f"{col}=?" for col in cols])
-        c.execute(f"UPDATE tasks_v2 SET {set_clause} WHERE id=?", (*vals, task_id))
-    else:
-        new_id = str(uuid.uuid4())[:8]
-        placeholders = ",".join(["?"] * (len(cols) + 1))
-        c.execute(f"INSERT INTO tasks_v2 VALUES ({placeholders})", (new_id, *vals))
-    conn.commit(); conn.close()
-
-def import_kpi_csv(file):
-    try:
-        df = pd.read_csv(file)
-        if 'id' not in df.columns: df['id'] = [str(uuid.uuid4())[:8] for _ in range(len(df))]
-        conn = sqlite3.connect(DB_FILE)
-        df.to_sql('tasks_v2', conn, if_exists='append', index=False)
-        conn.close()
-        return True
-    except: return False
-
-# --- TRAINING HELPERS ---
-def add_training(title, desc, link, role, mandatory, creator):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    tid = str(uuid.uuid4())[:8]
-    c.execute("INSERT INTO training_repo VALUES (?,?,?,?,?,?,?)", 
-              (tid, title, desc, link, role, 1 if mandatory else 0, creator))
-    conn.commit(); conn.close()
-
-def delete_training(tid):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM training_repo WHERE id=?", (tid,))
-    conn.commit()
-    conn.close()
-
-def delete_all_trainings():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM training_repo")
-    c.execute("DELETE FROM training_progress")
-    conn.commit()
-    conn.close()
-
-def get_trainings(user_name=None):
-    conn = sqlite3.connect(DB_FILE)
-    repo = pd.read_sql_query("SELECT * FROM training_repo", conn)
-    if user_name:
-        prog = pd.read_sql_query("SELECT * FROM training_progress WHERE user_name=?", conn, params=(user_name,))
-        if not repo.empty:
-            merged = pd.merge(repo, prog, left_on='id', right_on='training_id', how='left')
-            merged['status'] = merged['status'].fillna('Not Started')
-            conn.close(); return merged
-    conn.close(); return repo
-
-def update_training_status(user_name, training_id, status):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO training_progress VALUES (?,?,?,?)", 
-              (user_name, training_id, status, str(date.today())))
-    conn.commit(); conn.close()
-
-def import_training_csv(file):
-    try:
-        df = pd.read_csv(file)
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        for _, row in df.iterrows():
-            tid = str(uuid.uuid4())[:8]
-            c.execute("INSERT INTO training_repo VALUES (?,?,?,?,?,?,?)",
-                      (tid, row.get('title','No Title'), row.get('description',''), 
-                       row.get('link','#'), row.get('role_target','All'), 
-                       int(row.get('mandatory', 0)), 'Imported'))
-        conn.commit()
-        conn.close()
-        return True
-    except: return False
-
-# --- RESOURCE TRACKER HELPERS ---
-def get_resource_list():
-    conn = sqlite3.connect(DB_FILE)
-    try: df = pd.read_sql_query("SELECT * FROM resource_tracker_v4", conn)
-    except: df = pd.DataFrame()
-    conn.close()
-    return df
-
-def save_resource_entry(data, res_id=None):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    cols = ['employee_name', 'employee_id', 'dev_code', 'department', 'location', 
-            'reporting_manager', 'onboarding_date', 'experience_level', 'status', 
-            'po_details', 'remarks', 'effective_exit_date', 'backfill_status', 
-            'reason_for_leaving', 'hourly_rate', 'hardware_daily_cost']
-    vals = [str(data.get(k, '')) for k in cols]
-    
-    if res_id:
-        # Update existing
-        set_clause = ", ".join([f"{col}=?" for col in cols])
-        c.execute(f"UPDATE resource_tracker_v4 SET {set_clause} WHERE id=?", (*vals, res_id))
-        conn.commit(); conn.close()
-        return None
-    else:
-        # Create new
-        new_id = str(uuid.uuid4())[:8]
-        placeholders = ",".join(["?"] * (len(cols) + 1))
-        c.execute(f"INSERT INTO resource_tracker_v4 VALUES ({placeholders})", (new_id, *vals))
-        
-        # --- AUTO CREATE USER LOGIN ---
-        # Logic: username = empid_lowercase, password = auto-generated
-        emp_id = data.get('employee_id', 'unknown')
-        username = emp_id.lower().replace(" ", "")
-        temp_pass = generate_temp_password()
-        name = data.get('employee_name', 'New User')
-        role = "Team Member" 
-        img = f"https://ui-avatars.com/api/?name={name.replace(' ','+')}&background=random"
-        
-        # Insert user only if username doesn't exist
-        c.execute("SELECT count(*) FROM users WHERE username=?", (username,))
-        if c.fetchone()[0] == 0:
-            c.execute("INSERT INTO users VALUES (?,?,?,?,?,?,?)", 
-                      (username, temp_pass, role, name, emp_id, img, str(date.today())))
-            conn.commit(); conn.close()
-            return f"User: {username} | Pass: {temp_pass}"
-        
-        conn.commit(); conn.close()
-        return None
-
-def import_resource_csv(file):
-    try:
-        df = pd.read_csv(file)
-        cols = ['employee_name', 'employee_id', 'dev_code', 'department', 'location', 
-                'reporting_manager', 'onboarding_date', 'experience_level', 'status', 
-                'po_details', 'remarks', 'effective_exit_date', 'backfill_status', 
-                'reason_for_leaving', 'hourly_rate', 'hardware_daily_cost']
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        for _, row in df.iterrows():
-            new_id = str(uuid.uuid4())[:8]
-            vals = [str(row.get(k, '')) for k in cols]
-            placeholders = ",".join(["?"] * (len(cols) + 1))
-            c.execute(f"INSERT INTO resource_tracker_v4 VALUES ({placeholders})", (new_id, *vals))
-        conn.commit()
-        conn.close()
-        return True
-    except: return False
+# Columns each list screen actually shows; readers fetch only these
+KPI_BOARD_COLS = ['id', 'task_name', 'description_of_activity', 'name_activity_pilot',
+                  'commitment_date_to_customer', 'status', 'otd_customer', 'ftr_internal']
+KPI_MEMBER_COLS = ['id', 'task_name', 'commitment_date_to_customer', 'status', 'actual_delivery_date']
+RESOURCE_LIST_COLS = ['id', 'employee_name', 'employee_id', 'dev_code', 'department', 'status',
+                      'location', 'hourly_rate', 'hardware_daily_cost']
+
+# --- IMPORT JOB WIDGETS ---
+def import_widget(table, label, key):
+    """CSV uploader that runs the import as a background job and shows its progress."""
+    up = st.file_uploader(label, type=['csv'], key=key)
+    if up:
+        # The uploader keeps the file across reruns; submit once per upload,
+        # unless the job was orphaned by a restart
+        prev = st.session_state.get(f"{key}_job")
+        if st.session_state.get(f"{key}_upload") != up.file_id or is_stale(get_job(prev) or {'status': 'failed'}):
+            st.session_state[f"{key}_upload"] = up.file_id
+            st.session_state[f"{key}_job"] = submit_import(table, up.name, up.getvalue(), st.session_state.get('user', ''))
+    job_id = st.session_state.get(f"{key}_job")
+    if job_id:
+        if st.session_state.get(f"{key}_seen") == job_id:
+            job = get_job(job_id)
+            if job and job['status'] == 'failed': st.error(f"Import failed: {job['error']}")
+            elif job: st.caption(f"Last import: {job['status']} | {job['rows_inserted'] or 0:,} inserted, {job['rows_updated'] or 0:,} updated, "
+                                 f"{job['rows_unchanged'] or 0:,} unchanged, {job['rows_rejected']:,} rejected")
+        else:
+            import_progress(job_id, key)
+    with st.expander("🕘 Import history"):
+        hist = list_jobs(table)
+        if hist.empty: st.caption("No imports yet.")
+        else: st.dataframe(hist[['submitted_at', 'file_name', 'status', 'rows_inserted', 'rows_updated', 'rows_unchanged',
+                                 'rows_rejected', 'submitted_by', 'error']],
+                           use_container_width=True, hide_index=True)
+
+@st.fragment(run_every=1)
+def import_progress(job_id, key):
+    job = get_job(job_id)
+    if not job: return
+    total = max(job['rows_total'], 1)
+    processed = job['rows_done'] + job['rows_rejected']
+    eta = eta_seconds(job)
+    st.progress(min(processed / total, 1.0),
+                text=f"{job['status'].title()}: {job['rows_done']:,} / {job['rows_total']:,} rows | "
+                     f"{job['rows_rejected']:,} rejected" + (f" | ETA {int(eta)}s" if eta is not None else ""))
+    if job['status'] in ('done', 'failed'):
+        # Stop polling and refresh the page data once
+        st.session_state[f"{key}_seen"] = job_id
+        st.rerun(scope="app")
 
 # --- PLOTLY HELPERS ---
 def get_analytics_chart(df):
@@ -427,6 +140,25 @@ def get_donut(df):
     return fig
 
 # ---------- AUTH ----------
+def start_session(user, img):
+    st.session_state.update({
+        'logged_in': True, 'user': user['username'], 'role': user['role'],
+        'name': user['name'], 'emp_id': user['emp_id'], 'user_id': int(user['user_id']),
+        'img': img, 'current_app': st.session_state.get('current_app', 'HOME')
+    })
+
+def restore_session():
+    """Logs in from a signed ?session= token after a browser refresh, if the user's password and role are unchanged."""
+    token = st.query_params.get("session")
+    user = read_token(token, session_secret()) if token else None
+    current = session_user(user['username']) if user else None
+    if current and current['stamp'] == user.get('stamp'): start_session(user, current['img'])
+    elif token: del st.query_params["session"]
+
+def end_session():
+    st.session_state.clear()
+    st.query_params.clear()
+
 def login_page():
     st.markdown("<br><br><br>", unsafe_allow_html=True)
     c1, c2, c3 = st.columns([1, 1, 1])
@@ -439,30 +171,28 @@ def login_page():
             p = st.text_input("Password", type="password").strip()
             
             if st.button("Secure Login", use_container_width=True, type="primary"):
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                
-                # UPDATED QUERY: Checks lowercase username matches lowercase input
-                c.execute("SELECT * FROM users WHERE LOWER(username)=? AND password=?", (u.lower(), p))
-                user_data = c.fetchone()
-                conn.close()
+                # Checks lowercase username matches lowercase input
+                user_data = authenticate(u, p)
                 
                 if user_data:
-                    st.session_state.update({
-                        'logged_in': True, 'user': user_data[0], 'role': user_data[2], 
-                        'name': user_data[3], 'emp_id': user_data[4],
-                        'img': user_data[5], 'current_app': 'HOME'
-                    })
+                    start_session(user_data, user_data['img'])
+                    st.query_params["session"] = issue_token(user_data, session_secret())
                     st.rerun()
                 else:
                     st.error("Invalid credentials.")
-                    
-            # DEBUGGING HELPER (Optional: Remove before deployment)
-            with st.expander("Debug: View Valid Users"):
-                conn = sqlite3.connect(DB_FILE)
-                debug_df = pd.read_sql("SELECT username, role, password FROM users", conn)
-                st.dataframe(debug_df)
-                conn.close()
+
+
+def my_alert_counts():
+    """(overdue, due_soon) for the signed-in user: the whole board for leads, own tasks for members."""
+    if st.session_state['role'] in ['Team Leader', 'Super Admin']: return alert_counts('all')
+    return alert_counts('pilot', st.session_state['user_id'])
+
+def alert_badges(overdue, due_soon):
+    parts = []
+    if overdue: parts.append(f":red-badge[🔴 {overdue} overdue]")
+    if due_soon: parts.append(f":orange-badge[🟠 {due_soon} due in {DUE_SOON_DAYS}d]")
+    if parts: st.markdown(" ".join(parts))
+
 # ---------- APP SECTIONS ----------
 def app_home():
     st.markdown(f"## Welcome, {st.session_state['name']}")
@@ -484,6 +214,7 @@ def app_home():
     with c1:
         with st.container(border=True):
             st.markdown("### 📊 **KPI System**"); st.caption("Manage OTD & FTR")
+            alert_badges(*my_alert_counts())
             if st.button("Launch KPI", use_container_width=True): st.session_state['current_app']='KPI'; st.rerun()
     with c2:
         with st.container(border=True):
@@ -498,8 +229,10 @@ def app_home():
                 st.button("Restricted", disabled=True, use_container_width=True)
 
 def parse_date(d):
-    if not d or d == 'None' or d == '': return None
-    try: return pd.to_datetime(d).date()
+    if d is None or pd.isna(d) or d == 'None' or d == '': return None
+    try:
+        d = pd.to_datetime(d)
+        return None if pd.isna(d) else d.date()
     except: return None
 
 # --- NEW APP SECTION: MY PROFILE ---
@@ -525,7 +258,7 @@ def app_my_profile():
                 # Layout
                 c_prof, c_info = st.columns([1, 3])
                 with c_prof:
-                    st.image(st.session_state.get('img'), width=150)
+                    st.markdown(f"<img src='{avatar_src(st.session_state.get('img'), st.session_state.get('name'))}' class='profile-img'>", unsafe_allow_html=True)
                     st.markdown(f"**{data['employee_name']}**")
                     st.caption(f"{data['department']} | {data['location']}")
                     if data['status'] == 'Active':
@@ -565,13 +298,7 @@ def app_my_profile():
                 
                 if st.button("Update Password", type="primary", use_container_width=True):
                     # Verify current password
-                    conn = sqlite3.connect(DB_FILE)
-                    cur = conn.cursor()
-                    cur.execute("SELECT password FROM users WHERE username=?", (st.session_state['user'],))
-                    db_pass = cur.fetchone()[0]
-                    conn.close()
-                    
-                    if curr_pass != db_pass:
+                    if not check_password(st.session_state['user'], curr_pass):
                         st.error("Current password incorrect.")
                     elif new_pass != conf_pass:
                         st.error("New passwords do not match.")
@@ -580,17 +307,20 @@ def app_my_profile():
                     else:
                         update_user_credentials(st.session_state['user'], new_password=new_pass)
                         st.success("Password updated successfully! Please login again.")
-                        st.session_state['logged_in'] = False # Force re-login
+                        end_session() # Force re-login
+                        st.session_state['logged_in'] = False
                         st.rerun()
 
         with c_photo:
             with st.container(border=True):
                 st.subheader("🖼️ Change Profile Photo")
                 st.write("Current URL:")
-                st.caption(st.session_state.get('img'))
-                new_img = st.text_input("New Image URL", placeholder="https://example.com/my-photo.png")
+                st.caption(st.session_state.get('img') or "Initials (generated)")
+                new_img = st.text_input("New Image URL", placeholder="https://example.com/my-photo.png",
+                                        help="Fetched once and cached on the server; leave empty and use the button below for initials.")
                 
-                if st.button("Update Photo", use_container_width=True):
+                p1, p2 = st.columns(2)
+                if p1.button("Update Photo", use_container_width=True):
                     if new_img:
                         update_user_credentials(st.session_state['user'], new_img=new_img)
                         st.session_state['img'] = new_img # Update session immediately
@@ -598,6 +328,10 @@ def app_my_profile():
                         st.rerun()
                     else:
                         st.error("Please enter a valid URL.")
+                if p2.button("Use Initials", use_container_width=True):
+                    update_user_credentials(st.session_state['user'], new_img='')
+                    st.session_state['img'] = ''
+                    st.rerun()
 
 
 # --- ADMIN APP ---
@@ -611,7 +345,7 @@ def app_admin():
     if 'admin_mode' not in st.session_state: st.session_state['admin_mode'] = 'TABLE'
     if 'admin_edit_user' not in st.session_state: st.session_state['admin_edit_user'] = None
 
-    t1, t2 = st.tabs(["👥 User Management", "📥 Import/Export"])
+    t1, t2, t3, t4 = st.tabs(["👥 User Management", "📥 Import/Export", "💾 Backups", "🩺 Diagnostics"])
 
     with t1:
         if st.session_state['admin_mode'] == 'TABLE':
@@ -661,25 +395,28 @@ def app_admin():
                 with f2:
                     emp_id = st.text_input("Employee ID Link", value=u_data.get('emp_id',''))
                     if not is_edit:
-                        temp_pass = generate_temp_password()
+                        # Generated once per form, not on every rerun
+                        temp_pass = st.session_state.setdefault('admin_temp_pass', generate_temp_password())
                         password = st.text_input("Password (Auto-Generated Temp)", value=temp_pass)
                         st.info(f"📝 Note this temporary password: **{password}**")
                     else:
-                        password = st.text_input("Reset Password (Leave as is to keep current)", value=u_data.get('password',''))
-                    img = st.text_input("Profile Image URL", value=u_data.get('img','https://cdn-icons-png.flaticon.com/512/3135/3135715.png'))
+                        password = st.text_input("Reset Password (Leave empty to keep current)", value="", type="password")
+                    img = st.text_input("Profile Image URL", value=u_data.get('img') or '', help="Leave empty for a generated initials avatar")
 
                 st.markdown("<br>", unsafe_allow_html=True)
                 b1, b2 = st.columns(2)
                 with b1:
                     if st.button("Cancel", use_container_width=True):
+                        st.session_state.pop('admin_temp_pass', None)
                         st.session_state['admin_mode'] = 'TABLE'; st.rerun()
                 with b2:
                     if st.button("💾 Save User", type="primary", use_container_width=True):
-                        if not username or not password:
+                        if not username or (not password and not is_edit):
                             st.error("Username and Password are required.")
                         else:
                             payload = {'username': username, 'password': password, 'role': role, 'name': name, 'emp_id': emp_id, 'img': img}
                             save_user_entry(payload, is_update=is_edit)
+                            st.session_state.pop('admin_temp_pass', None)
                             st.success("User saved successfully!")
                             st.session_state['admin_mode'] = 'TABLE'
                             st.rerun()
@@ -688,14 +425,106 @@ def app_admin():
         st.subheader("Bulk Operations")
         c_imp, c_exp = st.columns(2)
         with c_imp:
-            up_users = st.file_uploader("Import Users (CSV)", type=['csv'])
-            if up_users:
-                if import_users_csv(up_users): st.success("Users Imported!"); st.rerun()
+            import_widget('users', "Import Users (CSV)", "user_csv_up")
         with c_exp:
             df_exp = get_all_users()
             st.download_button("Download User Database (CSV)", data=df_exp.to_csv(index=False).encode('utf-8'), file_name="portal_users.csv", mime="text/csv", use_container_width=True)
 
+    with t3:
+        st.subheader("Database Snapshots")
+        st.caption(f"Online snapshots every {backup.BACKUP_INTERVAL_HOURS:g}h into `{backup.BACKUP_DIR}`, newest {backup.BACKUP_KEEP} kept. "
+                   "Restore with `python cli.py restore <file> --yes`.")
+        if st.button("📸 Back Up Now", type="primary"):
+            bar = st.progress(0.0, text="Copying pages...")
+            try:
+                r = backup.backup(progress=lambda done, total: bar.progress(done / max(total, 1), text=f"{done:,} / {total:,} pages"))
+                backup.prune()
+                st.success(f"{r['file']}: {r['pages']:,} pages in {r['copy_seconds']:.2f}s ({r['pages_per_s']:,} pages/s), "
+                           f"{r['file_bytes'] / 2**20:.1f} MiB compressed" + (f", with {r['shards']} shard files" if r['shards'] else ""))
+            except Exception as e: st.error(f"Backup failed: {e}")
+        snaps = backup.list_backups()
+        if snaps.empty: st.info("No snapshots yet.")
+        else: st.dataframe(snaps, use_container_width=True, hide_index=True)
+        runs = scheduler.job_status()
+        if not runs.empty:
+            st.markdown("##### Scheduled Jobs")
+            st.dataframe(runs, use_container_width=True, hide_index=True)
+
+    with t4:
+        st.subheader("Database Health")
+        hours = maintenance.MAINTENANCE_HOURS
+        st.caption(f"PRAGMA optimize, WAL checkpoint and incremental vacuum every {maintenance.MAINTENANCE_INTERVAL_HOURS:g}h"
+                   + (f", between {hours[0]}:00 and {hours[1]}:00" if hours else "") + ". Each run records size and row counts.")
+        if "maintenance" not in scheduler.JOBS:
+            st.info("Scheduled maintenance is disabled (PORTAL_MAINTENANCE_INTERVAL_HOURS=0); run `python cli.py maintain` from cron.")
+        else:
+            pending = [] if scheduler.in_window(hours, datetime.now()) else maintenance.needs_full_vacuum()
+            if pending:
+                st.warning(f"One-off full VACUUM pending for: {', '.join(pending)}. It locks the file while it runs, "
+                           "so a run from here skips it; the scheduled run inside the window does it.")
+            if st.button("🧹 Run Maintenance Now"):
+                with st.spinner("Optimizing, checkpointing and vacuuming..."):
+                    report = scheduler.run_pending(["maintenance"], force=True).get("maintenance")
+                if report is None: st.warning("Maintenance is already running.")
+                elif isinstance(report, Exception): st.error(f"Maintenance failed: {report}")
+                else: st.success(report if isinstance(report, str) else "  \n".join(f"**{db}**: {line}" for db, line in report.items()))
+        snap = maintenance.snapshot()
+        if snap.empty: st.info("Diagnostics cover the SQLite backend.")
+        else:
+            sizes = snap.pivot(index='db', columns='metric', values='value')
+            k1, k2, k3 = st.columns(3)
+            k1.metric("Database Size", f"{sizes['file_bytes'].sum() / 2**20:.1f} MiB")
+            k2.metric("WAL Size", f"{sizes['wal_bytes'].sum() / 2**20:.1f} MiB")
+            k3.metric("Free Pages", f"{int(sizes['free_pages'].sum()):,}",
+                      help=f"{sizes['free_pages'].sum() / max(sizes['pages'].sum(), 1):.1%} of all pages; reclaimed by incremental vacuum")
+            hist = maintenance.history(['file_bytes', 'free_pages'])
+            if not hist.empty:
+                hist['value'] = hist['value'].where(hist['metric'] != 'file_bytes', hist['value'] / 2**20)
+                hist['metric'] = hist['metric'].map({'file_bytes': "Size (MiB)", 'free_pages': "Free pages"})
+                fig = px.line(hist, x='taken_at', y='value', color='db', facet_row='metric', markers=True)
+                fig.update_yaxes(matches=None, title=None)
+                fig.update_layout(height=360, margin=dict(l=0,r=0,t=20,b=0), xaxis_title=None, legend_title=None)
+                st.plotly_chart(fig, use_container_width=True)
+            last = maintenance.latest()
+            counts = last[last['metric'].str.startswith('rows:')]
+            if counts.empty: st.info("No maintenance run recorded yet.")
+            else:
+                st.markdown(f"##### Row Counts ({last['taken_at'].iloc[0]})")
+                counts = counts.assign(table=counts['metric'].str[5:], rows=counts['value'].astype(int))
+                st.dataframe(counts.pivot(index='table', columns='db', values='rows').fillna(0).astype(int), use_container_width=True)
+
 # --- FULL KPI APP ---
+CYCLE_LABELS = {"Lead time (receipt → delivery)": 'lead_time', "Time in Inprogress": 'in_progress', "Time in Hold": 'hold'}
+
+def cycle_time_tab():
+    c1, c2 = st.columns(2)
+    per = c1.radio("Per", ["Pilot", "Project Lead"], horizontal=True, key="cycle_per")
+    label = c2.selectbox("Metric", list(CYCLE_LABELS), key="cycle_metric")
+    metric = CYCLE_LABELS[label]
+    overall = cycle_time_stats('all')
+    overall = overall[overall['metric'] == metric]
+    if overall.empty:
+        st.info("Nothing recorded yet: durations accrue as tasks change status."); return
+    o = overall.iloc[0]
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Tasks" if metric == 'lead_time' else "Stints", int(o['n']))
+    k2.metric("Mean (days)", f"{o['mean_days']:.1f}")
+    k3.metric("Median (days)", int(o['p50_days']))
+    k4.metric("P90 (days)", int(o['p90_days']))
+    stats = cycle_time_stats('pilot' if per == "Pilot" else 'lead')
+    stats = stats[stats['metric'] == metric].copy()
+    if per == "Pilot":
+        p_df = get_pilots()
+        stats['key'] = stats['key'].map({str(u): n for u, n in zip(p_df['user_id'], p_df['name'])}).fillna(stats['key'])
+    stats = stats.sort_values('mean_days', ascending=False)
+    fig = px.bar(stats, x='key', y=['mean_days', 'p90_days'], barmode='group')
+    fig.update_layout(height=280, margin=dict(l=0,r=0,t=10,b=0), xaxis_title=None, yaxis_title="Days", legend_title=None)
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(stats[['key', 'n', 'mean_days', 'p50_days', 'p90_days', 'total_days']], use_container_width=True, hide_index=True,
+                 column_config={'key': per, 'n': "Samples", 'mean_days': st.column_config.NumberColumn("Mean", format="%.1f"),
+                                'p50_days': "P50", 'p90_days': "P90", 'total_days': st.column_config.NumberColumn("Total Days", format="%.0f")})
+    st.caption("Percentiles are in whole days. Lead time counts a task's first completion; stints end when the task leaves the status.")
+
 def app_kpi():
     c1, c2 = st.columns([1, 6])
     with c1:
@@ -706,7 +535,7 @@ def app_kpi():
     is_lead = st.session_state['role'] in ["Team Leader", "Super Admin"]
     
     if is_lead:
-        df = get_kpi_data()
+        df = get_kpi_data(columns=KPI_BOARD_COLS)
         if 'edit_kpi_id' not in st.session_state: st.session_state['edit_kpi_id'] = None
         if st.session_state['edit_kpi_id']:
             with st.container(border=True):
@@ -714,20 +543,40 @@ def app_kpi():
                 st.subheader("Create/Edit Task")
                 default_data = {}
                 if not is_new:
-                    task_row = df[df['id'] == st.session_state['edit_kpi_id']]
+                    task_row = get_task(st.session_state['edit_kpi_id'])
                     if not task_row.empty: default_data = task_row.iloc[0].to_dict()
 
+                # Pilot load over this task's window (its saved dates, or the next 7 days for a new task)
+                p_df = get_pilots()
+                pilot_val = default_data.get("pilot_user_id")
+                win_start = parse_date(default_data.get("start_date")) or date.today()
+                win_end = max(parse_date(default_data.get("commitment_date_to_customer")) or win_start + timedelta(days=7), win_start)
+                loads = {}
+                if not p_df.empty:
+                    wl = workload_index().load(p_df, win_start, win_end)
+                    loads = dict(zip(wl['user_id'], wl['open_tasks']))
+                    # Don't count the task being edited against its own pilot
+                    if not is_new and default_data.get("status") in OPEN_STATUSES and pilot_val in loads: loads[pilot_val] -= 1
+                    least = sorted(loads.items(), key=lambda kv: kv[1])[:3]
+                    names = dict(zip(p_df['user_id'], p_df['name']))
+                    st.caption(f"Least loaded {win_start:%d %b} – {win_end:%d %b}: " + ", ".join(f"{names[u]} ({n} open)" for u, n in least))
+                    if loads.get(pilot_val, 0) >= PILOT_CAPACITY:
+                        st.warning(f"{names.get(pilot_val, 'This pilot')} already has {loads[pilot_val]} open tasks in this window (capacity {PILOT_CAPACITY}).")
+
                 with st.form("kpi_editor_form"):
                     c1, c2, c3 = st.columns(3)
-                    u_df = get_all_users()
-                    pilots = u_df[u_df['role'] == "Team Member"]['name'].tolist()
-                    if not pilots: pilots = ["Generic Pilot"]
-                    
+                    pilot_names = dict(zip(p_df['user_id'], p_df['name']))
+                    if not pilot_names: pilot_names = {None: "Generic Pilot"}
+                    pilot_ids = list(pilot_names)
+
+                    def pilot_label(uid):
+                        if uid not in loads: return pilot_names[uid]
+                        return f"{pilot_names[uid]} · {loads[uid]} open" + (" ⚠️" if loads[uid] >= PILOT_CAPACITY else "")
+
                     with c1:
                         tname = st.text_input("Task Name", value=default_data.get("task_name", ""))
-                        pilot_val = default_data.get("name_activity_pilot")
-                        p_idx = pilots.index(pilot_val) if pilot_val in pilots else 0
-                        pilot = st.selectbox("Assign To", pilots, index=p_idx)
+                        p_idx = pilot_ids.index(pilot_val) if pilot_val in pilot_ids else 0
+                        pilot_uid = st.selectbox("Assign To", pilot_ids, index=p_idx, format_func=pilot_label)
                         otd_curr = default_data.get("otd_customer", "N/A")
                         st.text_input("OTD Status (Computed)", value=otd_curr, disabled=True)
                     with c2:
@@ -752,11 +601,11 @@ def app_kpi():
                     
                     if st.form_submit_button("💾 Save Task", type="primary", use_container_width=True):
                         payload = {
-                            "task_name": tname, "name_activity_pilot": pilot, "status": status,
+                            "task_name": tname, "name_activity_pilot": pilot_names[pilot_uid], "pilot_user_id": pilot_uid, "status": status,
                             "start_date": str(start_d), "commitment_date_to_customer": str(comm_d),
                             "actual_delivery_date": str(act_d), "description_of_activity": desc,
                             "reference_part_number": ref_part, "ftr_internal": ftr, "customer_remarks": rem,
-                            "date_of_receipt": str(date.today()), "activity_type": "Standard"
+                            "date_of_receipt": default_data.get("date_of_receipt") or str(date.today()), "activity_type": default_data.get("activity_type") or "Standard"
                         }
                         save_kpi_task(payload, None if is_new else st.session_state['edit_kpi_id'])
                         st.success("Saved successfully!")
@@ -773,63 +622,94 @@ def app_kpi():
             m3.metric("On Hold", len(df[df['status']=='Hold']) if not df.empty else 0)
             m4.metric("Completed", len(df[df['status']=='Completed']) if not df.empty else 0)
             
-            tb1, tb2 = st.columns([3, 1])
-            with tb1:
-                with st.expander("📂 CSV Import/Export"):
-                    up = st.file_uploader("Import CSV", type=['csv'])
-                    if up: 
-                        if import_kpi_csv(up): st.success("Imported!"); st.rerun()
-                    if not df.empty:
-                        st.download_button("Export CSV", data=df.to_csv(index=False).encode('utf-8'), file_name="kpi.csv", mime="text/csv")
-            with tb2:
-                if st.button("➕ New Task", type="primary", use_container_width=True):
-                    st.session_state['edit_kpi_id'] = "NEW"; st.rerun()
-
-            c_chart, c_donut = st.columns([2, 1])
-            if not df.empty:
-                with c_chart: st.plotly_chart(get_analytics_chart(df), use_container_width=True)
-                with c_donut: st.plotly_chart(get_donut(df), use_container_width=True)
+            tab_board, tab_cycle = st.tabs(["📋 Task Board", "⏱️ Cycle Time"])
+            with tab_board:
+                tb1, tb2 = st.columns([3, 1])
+                with tb1:
+                    with st.expander("📂 CSV Import/Export"):
+                        import_widget('tasks', "Import CSV", "kpi_csv_up")
+                        if not df.empty:
+                            # Full rows are only read when the export is actually clicked
+                            st.download_button("Export CSV", data=lambda: get_kpi_data(snapshot=True).to_csv(index=False).encode('utf-8'), file_name="kpi.csv", mime="text/csv")
+                    with st.expander("🗄️ Archived Tasks"):
+                        st.caption(f"Completed/Cancelled tasks older than {ARCHIVE_AFTER_DAYS} days are moved here by the archive job (cli.py archive).")
+                        arc_q = st.text_input("Search archive (task name / ref part #)", key="kpi_archive_q")
+                        arc_df = search_archive(arc_q)
+                        if arc_df.empty: st.info("No archived tasks match.")
+                        else:
+                            st.dataframe(arc_df, use_container_width=True, hide_index=True)
+                            st.download_button("Export Archive Results", data=arc_df.to_csv(index=False).encode('utf-8'), file_name="kpi_archive.csv", mime="text/csv")
+                    with st.expander("👥 Team Workload"):
+                        p_df = get_pilots()
+                        if p_df.empty: st.info("No pilots yet.")
+                        else:
+                            wi = workload_index()
+                            wl = wi.load(p_df, date.today(), date.today() + timedelta(days=30))
+                            st.caption(f"Open tasks overlapping the next 30 days; ⚠️ at {PILOT_CAPACITY} or more.")
+                            st.dataframe(wl[['name', 'open_tasks', 'overloaded']], use_container_width=True, hide_index=True,
+                                         column_config={'name': "Pilot", 'open_tasks': "Open Tasks", 'overloaded': "⚠️ Overloaded"})
+                            wl_pilot = st.selectbox("Pilot timeline", wl['user_id'], format_func=dict(zip(wl['user_id'], wl['name'])).get, key="kpi_wl_pilot")
+                            tl = wi.timeline(wl_pilot, date.today() - timedelta(days=60), date.today() + timedelta(days=60))
+                            fig = px.area(tl, x='day', y='open_tasks')
+                            fig.add_hline(y=PILOT_CAPACITY, line_dash="dot", line_color="#ef4444")
+                            fig.update_layout(height=220, margin=dict(l=0,r=0,t=10,b=0), xaxis_title=None, yaxis_title="Open tasks")
+                            st.plotly_chart(fig, use_container_width=True)
+                with tb2:
+                    if st.button("➕ New Task", type="primary", use_container_width=True):
+                        st.session_state['edit_kpi_id'] = "NEW"; st.rerun()
+
+                c_chart, c_donut = st.columns([2, 1])
+                if not df.empty:
+                    with c_chart: st.plotly_chart(get_analytics_chart(df), use_container_width=True)
+                    with c_donut: st.plotly_chart(get_donut(df), use_container_width=True)
             
-            st.markdown("#### Active Tasks")
-            if not df.empty:
-                # --- NEW GRID LAYOUT ---
-                cols = st.columns(2)
-                for idx, row in df.iterrows():
-                    with cols[idx % 2]: # Alternates between col 0 and 1
-                        with st.container(border=True):
-                            c_main, c_meta, c_btn = st.columns([4, 2, 1])
-                            with c_main:
-                                st.markdown(f"**{row['task_name']}**")
-                                st.caption(row.get('description_of_activity',''))
-                            with c_meta:
-                                st.caption(f"👤 {row.get('name_activity_pilot','-')}")
-                                st.caption(f"📅 Due: {row.get('commitment_date_to_customer','-')}")
-                                st_color = "black"
-                                if row['status'] == "Completed": st_color = "#10b981"
-                                elif row['status'] == "Cancelled": st_color = "#ef4444"
-                                elif row['status'] == "Hold": st_color = "#f59e0b"
-                                else: st_color = "#3b82f6"
-                                st.markdown(f"<span style='color:{st_color}; font-weight:bold;'>{row['status']}</span> | OTD: {row.get('otd_customer','-')}", unsafe_allow_html=True)
-                            with c_btn:
-                                if st.button("Edit", key=f"kpi_edit_{row['id']}", use_container_width=True):
-                                    st.session_state['edit_kpi_id'] = row['id']; st.rerun()
-            else: st.info("No tasks found.")
+                st.markdown("#### Active Tasks")
+                if not df.empty:
+                    alert_kinds = task_alert_kinds()
+                    # --- NEW GRID LAYOUT ---
+                    cols = st.columns(2)
+                    for idx, row in df.iterrows():
+                        with cols[idx % 2]: # Alternates between col 0 and 1
+                            with st.container(border=True):
+                                c_main, c_meta, c_btn = st.columns([4, 2, 1])
+                                with c_main:
+                                    st.markdown(f"**{row['task_name']}**")
+                                    st.caption(row.get('description_of_activity',''))
+                                with c_meta:
+                                    st.caption(f"👤 {row.get('name_activity_pilot','-')}")
+                                    st.caption(f"📅 Due: {row.get('commitment_date_to_customer','-')}")
+                                    alert = alert_kinds.get(row['id'])
+                                    if alert: st.markdown(":red-badge[Overdue]" if alert == 'overdue' else ":orange-badge[Due soon]")
+                                    st_color = "black"
+                                    if row['status'] == "Completed": st_color = "#10b981"
+                                    elif row['status'] == "Cancelled": st_color = "#ef4444"
+                                    elif row['status'] == "Hold": st_color = "#f59e0b"
+                                    else: st_color = "#3b82f6"
+                                    st.markdown(f"<span style='color:{st_color}; font-weight:bold;'>{row['status']}</span> | OTD: {row.get('otd_customer','-')}", unsafe_allow_html=True)
+                                with c_btn:
+                                    if st.button("Edit", key=f"kpi_edit_{row['id']}", use_container_width=True):
+                                        st.session_state['edit_kpi_id'] = row['id']; st.rerun()
+                else: st.info("No tasks found.")
+            with tab_cycle:
+                cycle_time_tab()
 
     else:
-        df = get_kpi_data()
-        my_tasks = df[df['name_activity_pilot'] == st.session_state['name']]
+        my_tasks = get_pilot_tasks(st.session_state['user_id'], columns=KPI_MEMBER_COLS)
         st.metric("My Pending Tasks", len(my_tasks[my_tasks['status']!='Completed']) if not my_tasks.empty else 0)
         if not my_tasks.empty:
             # --- NEW GRID LAYOUT FOR MEMBER ---
             cols = st.columns(2)
             # Reset index to iterate properly for modulo
             my_tasks = my_tasks.reset_index(drop=True)
+            alert_kinds = task_alert_kinds()
             
             for idx, row in my_tasks.iterrows():
                 with cols[idx % 2]:
                     with st.container(border=True):
                         st.markdown(f"**{row['task_name']}**")
                         st.write(f"Due: {row.get('commitment_date_to_customer','-')}")
+                        alert = alert_kinds.get(row['id'])
+                        if alert: st.markdown(":red-badge[Overdue]" if alert == 'overdue' else ":orange-badge[Due soon]")
                         with st.form(key=f"my_task_{row['id']}"):
                             c1, c2 = st.columns(2)
                             curr_stat = row.get('status', 'Inprogress')
@@ -837,9 +717,7 @@ def app_kpi():
                             ns = c1.selectbox("Status", ["Inprogress", "Completed", "Hold"], index=idx_stat)
                             ad = c2.date_input("Actual Delivery", value=parse_date(row.get('actual_delivery_date')) or date.today())
                             if st.form_submit_button("Update", type="primary"):
-                                conn = sqlite3.connect(DB_FILE)
-                                conn.execute("UPDATE tasks_v2 SET status=?, actual_delivery_date=? WHERE id=?", (ns, str(ad), row['id']))
-                                conn.commit(); conn.close()
+                                update_task_status(row['id'], ns, str(ad))
                                 st.success("Updated!"); st.rerun()
 
 # --- TRAINING APP ---
@@ -858,9 +736,7 @@ def app_training():
             with st.expander("📂 Import / Export", expanded=True):
                 col_imp, col_exp = st.columns(2)
                 with col_imp:
-                    up_train = st.file_uploader("Upload CSV", type=['csv'], key="train_csv_up")
-                    if up_train:
-                        if import_training_csv(up_train): st.success("Trainings Imported!"); st.rerun()
+                    import_widget('trainings', "Upload CSV", "train_csv_up")
                 with col_exp:
                     if not df.empty:
                         csv = df.to_csv(index=False).encode('utf-8')
@@ -915,33 +791,31 @@ def app_training():
                     add_training(tt, td, tl, "All", tm, st.session_state['name'])
                     st.success("Published."); st.rerun()
     else:
-        df = get_trainings(user_name=st.session_state['name'])
+        df = get_trainings(user_id=st.session_state['user_id'])
         if not df.empty:
             comp = len(df[df['status']=='Completed'])
             st.progress(comp/len(df), text=f"Progress: {int((comp/len(df))*100)}%")
         st.markdown("#### Modules")
         if df.empty: st.info("No training found.")
         else:
-            # --- NEW GRID LAYOUT FOR TRAINING ---
-            cols = st.columns(2)
-            # Reset index just in case
-            df = df.reset_index(drop=True)
-            
-            for idx, row in df.iterrows():
-                with cols[idx % 2]:
-                    with st.container(border=True):
-                        c1, c2 = st.columns([3, 1])
-                        with c1:
-                            st.markdown(f"**{row['title']}**")
-                            st.caption(row['description'])
-                            st.markdown(f"[{row['link']}]({row['link']})")
-                        with c2:
-                            c_stat = row['status']
-                            n_stat = st.selectbox("Status", ["Not Started", "In Progress", "Completed"], 
-                                                  index=["Not Started", "In Progress", "Completed"].index(c_stat), 
-                                                  key=f"tr_stat_{row['id']}", label_visibility="collapsed")
-                            if n_stat != c_stat:
-                                update_training_status(st.session_state['name'], row['id'], n_stat); st.rerun()
+            # One virtualized grid; edits stay client-side until Save, then go out as one batch
+            grid = df[['id', 'title', 'description', 'link', 'status']].reset_index(drop=True)
+            with st.form("training_status_form", border=False):
+                edited = st.data_editor(
+                    grid, use_container_width=True, hide_index=True, key="tr_status_grid",
+                    disabled=['id', 'title', 'description', 'link'],
+                    column_config={
+                        "id": None,
+                        "title": st.column_config.TextColumn("Module"),
+                        "description": st.column_config.TextColumn("Description"),
+                        "link": st.column_config.LinkColumn("Link"),
+                        "status": st.column_config.SelectboxColumn("Status", options=["Not Started", "In Progress", "Completed"], required=True),
+                    })
+                if st.form_submit_button("💾 Save Progress", type="primary"):
+                    changed = edited['status'] != grid['status']
+                    update_training_statuses(st.session_state['user_id'], dict(zip(edited.loc[changed, 'id'], edited.loc[changed, 'status'])),
+                                             st.session_state['name'])
+                    st.success(f"Updated {int(changed.sum())} modules."); st.rerun()
 
 # --- RESOURCE TRACKER APP ---
 def app_resource():
@@ -959,17 +833,15 @@ def app_resource():
     if 'res_view_mode' not in st.session_state: st.session_state['res_view_mode'] = 'LIST' 
 
     if st.session_state['res_view_mode'] == 'LIST':
+        df = get_resource_list(columns=RESOURCE_LIST_COLS)
         with st.expander("📂 Import / Export", expanded=False):
             rc1, rc2 = st.columns(2)
             with rc1:
-                up_res = st.file_uploader("Import Resource CSV", type=['csv'], key="res_csv_up")
-                if up_res:
-                    if import_resource_csv(up_res): st.success("Resources Imported!"); st.rerun()
+                import_widget('resources', "Import Resource CSV", "res_csv_up")
             with rc2:
-                df_all = get_resource_list()
-                if not df_all.empty:
-                    csv_res = df_all.to_csv(index=False).encode('utf-8')
-                    st.download_button("Download Data CSV", data=csv_res, file_name="resources.csv", mime="text/csv", use_container_width=True)
+                if not df.empty:
+                    st.download_button("Download Data CSV", data=lambda: get_resource_list(snapshot=True).to_csv(index=False).encode('utf-8'),
+                                       file_name="resources.csv", mime="text/csv", use_container_width=True)
                 else:
                     st.info("No data to export.")
 
@@ -982,6 +854,60 @@ def app_resource():
             with fc3:
                 stat_filter = st.multiselect("Filter Status", ["Active", "Inactive", "Yet to start"])
 
+        with st.expander("📈 Headcount & Attrition", expanded=False):
+            hc1, hc2 = st.columns([1, 3])
+            with hc1:
+                breakdown = st.selectbox("Breakdown", ["All", "Department", "Location"])
+                years = st.number_input("Years shown", min_value=1, max_value=20, value=3)
+            tl = headcount_timeline(None if breakdown == "All" else breakdown.lower())
+            if tl.empty:
+                st.info("No onboarding dates recorded yet.")
+            else:
+                tl = tl[tl['month'] >= tl['month'].max() - pd.DateOffset(years=int(years))]
+                latest = tl[tl['month'] == tl['month'].max()]
+                with hc2:
+                    m1, m2, m3, m4, m5 = st.columns(5)
+                    m1.metric("Headcount", int(latest['headcount'].sum()))
+                    m2.metric("Joiners (month)", int(latest['joiners'].sum()))
+                    m3.metric("Leavers (month)", int(latest['leavers'].sum()))
+                    m4.metric("Leavers (12 mo)", int(tl[tl['month'] > tl['month'].max() - pd.DateOffset(years=1)]['leavers'].sum()))
+                    m5.metric("Open Backfills", int(latest['open_backfills'].sum()))
+                fig = px.line(tl, x='month', y='headcount', color='group', markers=True)
+                fig.update_layout(height=300, margin=dict(l=0,r=0,t=10,b=0), xaxis_title=None, yaxis_title="Active headcount")
+                st.plotly_chart(fig, use_container_width=True)
+                flows = tl.groupby('month', as_index=False)[['joiners', 'leavers']].sum()
+                fig = px.bar(flows, x='month', y=['joiners', 'leavers'], barmode='group',
+                             color_discrete_map={'joiners': '#10b981', 'leavers': '#ef4444'})
+                fig.update_layout(height=240, margin=dict(l=0,r=0,t=10,b=0), xaxis_title=None, yaxis_title=None, legend_title=None)
+                st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(tl.sort_values('month', ascending=False), use_container_width=True, hide_index=True,
+                             column_config={'month': st.column_config.DateColumn("Month", format="MMM YYYY"),
+                                            'attrition_pct': st.column_config.NumberColumn("Attrition %", format="%.1f")})
+
+        with st.expander("💰 Cost per Task", expanded=False):
+            cc1, cc2 = st.columns([1, 3])
+            with cc1:
+                cost_group = st.selectbox("Group by", ["Project Lead", "Customer Manager", "Pilot"], key="cost_group")
+            by = {"Project Lead": 'project_lead', "Customer Manager": 'customer_manager_name', "Pilot": 'name_activity_pilot'}[cost_group]
+            tc = task_costs()
+            if tc.empty:
+                st.info("No tasks yet.")
+            else:
+                with cc2:
+                    k1, k2, k3 = st.columns(3)
+                    k1.metric("Total Cost", f"{tc['cost'].sum():,.0f}")
+                    k2.metric("Task-days", f"{int(tc['work_days'].sum()):,}")
+                    k3.metric("Unpriced Tasks", int((~tc['priced']).sum()), help="Pilot has no resource row with rates")
+                st.caption(f"Business days from start to delivery (open tasks to today) × (hourly rate × {HOURS_PER_DAY:g}h + hardware per day).")
+                mc = monthly_costs(by)
+                fig = px.bar(mc, x='month', y='cost', color='group')
+                fig.update_layout(height=280, margin=dict(l=0,r=0,t=10,b=0), xaxis_title=None, yaxis_title="Cost", legend_title=None)
+                st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(cost_by(by), use_container_width=True, hide_index=True,
+                             column_config={'group': cost_group, 'cost': st.column_config.NumberColumn("Cost", format="%.0f")})
+                st.dataframe(tc.nlargest(50, 'cost')[['task_name', 'name_activity_pilot', 'project_lead', 'status', 'work_days', 'daily_rate', 'cost']],
+                             use_container_width=True, hide_index=True)
+
         col_act, col_add = st.columns([5, 1])
         with col_act:
             st.markdown("#### Resource List")
@@ -991,19 +917,20 @@ def app_resource():
                 st.session_state['res_view_mode'] = 'FORM'
                 st.rerun()
         
-        df = get_resource_list()
-        
         if not df.empty:
             if search_query:
-                df = df[df.apply(lambda row: search_query.lower() in str(row.values).lower(), axis=1)]
+                q = search_query.lower()
+                hit = pd.Series(False, index=df.index)
+                for col in ['employee_name', 'employee_id', 'dev_code', 'department', 'status', 'location']:
+                    hit |= df[col].astype(str).str.lower().str.contains(q, regex=False)
+                df = df[hit]
             if dept_filter:
                 df = df[df['department'].isin(dept_filter)]
             if stat_filter:
                 df = df[df['status'].isin(stat_filter)]
             
-            df['hourly_rate'] = pd.to_numeric(df['hourly_rate'], errors='coerce').fillna(0)
-            df['hardware_daily_cost'] = pd.to_numeric(df['hardware_daily_cost'], errors='coerce').fillna(0)
-            df['Daily_Labor_Cost_$'] = df['hourly_rate'] * 8
+            df = df.copy()
+            df['Daily_Labor_Cost_$'] = df['hourly_rate'] * HOURS_PER_DAY
             df['Total_Daily_Bill_$'] = df['Daily_Labor_Cost_$'] + df['hardware_daily_cost']
             
             display_cols = ['employee_name', 'employee_id', 'department', 'status', 'location', 
@@ -1031,8 +958,7 @@ def app_resource():
         st.subheader("Edit Resource" if is_edit else "New Resource Onboarding")
         d = {}
         if is_edit:
-            df = get_resource_list()
-            row = df[df['id'] == res_id]
+            row = get_resource(res_id)
             if not row.empty: d = row.iloc[0].to_dict()
 
         with st.container(border=True):
@@ -1068,8 +994,8 @@ def app_resource():
             with fin2:
                 hw_cost = st.number_input("Hardware Cost (Daily $)", min_value=0.0, value=float(d.get('hardware_daily_cost', 0.0)))
             with fin3:
-                lab_daily = hr_rate * 8
-                st.metric("Labor Daily (8h)", f"${lab_daily:,.2f}")
+                lab_daily = hr_rate * HOURS_PER_DAY
+                st.metric(f"Labor Daily ({HOURS_PER_DAY:g}h)", f"${lab_daily:,.2f}")
             with fin4:
                 tot_daily = lab_daily + hw_cost
                 st.metric("Total Daily Bill", f"${tot_daily:,.2f}")
@@ -1125,16 +1051,18 @@ def app_resource():
 # ---------- MAIN CONTROLLER ----------
 def main():
     init_db()
+    scheduler.start()
     if 'logged_in' not in st.session_state:
         st.session_state['logged_in'] = False
         st.session_state['current_app'] = 'HOME'
+        restore_session()
 
     if st.session_state['logged_in']:
         with st.sidebar:
-            img_url = st.session_state.get('img', '')
-            if img_url: st.markdown(f"<img src='{img_url}' class='profile-img'>", unsafe_allow_html=True)
+            st.markdown(f"<img src='{avatar_src(st.session_state.get('img'), st.session_state.get('name'))}' class='profile-img'>", unsafe_allow_html=True)
             st.markdown(f"<h3 style='text-align:center;'>{st.session_state.get('name','')}</h3>", unsafe_allow_html=True)
             st.markdown(f"<p style='text-align:center; color:gray;'>{st.session_state.get('role','')}</p>", unsafe_allow_html=True)
+            alert_badges(*my_alert_counts())
             
             # --- NEW SIDEBAR LINK ---
             if st.button("👤 My Profile", use_container_width=True): 
@@ -1142,7 +1070,7 @@ def main():
                 st.rerun()
             
             st.markdown("---")
-            if st.button("Sign Out", use_container_width=True): st.session_state.clear(); st.rerun()
+            if st.button("Sign Out", use_container_width=True): end_session(); st.rerun()
 
     if not st.session_state['logged_in']:
         login_page()
@@ -0,0 +1,90 @@
+"""
+Password hashing and signed session tokens.
+
+Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>". Rows
+still holding a plaintext password are verified as before and re-hashed on
+the next successful login (see storage.authenticate).
+
+Session tokens are "<payload>.<signature>": base64url JSON carrying the
+username, user_id, role, name, emp_id and an expiry, signed with
+HMAC-SHA256, plus a stamp derived from the user's stored password hash and
+role. The app keeps the token in the URL (?session=...), so a browser
+refresh restores the session by checking the signature and comparing the
+stamp with the users row (one primary-key read): changing the password or
+role, or deleting the user, ends every outstanding session.
+
+    PORTAL_PBKDF2_ITERATIONS  200000
+    PORTAL_SESSION_HOURS      12
+    PORTAL_SESSION_SECRET     signing key (default: generated once, stored in portal_settings)
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ITERATIONS = int(os.environ.get("PORTAL_PBKDF2_ITERATIONS", 200000))
+SESSION_HOURS = float(os.environ.get("PORTAL_SESSION_HOURS", 12))
+PREFIX = "pbkdf2_sha256"
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(PREFIX + "$")
+
+def hash_password(password, iterations=None):
+    iterations = iterations or ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{PREFIX}${iterations}${_b64(salt)}${_b64(digest)}"
+
+def hash_passwords(passwords):
+    """Hashes many passwords in parallel (pbkdf2_hmac releases the GIL); hashed values pass through."""
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as pool:
+        return list(pool.map(lambda p: p if is_hashed(p) else hash_password(str(p)), passwords))
+
+def verify_password(password, stored):
+    """Returns (ok, needs_rehash). Plaintext and weaker-iteration hashes need a rehash."""
+    if not stored: return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(str(password).encode(), str(stored).encode()), True
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        check = hashlib.pbkdf2_hmac("sha256", password.encode(), _unb64(salt), int(iterations))
+    except Exception:
+        return False, False
+    ok = hmac.compare_digest(check, _unb64(digest))
+    return ok, ok and int(iterations) < ITERATIONS
+
+# --- SESSION TOKENS ---
+TOKEN_FIELDS = ('username', 'user_id', 'role', 'name', 'emp_id')
+
+def user_stamp(stored_password, role):
+    """Short fingerprint of what a session depends on; changes with the password hash or the role."""
+    return hashlib.sha256(f"{stored_password}\x1f{role}".encode()).hexdigest()[:16]
+
+def issue_token(user, secret, hours=None):
+    """user: the TOKEN_FIELDS plus 'stamp' (see user_stamp)."""
+    payload = {k: user[k] for k in TOKEN_FIELDS}
+    payload['stamp'] = user['stamp']
+    payload['exp'] = int(time.time() + 3600 * (hours or SESSION_HOURS))
+    body = _b64(json.dumps(payload, separators=(",", ":"), default=str).encode())
+    return f"{body}.{_b64(hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest())}"
+
+def read_token(token, secret):
+    """The token's payload dict if the signature checks out and it hasn't expired, else None."""
+    try:
+        body, sig = token.split(".")
+        if not hmac.compare_digest(_unb64(sig), hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()):
+            return None
+        payload = json.loads(_unb64(body))
+    except Exception:
+        return None
+    return payload if payload.get('exp', 0) > time.time() else None
@@ -0,0 +1,78 @@
+"""
+Profile pictures without per-render external requests.
+
+An empty users.img (or a legacy ui-avatars.com URL) means "initials": an SVG
+is generated locally and embedded as a data URI. Any other http(s) URL is
+downloaded once into PORTAL_AVATAR_DIR and served inline from there; a URL
+that cannot be fetched falls back to initials and is not retried until the
+process restarts. Both caches are bounded LRUs.
+
+    PORTAL_AVATAR_DIR            avatars
+    PORTAL_AVATAR_FETCH_TIMEOUT  2   (seconds)
+"""
+import base64
+import functools
+import hashlib
+import os
+import urllib.request
+from html import escape
+
+AVATAR_DIR = os.environ.get("PORTAL_AVATAR_DIR", "avatars")
+FETCH_TIMEOUT = float(os.environ.get("PORTAL_AVATAR_FETCH_TIMEOUT", 2))
+MAX_BYTES = 2 * 2**20
+COLORS = ["#2563eb", "#7c3aed", "#db2777", "#dc2626", "#ea580c", "#ca8a04", "#16a34a", "#0d9488", "#0891b2", "#4f46e5"]
+_MAGIC = [(b"\x89PNG", "image/png"), (b"\xff\xd8", "image/jpeg"), (b"GIF8", "image/gif"), (b"RIFF", "image/webp")]
+
+def initials(name):
+    parts = str(name or "?").split()
+    return "".join(p[0] for p in parts[:2]).upper() or "?"
+
+def avatar_svg(name, size=120):
+    """Initials on a colour picked from the name, so a user keeps the same colour everywhere."""
+    color = COLORS[int(hashlib.md5(str(name).encode()).hexdigest(), 16) % len(COLORS)]
+    return (f"<svg xmlns='http://www.w3.org/2000/svg' width='{size}' height='{size}' viewBox='0 0 100 100'>"
+            f"<rect width='100' height='100' fill='{color}'/>"
+            f"<text x='50' y='50' dy='.35em' text-anchor='middle' font-family='Arial,sans-serif' font-size='40' "
+            f"fill='#fff'>{escape(initials(name))}</text></svg>")
+
+def _data_uri(raw, mime):
+    return f"data:{mime};base64,{base64.b64encode(raw).decode()}"
+
+def _mime(raw):
+    if raw.lstrip()[:5] in (b"<svg ", b"<?xml"): return "image/svg+xml"
+    return next((m for magic, m in _MAGIC if raw.startswith(magic)), None)
+
+@functools.lru_cache(maxsize=256)
+def _fetched(url):
+    """Data URI for an external image, downloaded once into AVATAR_DIR; None if it can't be fetched."""
+    path = os.path.join(AVATAR_DIR, hashlib.sha1(url.encode()).hexdigest())
+    if os.path.exists(path):
+        with open(path, "rb") as f: raw = f.read()
+    else:
+        try:
+            with urllib.request.urlopen(url, timeout=FETCH_TIMEOUT) as resp: raw = resp.read(MAX_BYTES + 1)
+        except Exception:
+            return None
+        if len(raw) > MAX_BYTES or not _mime(raw): return None
+        os.makedirs(AVATAR_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.part"
+        with open(tmp, "wb") as f: f.write(raw)
+        os.replace(tmp, path)
+    mime = _mime(raw)
+    return _data_uri(raw, mime) if mime else None
+
+@functools.lru_cache(maxsize=1024)
+def initials_uri(name):
+    return _data_uri(avatar_svg(name).encode(), "image/svg+xml")
+
+def is_generated(img):
+    return not img or "ui-avatars.com" in str(img)
+
+def avatar_src(img, name):
+    """Value for an <img src>: the cached copy of img, or generated initials for name."""
+    if not is_generated(img) and str(img).startswith(("http://", "https://")):
+        uri = _fetched(img)
+        if uri: return uri
+    elif not is_generated(img) and str(img).startswith("data:image/"):
+        return img
+    return initials_uri(str(name or ""))
@@ -0,0 +1,212 @@
+"""
+Online backups of the SQLite database.
+
+Snapshots are taken with SQLite's backup API in steps of PORTAL_BACKUP_PAGES
+pages, with a short pause between steps. Readers and writers keep going while
+a snapshot runs. A write from another connection restarts the copy; after
+MAX_RESTARTS restarts the rest is copied in one step. Each snapshot is checked with PRAGMA quick_check, gzip-compressed into
+PORTAL_BACKUP_DIR and pruned down to the newest PORTAL_BACKUP_KEEP files.
+With PORTAL_SHARD_BY set, every shard file is copied next to the main
+snapshot (<snapshot>.shard-<name>.db.gz) and restored with it, so
+shard_map and the shards never come from different points in time.
+
+    PORTAL_BACKUP_DIR             backups
+    PORTAL_BACKUP_KEEP            14
+    PORTAL_BACKUP_INTERVAL_HOURS  24   (0 disables the scheduled snapshot)
+    PORTAL_BACKUP_PAGES           256
+
+PostgreSQL deployments should use pg_dump / PITR instead.
+"""
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import scheduler
+import storage
+
+BACKUP_DIR = os.environ.get("PORTAL_BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("PORTAL_BACKUP_KEEP", 14))
+BACKUP_INTERVAL_HOURS = float(os.environ.get("PORTAL_BACKUP_INTERVAL_HOURS", 24))
+BACKUP_PAGES = int(os.environ.get("PORTAL_BACKUP_PAGES", 256))
+STEP_PAUSE = 0.005
+# A write from another connection restarts the copy; after this many restarts
+# finish in one step (holds a read lock for the remaining copy)
+MAX_RESTARTS = 3
+# Marks the shard files stored alongside a main snapshot
+SHARD_TAG = ".shard-"
+
+class _Restarted(Exception):
+    pass
+
+def _sqlite_path():
+    backend = storage.get_backend()
+    if backend.name != "sqlite":
+        raise RuntimeError("Online backups cover the SQLite backend; use pg_dump for PostgreSQL")
+    return backend.path
+
+def _files():
+    """(shard name, path) of the files a snapshot covers: main (name None), then every shard."""
+    files = [(None, _sqlite_path())]
+    if storage.get_router(): files += [(s.shard_name, s.path) for s in storage.shards()]
+    return files
+
+def _split(path):
+    ext = ".db.gz" if path.endswith(".db.gz") else ".db"
+    return path[:-len(ext)], ext
+
+def _shard_parts(path):
+    """{shard name: file} stored with a main snapshot."""
+    base, ext = _split(path)
+    return {p[len(base) + len(SHARD_TAG):-len(ext)]: p for p in glob.glob(f"{glob.escape(base)}{SHARD_TAG}*{ext}")}
+
+def _copy(src, dst, pages, progress=None):
+    """Incremental backup API copy; returns the page count."""
+    seen = {'pages': 0, 'remaining': None, 'restarts': 0}
+    def step(status, remaining, total):
+        if seen['remaining'] is not None and remaining > seen['remaining']:
+            seen['restarts'] += 1
+            if seen['restarts'] > MAX_RESTARTS: raise _Restarted()
+        seen.update(pages=total, remaining=remaining)
+        if progress: progress(total - remaining, total)
+    try:
+        src.backup(dst, pages=pages, progress=step, sleep=STEP_PAUSE)
+    except _Restarted:
+        src.backup(dst)
+        seen['pages'] = dst.execute("PRAGMA page_count").fetchone()[0]
+        if progress: progress(seen['pages'], seen['pages'])
+    return seen['pages']
+
+def _snapshot(src_path, tmp, compress, pages, progress):
+    """Copies one file into tmp (already created), checks and compresses it; returns (file, pages, copy seconds, db bytes)."""
+    t0 = time.perf_counter()
+    src, dst = sqlite3.connect(src_path), sqlite3.connect(tmp)
+    try:
+        n_pages = _copy(src, dst, pages, progress)
+        check = dst.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        dst.close(); src.close()
+    if check != "ok":
+        os.remove(tmp)
+        raise RuntimeError(f"Snapshot failed quick_check: {check}")
+    copy_s = time.perf_counter() - t0
+
+    out = tmp[:-len(".part")] + (".gz" if compress else "")
+    if compress:
+        with open(tmp, "rb") as f_in, gzip.open(out, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        raw_bytes = os.path.getsize(tmp)
+        os.remove(tmp)
+    else:
+        os.replace(tmp, out)
+        raw_bytes = os.path.getsize(out)
+    return out, n_pages, copy_s, raw_bytes
+
+def backup(dest_dir=None, pages=None, compress=True, progress=None):
+    """Takes a snapshot (main and shards); returns a report dict (file, shards, pages, seconds, pages_per_s, bytes) for the set."""
+    dest_dir = dest_dir or BACKUP_DIR
+    os.makedirs(dest_dir, exist_ok=True)
+    # Millisecond stamp plus exclusive create: concurrent backups never share a file
+    base = os.path.join(dest_dir, f"{os.path.splitext(os.path.basename(_sqlite_path()))[0]}-{datetime.now():%Y%m%d-%H%M%S-%f}"[:-3])
+    open(base + ".db.part", "x").close()
+
+    t0, done = time.perf_counter(), []
+    try:
+        for shard, path in _files():
+            tmp = base + (f"{SHARD_TAG}{shard}" if shard else "") + ".db.part"
+            if shard: open(tmp, "x").close()
+            done.append(_snapshot(path, tmp, compress, pages or BACKUP_PAGES, progress))
+    except Exception:
+        # A set missing a shard can't be restored consistently
+        for part in done: os.remove(part[0])
+        raise
+    n_pages, copy_s = sum(p[1] for p in done), sum(p[2] for p in done)
+    return {'file': done[0][0], 'shards': len(done) - 1, 'pages': n_pages,
+            'seconds': round(time.perf_counter() - t0, 3), 'copy_seconds': round(copy_s, 3),
+            'pages_per_s': round(n_pages / copy_s) if copy_s else None,
+            'db_bytes': sum(p[3] for p in done), 'file_bytes': sum(os.path.getsize(p[0]) for p in done)}
+
+def list_backups(dest_dir=None):
+    """Main snapshots, newest first; bytes include the shard files stored with them."""
+    files = sorted(glob.glob(os.path.join(dest_dir or BACKUP_DIR, "*.db")) + glob.glob(os.path.join(dest_dir or BACKUP_DIR, "*.db.gz")),
+                   key=os.path.getmtime, reverse=True)
+    files = [f for f in files if SHARD_TAG not in os.path.basename(f)]
+    parts = [list(_shard_parts(f).values()) for f in files]
+    return pd.DataFrame({'file': files, 'shards': [len(p) for p in parts],
+                         'bytes': [os.path.getsize(f) + sum(map(os.path.getsize, p)) for f, p in zip(files, parts)],
+                         'created': [datetime.fromtimestamp(os.path.getmtime(f)).isoformat(timespec="seconds") for f in files]})
+
+def prune(keep=None, dest_dir=None):
+    """Deletes all but the newest `keep` snapshots (with their shard files); returns the removed main paths."""
+    keep = BACKUP_KEEP if keep is None else keep
+    old = list_backups(dest_dir)['file'].tolist()[keep:]
+    for f in old:
+        for part in _shard_parts(f).values(): os.remove(part)
+        os.remove(f)
+    return old
+
+def _unpack(path):
+    """Plain copy of a snapshot file that passed quick_check (decompressed next to it for .gz)."""
+    src_path = path
+    if path.endswith(".gz"):
+        src_path = path[:-3] + ".restore"
+        with gzip.open(path, "rb") as f_in, open(src_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True)
+    try: check = src.execute("PRAGMA quick_check").fetchone()[0]
+    finally: src.close()
+    if check != "ok":
+        if src_path != path: _remove_unpacked(src_path)
+        raise RuntimeError(f"Snapshot failed quick_check: {check} ({path})")
+    return src_path
+
+def _remove_unpacked(src_path):
+    # Opening a WAL-mode copy read-only leaves its -wal/-shm behind
+    for f in (src_path, src_path + "-wal", src_path + "-shm"):
+        if os.path.exists(f): os.remove(f)
+
+def restore(path, target=None, pages=None):
+    """
+    Copies a snapshot (.db or .db.gz) over the live database through the
+    backup API, so open connections see a consistent switch instead of a
+    replaced file. When sharded, its shard files are restored too, shards
+    created since are emptied, and rows a pre-sharding snapshot brings back
+    into main are distributed again. Every file is checked before any is
+    written. Returns the page count.
+    """
+    router = storage.get_router() if target is None else None
+    parts = _shard_parts(path)
+    if parts and not router and target is None:
+        raise RuntimeError(f"{path} holds {len(parts)} shard file(s); set PORTAL_SHARD_BY to restore it")
+    files = {None: path, **(parts if router else {})}
+    srcs = {}
+    try:
+        for shard, f in files.items(): srcs[shard] = _unpack(f)
+        n_pages = 0
+        for shard, src_path in srcs.items():
+            dst_path = (target or _sqlite_path()) if shard is None else router.shard(shard).path
+            src, dst = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True), sqlite3.connect(dst_path)
+            try: n_pages += _copy(src, dst, pages or BACKUP_PAGES)
+            finally: dst.close(); src.close()
+    finally:
+        for shard, src_path in srcs.items():
+            if src_path != files[shard]: _remove_unpacked(src_path)
+    if router:
+        for backend in storage.shards():
+            if backend.shard_name in parts: continue
+            with backend.connect() as c:
+                for table in storage.SHARDED_TABLES: c.execute(f"DELETE FROM {table}")
+        storage.distribute_to_shards()
+    return n_pages
+
+@scheduler.every("backup", BACKUP_INTERVAL_HOURS * 3600)
+def scheduled_backup():
+    if storage.get_backend().name != "sqlite": return "skipped (not sqlite)"
+    report = backup()
+    report['pruned'] = len(prune())
+    return report
@@ -0,0 +1,118 @@
+"""
+Data-layer benchmarks, runnable against either storage backend.
+
+    python bench.py --tasks 50000                                   # SQLite (bench_portal.db)
+    python bench.py --backend postgres --url postgresql://localhost/portal_bench --tasks 50000
+
+Loads synthetic rows on first run, then times the reads and writes the UI
+performs on every rerun. Point it at a throwaway database.
+"""
+import argparse
+import io
+import random
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+import analytics
+import storage
+from ids import new_ids
+
+# Same projections as the KPI board and resource list in app.py
+BOARD_COLS = ['id', 'task_name', 'description_of_activity', 'name_activity_pilot',
+              'commitment_date_to_customer', 'status', 'otd_customer', 'ftr_internal']
+RESOURCE_LIST_COLS = ['id', 'employee_name', 'employee_id', 'dev_code', 'department', 'status',
+                      'location', 'hourly_rate', 'hardware_daily_cost']
+
+def _timed(label, fn, repeat, results):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    results.append((label, best))
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 2**20
+
+def load_synthetic(n_tasks, n_resources):
+    storage.import_users_df(pd.DataFrame({'username': [f"pilot{i}" for i in range(200)], 'password': "x",
+                                          'role': "Team Member", 'name': [f"Pilot {i}" for i in range(200)]}))
+    pilots = list(storage.get_pilots().itertuples(index=False, name=None))
+    with storage.get_backend().connect() as c:
+        have = c.execute("SELECT count(*) FROM tasks_v2").fetchone()[0]
+        if have < n_tasks:
+            rows = []
+            task_ids = new_ids(n_tasks - have)
+            for i in range(have, n_tasks):
+                start = date.today() - timedelta(days=random.randint(0, 900))
+                due = start + timedelta(days=random.randint(5, 30))
+                uid, name = random.choice(pilots)
+                rows.append((task_ids[i - have], name, f"Bench Task {i}", str(start), "", str(due),
+                             random.choice(["Completed", "Inprogress", "Hold", "Cancelled"]), "Yes", f"REF-{i}",
+                             "Yes", "N/A", "", "Standard", "Yes", str(start), str(start), "N/A", "", "", "Lead-X", "Mgr-Y", uid))
+            c.executemany(f"INSERT INTO tasks_v2 ({', '.join(storage.TASK_INSERT_COLS)}) "
+                          f"VALUES ({','.join(['?'] * len(storage.TASK_INSERT_COLS))})", rows)
+        have = c.execute("SELECT count(*) FROM resource_tracker_v4").fetchone()[0]
+        if have < n_resources:
+            rows = [(rid, f"Bench Res {i}", f"BR-{i}", "001", random.choice(["Engineering", "Quality", "Manufacturing"]),
+                     random.choice(["Chennai", "Bangalore", "Pune"]), "Sarah Jenkins", str(date.today()), "MID", "Active",
+                     "", "", "", "", "", str(random.randint(20, 50)), "5")
+                    for rid, i in zip(new_ids(n_resources - have), range(have, n_resources))]
+            c.executemany(storage.RESOURCE_INSERT_SQL, rows)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backend", choices=["sqlite", "postgres"], default="sqlite")
+    ap.add_argument("--db-file", default="bench_portal.db")
+    ap.add_argument("--url", default=None, help="PostgreSQL DSN")
+    ap.add_argument("--tasks", type=int, default=20000)
+    ap.add_argument("--resources", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    storage.configure(backend=args.backend, db_file=args.db_file, url=args.url)
+    storage.init_db()
+    load_synthetic(args.tasks, args.resources)
+
+    df = storage.get_kpi_data()
+    some_ids = df['id'].sample(min(100, len(df))).tolist()
+    trainings = storage.get_trainings()['id'].tolist()
+    pilot_uid = int(storage.resolve_user_ids(["Pilot 7"])[0])
+    csv_bytes = df.head(1000).drop(columns=['id']).to_csv(index=False).encode('utf-8')
+
+    results = []
+    _timed("get_kpi_data (full board)", storage.get_kpi_data, args.repeat, results)
+    _timed("member view (get_pilot_tasks)", lambda: storage.get_pilot_tasks(pilot_uid), args.repeat, results)
+    _timed("update 100 task statuses", lambda: [storage.update_task_status(t, "Inprogress", str(date.today())) for t in some_ids], args.repeat, results)
+    _timed("toggle training status x10", lambda: [storage.update_training_status(pilot_uid, t, "In Progress", "Pilot 7") for t in trainings], args.repeat, results)
+    _timed("batched training status x10", lambda: storage.update_training_statuses(pilot_uid, {t: "Completed" for t in trainings}, "Pilot 7"), args.repeat, results)
+    _timed("get_resource_list", storage.get_resource_list, args.repeat, results)
+    _timed("stream tasks in 10k chunks", lambda: sum(len(ch) for ch in storage.get_backend().iter_df("SELECT * FROM tasks_v2", chunksize=10000)), args.repeat, results)
+    _timed("import_kpi_df (1000 rows)", lambda: storage.import_kpi_df(pd.read_csv(io.BytesIO(csv_bytes))), 1, results)
+
+    _timed("get_kpi_data (board columns)", lambda: storage.get_kpi_data(columns=BOARD_COLS), args.repeat, results)
+    _timed("get_resource_list (list columns)", lambda: storage.get_resource_list(columns=RESOURCE_LIST_COLS), args.repeat, results)
+
+    pilots = storage.get_pilots()
+    _timed("workload_index (rebuild)", lambda: (analytics.workload_index.cache_clear(), analytics.workload_index()), args.repeat, results)
+    _timed("pilot load, next 30 days (all pilots)", lambda: analytics.workload_index().load(pilots, date.today(), date.today() + timedelta(days=30)), args.repeat, results)
+    _timed("task cost per lead and month (rebuild)", lambda: (analytics.task_costs.cache_clear(), analytics.monthly_costs.cache_clear(),
+                                                              analytics.monthly_costs('project_lead')), args.repeat, results)
+
+    print(f"backend={storage.get_backend().name} tasks={len(df)}")
+    print(pd.DataFrame(results, columns=["workload", "best_seconds"]).to_string(index=False))
+
+    # Per-session frame sizes: raw SELECT * frames vs projected, compacted readers
+    mem = [
+        ("tasks: SELECT * (uncompacted)", memory_mb(storage.get_backend().read_df("SELECT * FROM tasks_v2"))),
+        ("tasks: board columns (compact)", memory_mb(storage.get_kpi_data(columns=BOARD_COLS))),
+        ("resources: SELECT * (uncompacted)", memory_mb(storage.get_backend().read_df("SELECT * FROM resource_tracker_v4"))),
+        ("resources: list columns (compact)", memory_mb(storage.get_resource_list(columns=RESOURCE_LIST_COLS))),
+    ]
+    print(pd.DataFrame(mem, columns=["frame", "MiB"]).round(2).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Headless entry point for imports, exports and maintenance (cron friendly).
+
+    python cli.py import tasks history.csv --chunksize 50000
+    python cli.py export resources -o resources.csv
+    python cli.py recompute
+    python cli.py rebuild-aggregates
+    python cli.py vacuum
+    python cli.py maintain --pages 5000
+    python cli.py archive --days 90
+    python cli.py export archive -o archived_tasks.csv
+    python cli.py rekey
+    python cli.py backup
+    python cli.py restore backups/portal_v23_fixed-20250101-020000.db.gz --yes
+    python cli.py run-scheduled
+    python cli.py hash-passwords
+
+Uses the same storage layer and PORTAL_* settings as the app; --backend,
+--db-file and --url override them.
+"""
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+import alerts  # registers the task_alerts / cycle_time aggregates and the alerts job
+import backup
+import maintenance
+import scheduler
+import storage
+
+def cmd_import(args):
+    importer = storage.IMPORTERS[args.table]
+    total, t0 = 0, time.perf_counter()
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    # Chunked read keeps memory flat for multi-million-row histories
+    for chunk in pd.read_csv(args.file, chunksize=args.chunksize):
+        for k, n in importer(chunk).items(): counts[k] += n
+        total += len(chunk)
+        print(f"\r{args.table}: {total:,} rows", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    print(f"Imported {total:,} rows into {storage.TABLES[args.table]} in {time.perf_counter() - t0:.1f}s: "
+          f"{counts['inserted']:,} inserted, {counts['updated']:,} updated, {counts['unchanged']:,} unchanged")
+
+def cmd_export(args):
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    total = 0
+    try:
+        for i, chunk in enumerate(storage.iter_table(storage.TABLES[args.table], chunksize=args.chunksize)):
+            chunk.to_csv(out, index=False, header=(i == 0))
+            total += len(chunk)
+    finally:
+        if args.output: out.close()
+    print(f"Exported {total:,} rows", file=sys.stderr)
+
+def cmd_recompute(args):
+    print(f"Recomputed OTD fields: {storage.recompute_derived_fields():,} rows changed")
+
+def cmd_rebuild_aggregates(args):
+    if not storage.AGGREGATE_BUILDERS:
+        print("No aggregates registered.")
+        return
+    for name, result in storage.rebuild_aggregates(args.names).items():
+        print(f"{name}: {result}")
+
+def cmd_vacuum(args):
+    t0 = time.perf_counter()
+    storage.vacuum_analyze()
+    print(f"VACUUM/ANALYZE finished in {time.perf_counter() - t0:.1f}s")
+
+def cmd_maintain(args):
+    result = maintenance.run(args.pages)
+    if isinstance(result, str): print(result); return
+    for name, line in result.items(): print(f"{name}: {line}")
+
+def cmd_archive(args):
+    moved = storage.archive_tasks(args.days)
+    print(f"Archived {moved:,} finished tasks older than {args.days if args.days is not None else storage.ARCHIVE_AFTER_DAYS} days")
+
+def cmd_rekey(args):
+    for table, n in storage.migrate_legacy_ids(args.tables).items():
+        print(f"{table}: {n:,} legacy ids replaced")
+
+def cmd_backup(args):
+    if args.list:
+        print(backup.list_backups(args.dir).to_string(index=False))
+        return
+    r = backup.backup(args.dir, args.pages, compress=not args.no_compress,
+                      progress=lambda done, total: print(f"\r{done:,}/{total:,} pages", end="", file=sys.stderr))
+    print(file=sys.stderr)
+    print(f"{r['file']}: {r['pages']:,} pages in {r['copy_seconds']:.2f}s ({r['pages_per_s']:,} pages/s), "
+          f"{r['db_bytes'] / 2**20:.1f} MiB -> {r['file_bytes'] / 2**20:.1f} MiB, total {r['seconds']:.2f}s"
+          + (f" (with {r['shards']} shard files)" if r['shards'] else ""))
+    removed = backup.prune(args.keep, args.dir)
+    if removed: print(f"Pruned {len(removed)} old snapshot(s)")
+
+def cmd_restore(args):
+    if not args.yes:
+        sys.exit(f"Restoring {args.file} overwrites {backup._sqlite_path()}; re-run with --yes")
+    t0 = time.perf_counter()
+    pages = backup.restore(args.file)
+    print(f"Restored {pages:,} pages from {args.file} in {time.perf_counter() - t0:.1f}s")
+
+def cmd_hash_passwords(args):
+    print(f"Hashed {storage.hash_plaintext_passwords():,} plaintext passwords")
+
+def cmd_run_scheduled(args):
+    for name, result in scheduler.run_pending(args.names or None, force=args.force).items():
+        print(f"{name}: {result}")
+
+def build_parser():
+    ap = argparse.ArgumentParser(prog="cli.py", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backend", choices=["sqlite", "postgres"])
+    ap.add_argument("--db-file")
+    ap.add_argument("--url", help="PostgreSQL DSN")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="Load a CSV into a table")
+    p.add_argument("table", choices=sorted(storage.IMPORTERS))
+    p.add_argument("file")
+    p.add_argument("--chunksize", type=int, default=50000)
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export", help="Write a table as CSV")
+    p.add_argument("table", choices=sorted(storage.TABLES))
+    p.add_argument("-o", "--output", help="File path (default: stdout)")
+    p.add_argument("--chunksize", type=int, default=50000)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("recompute", help="Recompute derived task fields (OTD)")
+    p.set_defaults(func=cmd_recompute)
+
+    p = sub.add_parser("rebuild-aggregates", help="Rebuild summary tables")
+    p.add_argument("names", nargs="*")
+    p.set_defaults(func=cmd_rebuild_aggregates)
+
+    p = sub.add_parser("vacuum", help="VACUUM and ANALYZE the database")
+    p.set_defaults(func=cmd_vacuum)
+
+    p = sub.add_parser("maintain", help="PRAGMA optimize, WAL checkpoint, incremental vacuum; records telemetry")
+    p.add_argument("--pages", type=int, help="Free pages to release per file")
+    p.set_defaults(func=cmd_maintain)
+
+    p = sub.add_parser("archive", help="Move old Completed/Cancelled tasks to tasks_archive")
+    p.add_argument("--days", type=int, help="Age threshold (default: PORTAL_ARCHIVE_AFTER_DAYS)")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("rekey", help="Replace legacy random ids with time-ordered ids")
+    p.add_argument("tables", nargs="*")
+    p.set_defaults(func=cmd_rekey)
+
+    p = sub.add_parser("backup", help="Online snapshot of the SQLite database (gzip, with retention)")
+    p.add_argument("--dir", help="Destination (default: PORTAL_BACKUP_DIR)")
+    p.add_argument("--pages", type=int, help="Pages copied per step (default: PORTAL_BACKUP_PAGES)")
+    p.add_argument("--keep", type=int, help="Snapshots to keep (default: PORTAL_BACKUP_KEEP)")
+    p.add_argument("--no-compress", action="store_true")
+    p.add_argument("--list", action="store_true", help="List existing snapshots")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("restore", help="Restore a snapshot over the live SQLite database")
+    p.add_argument("file")
+    p.add_argument("--yes", action="store_true")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("hash-passwords", help="Hash passwords still stored in plaintext")
+    p.set_defaults(func=cmd_hash_passwords)
+
+    p = sub.add_parser("run-scheduled", help="Run due scheduled jobs once (cron alternative to the app thread)")
+    p.add_argument("names", nargs="*")
+    p.add_argument("--force", action="store_true", help="Run even if not due")
+    p.set_defaults(func=cmd_run_scheduled)
+    return ap
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    storage.configure(backend=args.backend, db_file=args.db_file, url=args.url)
+    storage.init_db()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
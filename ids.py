@@ -0,0 +1,78 @@
+"""
+Record IDs for tasks, trainings and resources.
+
+IDs are 16-character Crockford base32 strings: 50 bits of Unix milliseconds
+followed by a 30-bit tail that starts at a random point each millisecond and
+then counts up. They sort by creation time (so they double as keyset
+pagination cursors), are strictly increasing within a process, and land at
+the right-hand edge of the primary-key B-tree instead of scattering inserts.
+
+    new_id()      -> one id
+    new_ids(n)    -> n increasing ids, generated in one vectorized block
+"""
+import random
+import threading
+import time
+
+import numpy as np
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LEN = 16
+_TIME_CHARS, _TAIL_CHARS = 10, 6
+_TAIL_BITS = 5 * _TAIL_CHARS
+_TAIL_MAX = 1 << _TAIL_BITS
+
+_CODES = np.array([ord(ch) for ch in ALPHABET], dtype=np.uint32)
+_lock = threading.Lock()
+_last_ms = 0
+_next_tail = 0
+
+def _encode(value, width):
+    out = []
+    for _ in range(width):
+        out.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(out))
+
+def _reserve(n):
+    """Returns [(ms, first_tail, count), ...] covering n ids, advancing the clock when a tail fills up."""
+    global _last_ms, _next_tail
+    blocks = []
+    with _lock:
+        now = int(time.time() * 1000)
+        if now > _last_ms:
+            # Random start in the lower half leaves room to count up within the millisecond
+            _last_ms, _next_tail = now, random.getrandbits(_TAIL_BITS - 1)
+        while n > 0:
+            if _next_tail >= _TAIL_MAX:
+                _last_ms, _next_tail = _last_ms + 1, random.getrandbits(_TAIL_BITS - 1)
+            take = min(n, _TAIL_MAX - _next_tail)
+            blocks.append((_last_ms, _next_tail, take))
+            _next_tail += take
+            n -= take
+    return blocks
+
+def new_ids(n):
+    out = []
+    for ms, start, count in _reserve(n):
+        tails = np.arange(start, start + count, dtype=np.int64)
+        shifts = np.arange(_TAIL_CHARS - 1, -1, -1, dtype=np.int64) * 5
+        chars = np.empty((count, ID_LEN), dtype=np.uint32)
+        chars[:, :_TIME_CHARS] = [ord(ch) for ch in _encode(ms, _TIME_CHARS)]
+        chars[:, _TIME_CHARS:] = _CODES[(tails[:, None] >> shifts) & 31]
+        out.extend(chars.view(f"<U{ID_LEN}").ravel().tolist())
+    return out
+
+def new_id():
+    return new_ids(1)[0]
+
+def id_timestamp(record_id):
+    """Creation time (Unix ms) encoded in an id; None for legacy ids."""
+    if not is_new_style(record_id): return None
+    ms = 0
+    for ch in record_id[:_TIME_CHARS]:
+        ms = ms * 32 + ALPHABET.index(ch)
+    return ms
+
+def is_new_style(record_id):
+    return isinstance(record_id, str) and len(record_id) == ID_LEN and all(ch in ALPHABET for ch in record_id)
@@ -0,0 +1,107 @@
+"""
+Background CSV imports.
+
+Uploads are handed to a small worker pool instead of running in the script
+thread. Every submission gets its own job; the app submits once per upload,
+so the reruns that follow -- with the file still sitting in st.file_uploader
+-- don't import twice. While a job for the same (table, file bytes) is still
+queued or running, submitting it again returns that job. Once it finished
+the same file can be imported again (imports are upserts). Progress lives in
+the import_jobs table, which keeps history visible to every session and replica.
+"""
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import storage
+from ids import new_id
+
+CHUNK_ROWS = 2000
+# A queued/running job with no heartbeat for this long is treated as orphaned
+# (process or replica restarted) and may be resubmitted. Imports are upserts,
+# so a rerun of a job that was merely slow does no harm.
+STALE_SECONDS = int(os.environ.get("PORTAL_IMPORT_STALE_SECONDS", 600))
+_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("PORTAL_IMPORT_WORKERS", 2)), thread_name_prefix="import")
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def content_key(table, data):
+    return hashlib.sha256(table.encode() + b"\0" + data).hexdigest()[:16]
+
+def get_job(job_id):
+    df = storage.get_backend().read_df("SELECT * FROM import_jobs WHERE job_id=?", (job_id,))
+    return df.iloc[0].to_dict() if not df.empty else None
+
+def list_jobs(table=None, limit=20):
+    if table:
+        return storage.get_backend().read_df("SELECT * FROM import_jobs WHERE table_name=? ORDER BY submitted_at DESC LIMIT ?", (table, limit))
+    return storage.get_backend().read_df("SELECT * FROM import_jobs ORDER BY submitted_at DESC LIMIT ?", (limit,))
+
+def _update(job_id, **fields):
+    fields['heartbeat_at'] = _now()
+    sets = ", ".join(f"{k}=?" for k in fields)
+    storage.get_backend().execute(f"UPDATE import_jobs SET {sets} WHERE job_id=?", (*fields.values(), job_id))
+
+def is_stale(job):
+    if job['status'] not in ('queued', 'running'): return False
+    beat = job.get('heartbeat_at') or job['submitted_at']
+    return not beat or (datetime.now() - datetime.fromisoformat(beat)).total_seconds() > STALE_SECONDS
+
+def submit_import(table, file_name, data, submitted_by=""):
+    """Queues an import and returns its job id, or the id of a live job already importing the same file."""
+    key = content_key(table, data)
+    active = storage.get_backend().read_df("SELECT * FROM import_jobs WHERE content_key=? AND status IN ('queued', 'running')", (key,))
+    for job in active.to_dict('records'):
+        if not is_stale(job): return job['job_id']
+        _update(job['job_id'], status="failed", error="orphaned (no heartbeat)", finished_at=_now())
+    job_id = new_id()
+    lines = data.count(b"\n") + (0 if data.endswith(b"\n") else 1)
+    rows_total = max(lines - 1, 0)
+    storage.get_backend().execute(
+        storage.upsert_sql("import_jobs", ["job_id", "table_name", "file_name", "status", "rows_total", "rows_done",
+                                           "rows_rejected", "error", "submitted_by", "submitted_at", "started_at", "finished_at",
+                                           "rows_inserted", "rows_updated", "rows_unchanged", "heartbeat_at", "content_key"],
+                           ["job_id"]),
+        (job_id, table, file_name, "queued", rows_total, 0, 0, "", submitted_by, _now(), "", "", 0, 0, 0, _now(), key))
+    _pool.submit(_run, job_id, table, data)
+    return job_id
+
+def _run(job_id, table, data):
+    importer = storage.IMPORTERS[table]
+    done = rejected = 0
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def apply(frame):
+        for k, n in importer(frame).items(): counts[k] += n
+
+    _update(job_id, status="running", started_at=_now())
+    try:
+        for chunk in pd.read_csv(io.BytesIO(data), chunksize=CHUNK_ROWS):
+            try:
+                apply(chunk)
+                done += len(chunk)
+            except Exception:
+                # Retry row by row so one bad line doesn't reject the whole chunk
+                for i in range(len(chunk)):
+                    try:
+                        apply(chunk.iloc[i:i + 1].copy())
+                        done += 1
+                    except Exception:
+                        rejected += 1
+            _update(job_id, rows_done=done, rows_rejected=rejected, **{f"rows_{k}": n for k, n in counts.items()})
+        _update(job_id, status="done", rows_total=done + rejected, finished_at=_now())
+    except Exception as e:
+        _update(job_id, status="failed", error=str(e)[:500], finished_at=_now())
+
+def eta_seconds(job):
+    """Remaining seconds estimated from the processing rate so far, or None."""
+    if job['status'] != 'running' or not job['started_at']: return None
+    processed = job['rows_done'] + job['rows_rejected']
+    if processed == 0: return None
+    elapsed = (datetime.now() - datetime.fromisoformat(job['started_at'])).total_seconds()
+    return max(job['rows_total'] - processed, 0) * elapsed / processed
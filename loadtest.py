@@ -0,0 +1,146 @@
+"""
+Concurrent-session load test.
+
+    python loadtest.py --sessions 50 --iterations 20                 # data layer, thread pool
+    python loadtest.py --sessions 50 --processes                     # data layer, process pool
+    python loadtest.py --mode app --sessions 8 --iterations 5        # full app script via AppTest
+
+Each simulated session logs in, opens the KPI board, updates a task, toggles a
+training status, searches resources and (every --import-every iterations)
+imports a small KPI CSV. "data" mode calls storage.py directly; "app" mode
+runs app.py in-process with streamlit.testing (page renders only, uploads
+can't be driven there). Reports throughput, latency percentiles per
+operation and database busy/lock errors. Use a throwaway --db-file.
+"""
+import argparse
+import io
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+
+import pandas as pd
+
+import storage
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PASSWORD = "load"
+RESOURCE_LIST_COLS = ['id', 'employee_name', 'employee_id', 'dev_code', 'department', 'status', 'location']
+
+def _error_kind(e):
+    msg = str(e).lower()
+    if "locked" in msg or "busy" in msg: return "busy/locked"
+    return type(e).__name__
+
+def _timed(samples, op, fn):
+    t0 = time.perf_counter()
+    try:
+        fn()
+        samples.append((op, time.perf_counter() - t0, ""))
+    except Exception as e:
+        samples.append((op, time.perf_counter() - t0, _error_kind(e)))
+
+def prepare(sessions):
+    """Creates one Team Member login per simulated session and gives each a few tasks."""
+    storage.init_db()
+    users = pd.DataFrame({'username': [f"load{i}" for i in range(sessions)], 'password': PASSWORD,
+                          'role': "Team Member", 'name': [f"Load User {i}" for i in range(sessions)]})
+    storage.import_users_df(users)
+    if storage.get_backend().scalar("SELECT count(*) FROM tasks_v2 WHERE task_name LIKE 'Load Task%'") == 0:
+        storage.import_kpi_df(pd.DataFrame({
+            'name_activity_pilot': [f"Load User {i % sessions}" for i in range(sessions * 5)],
+            'task_name': [f"Load Task {i}" for i in range(sessions * 5)],
+            'status': "Inprogress", 'commitment_date_to_customer': str(date.today())}))
+
+def _configure(db_file, backend, url):
+    storage.configure(backend=backend, db_file=db_file, url=url)
+
+def data_session(n, iterations, import_every, think, db_file, backend, url):
+    _configure(db_file, backend, url)
+    rng, samples = random.Random(n), []
+    user = {}
+    trainings = storage.get_trainings()['id'].tolist()
+    csv = pd.DataFrame({'name_activity_pilot': f"Load User {n}", 'task_name': [f"Imported {n}-{i}" for i in range(20)],
+                        'status': "Inprogress"}).to_csv(index=False).encode()
+    for it in range(iterations):
+        _timed(samples, "login", lambda: user.update(storage.authenticate(f"load{n}", PASSWORD) or {}))
+        _timed(samples, "kpi_board", lambda: storage.get_kpi_data(columns=['id', 'task_name', 'status', 'name_activity_pilot']))
+        mine = storage.get_pilot_tasks(user.get('user_id', -1), columns=['id'])['id'].tolist()
+        if mine:
+            _timed(samples, "update_task", lambda: storage.update_task_status(rng.choice(mine), rng.choice(["Inprogress", "Hold"]), str(date.today())))
+        if trainings:
+            _timed(samples, "toggle_training", lambda: storage.update_training_status(
+                user.get('user_id', -1), rng.choice(trainings), rng.choice(["In Progress", "Completed"]), user.get('name', '')))
+        _timed(samples, "search_resources", lambda: storage.get_resource_list(columns=RESOURCE_LIST_COLS)
+               .query("employee_name.str.contains('1', regex=False)", engine="python"))
+        if import_every and it % import_every == import_every - 1:
+            _timed(samples, "import_csv", lambda: storage.import_kpi_df(pd.read_csv(io.BytesIO(csv))))
+        if think: time.sleep(rng.uniform(0, think))
+    return samples
+
+def app_session(n, iterations, import_every, think, db_file, backend, url):
+    from streamlit.testing.v1 import AppTest
+    _configure(db_file, backend, url)
+    rng, samples = random.Random(n), []
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+
+    def login():
+        at.run()
+        at.text_input[0].input(f"load{n}"); at.text_input[1].input(PASSWORD)
+        at.button[0].click(); at.run()
+        if not at.session_state["logged_in"]: raise RuntimeError("login failed")
+
+    def page(name):
+        def go():
+            at.session_state["current_app"] = name
+            at.run()
+            if at.exception: raise RuntimeError(at.exception[0].message)
+        return go
+
+    _timed(samples, "login", login)
+    for _ in range(iterations):
+        _timed(samples, "kpi_board", page("KPI"))
+        _timed(samples, "training", page("TRAINING"))
+        _timed(samples, "home", page("HOME"))
+        if think: time.sleep(rng.uniform(0, think))
+    return samples
+
+def report(samples, wall):
+    df = pd.DataFrame(samples, columns=["op", "seconds", "error"])
+    ok = df[df["error"] == ""]
+    lat = ok.groupby("op")["seconds"].describe(percentiles=[.5, .95, .99])[["count", "50%", "95%", "99%", "max"]] * [1, 1000, 1000, 1000, 1000]
+    lat.columns = ["ok", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    errs = df[df["error"] != ""].groupby(["op", "error"]).size().unstack(fill_value=0)
+    print(f"\n{len(ok):,} ok ops, {len(df) - len(ok):,} errors in {wall:.1f}s -> {len(ok) / wall:,.1f} ops/s")
+    print(lat.join(errs, how="outer").fillna(0).round(1).to_string())
+    busy = int((df["error"] == "busy/locked").sum())
+    print(f"\nbusy/locked errors: {busy:,}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mode", choices=["data", "app"], default="data")
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--iterations", type=int, default=10)
+    ap.add_argument("--import-every", type=int, default=5, help="Import a CSV every N iterations (0 = never)")
+    ap.add_argument("--think", type=float, default=0.0, help="Max random think time between iterations (s)")
+    ap.add_argument("--processes", action="store_true", help="Process pool instead of threads")
+    ap.add_argument("--backend", choices=["sqlite", "postgres"], default="sqlite")
+    ap.add_argument("--db-file", default="loadtest_portal.db")
+    ap.add_argument("--url", help="PostgreSQL DSN")
+    args = ap.parse_args(argv)
+
+    _configure(args.db_file, args.backend, args.url)
+    prepare(args.sessions)
+    session = app_session if args.mode == "app" else data_session
+    pool_cls = ProcessPoolExecutor if args.processes or args.mode == "app" else ThreadPoolExecutor
+
+    t0 = time.perf_counter()
+    with pool_cls(max_workers=args.sessions) as pool:
+        futures = [pool.submit(session, n, args.iterations, args.import_every, args.think,
+                               args.db_file, args.backend, args.url) for n in range(args.sessions)]
+        samples = [s for f in futures for s in f.result()]
+    report(samples, time.perf_counter() - t0)
+
+if __name__ == "__main__":
+    main()
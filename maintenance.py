@@ -0,0 +1,144 @@
+"""
+Scheduled SQLite maintenance and size telemetry.
+
+run() goes over the main database file and every shard file. Each one gets
+PRAGMA optimize (ANALYZE where statistics went stale), an incremental vacuum
+returning up to PORTAL_MAINTENANCE_VACUUM_PAGES free pages to the filesystem,
+and a TRUNCATE WAL checkpoint. Files created before incremental auto-vacuum
+was the default are switched over with one full VACUUM on their first run
+inside the window; a forced run outside it (the admin button) defers that
+VACUUM, which locks the file for its whole duration.
+Afterwards the file and WAL size, page and free-page counts and per-table row
+counts are recorded in db_telemetry (main database). The job runs once per
+PORTAL_MAINTENANCE_INTERVAL_HOURS, inside the PORTAL_MAINTENANCE_HOURS window
+(local time, "start-end"; empty for any time).
+
+    PORTAL_MAINTENANCE_INTERVAL_HOURS  24    (0 disables the scheduled run)
+    PORTAL_MAINTENANCE_HOURS           1-5
+    PORTAL_MAINTENANCE_VACUUM_PAGES    5000
+    PORTAL_TELEMETRY_KEEP_DAYS         90
+
+PostgreSQL has autovacuum; the job skips it.
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import scheduler
+import storage
+
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get("PORTAL_MAINTENANCE_INTERVAL_HOURS", 24))
+_HOURS = os.environ.get("PORTAL_MAINTENANCE_HOURS", "1-5")
+MAINTENANCE_HOURS = tuple(int(h) for h in _HOURS.split("-")) if _HOURS else None
+VACUUM_PAGES = int(os.environ.get("PORTAL_MAINTENANCE_VACUUM_PAGES", 5000))
+TELEMETRY_KEEP_DAYS = int(os.environ.get("PORTAL_TELEMETRY_KEEP_DAYS", 90))
+INCREMENTAL = 2  # PRAGMA auto_vacuum value
+
+def _files():
+    """(name, path) of the main database and, when sharded, each shard."""
+    backend = storage.get_backend()
+    files = [("main", backend.path)]
+    if storage.get_router(): files += [(b.shard_name, b.path) for b in storage.shards()]
+    return files
+
+def _connect(path):
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+def sample(conn, path, rows=True):
+    """{metric: value} for one open database file; rows=False skips the per-table counts."""
+    pragma = lambda name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+    out = {'file_bytes': os.path.getsize(path),
+           'wal_bytes': os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0,
+           'page_size': pragma("page_size"), 'pages': pragma("page_count"), 'free_pages': pragma("freelist_count")}
+    if not rows: return out
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+    for t in tables: out[f"rows:{t}"] = conn.execute(f'SELECT count(*) FROM "{t}"').fetchone()[0]
+    return out
+
+def needs_full_vacuum():
+    """Names of the files still waiting for their one-off full VACUUM."""
+    if storage.get_backend().name != "sqlite": return []
+    out = []
+    for name, path in _files():
+        conn = _connect(path)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL: out.append(name)
+        finally: conn.close()
+    return out
+
+def maintain(path, vacuum_pages=None, full_vacuum=True):
+    """Optimize, checkpoint and incrementally vacuum one file; returns its before/after samples and what was done."""
+    vacuum_pages = VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+    conn = _connect(path)
+    try:
+        before, t0, done = sample(conn, path), time.perf_counter(), []
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL:
+            if full_vacuum:
+                # Only takes effect through a full VACUUM; after that free pages can be released a batch at a time
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL"); conn.execute("VACUUM")
+                done.append("vacuum (auto_vacuum=incremental)")
+            else: done.append("full vacuum deferred")
+        elif before['free_pages']:
+            # Frees one page per step; executescript steps it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+            done.append("incremental_vacuum")
+        conn.execute("PRAGMA optimize")
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone():
+            conn.execute("ANALYZE")
+            done.append("analyze")
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        done.append("checkpoint" if not busy else "checkpoint (busy)")
+        after = sample(conn, path)
+    finally:
+        conn.close()
+    return before, after, time.perf_counter() - t0, done
+
+def run(vacuum_pages=None, full_vacuum=True):
+    """Maintains every database file and records telemetry; returns a short report per file."""
+    if storage.get_backend().name != "sqlite": return "skipped (not sqlite)"
+    stamp = datetime.now().isoformat(timespec="seconds")
+    rows, report = [], {}
+    for name, path in _files():
+        before, after, seconds, done = maintain(path, vacuum_pages, full_vacuum)
+        after = dict(after, seconds=round(seconds, 3), freed_bytes=before['file_bytes'] - after['file_bytes'])
+        rows += [(stamp, name, metric, float(value)) for metric, value in after.items()]
+        report[name] = f"{', '.join(done)}; {after['file_bytes'] / 2**20:.1f} MiB, {after['free_pages']} free pages"
+    with storage.get_backend().connect() as c:
+        c.executemany(storage.upsert_sql("db_telemetry", ['taken_at', 'db', 'metric', 'value'], ['taken_at', 'db', 'metric']), rows)
+        c.execute("DELETE FROM db_telemetry WHERE taken_at < ?",
+                  ((datetime.now() - timedelta(days=TELEMETRY_KEEP_DAYS)).isoformat(timespec="seconds"),))
+    return report
+
+def snapshot(rows=False):
+    """Current samples (no maintenance) as a DataFrame: db, metric, value. Row counts scan every table, so they are opt-in."""
+    if storage.get_backend().name != "sqlite": return pd.DataFrame(columns=['db', 'metric', 'value'])
+    out = []
+    for name, path in _files():
+        conn = _connect(path)
+        try: out += [(name, m, v) for m, v in sample(conn, path, rows).items()]
+        finally: conn.close()
+    return pd.DataFrame(out, columns=['db', 'metric', 'value'])
+
+def latest():
+    """db_telemetry rows of the most recent run."""
+    return storage.get_backend().read_df("SELECT * FROM db_telemetry WHERE taken_at=(SELECT MAX(taken_at) FROM db_telemetry)")
+
+def history(metrics=None, db=None):
+    """db_telemetry rows (taken_at, db, metric, value), oldest first."""
+    query, params = "SELECT taken_at, db, metric, value FROM db_telemetry WHERE 1=1", []
+    if metrics:
+        query += f" AND metric IN ({','.join(['?'] * len(metrics))})"; params += list(metrics)
+    if db:
+        query += " AND db=?"; params.append(db)
+    df = storage.get_backend().read_df(query + " ORDER BY taken_at", params)
+    df['taken_at'] = pd.to_datetime(df['taken_at'])
+    return df
+
+@scheduler.every("maintenance", MAINTENANCE_INTERVAL_HOURS * 3600, hours=MAINTENANCE_HOURS)
+def scheduled_maintenance():
+    return run(full_vacuum=scheduler.in_window(MAINTENANCE_HOURS, datetime.now()))
@@ -0,0 +1,85 @@
+"""
+Periodic background jobs (backups, alert refresh, maintenance).
+
+Modules register jobs with every(); start() launches one daemon thread per
+process that calls run_pending(). Each run is claimed in the scheduled_runs
+table first, so when several app processes share a database a job still
+runs once per interval. A job registered with hours=(start, end) is only
+claimed while the local hour is in that window (off-peak maintenance).
+A forced run (run_pending(force=True), e.g. from an admin button) skips the
+interval and the window but still waits for a run already in progress.
+cli.py run-scheduled does the same from cron.
+"""
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import storage
+
+# name -> (interval seconds, callable, (start hour, end hour) or None)
+JOBS = {}
+POLL_SECONDS = 30
+_started = False
+_start_lock = threading.Lock()
+
+def every(name, seconds, hours=None):
+    """Registers fn to run every `seconds`, inside the `hours` window if given; 0 or less leaves it disabled."""
+    def deco(fn):
+        if seconds and seconds > 0: JOBS[name] = (seconds, fn, hours)
+        return fn
+    return deco
+
+def in_window(hours, now):
+    """hours=(start, end) in local time, end exclusive; wraps past midnight when start > end."""
+    if not hours: return True
+    start, end = hours
+    return start <= now.hour < end if start <= end else (now.hour >= start or now.hour < end)
+
+def _claim(name, interval, now, force=False):
+    with storage.get_backend().connect() as c:
+        c.execute("INSERT INTO scheduled_runs (name, last_run, status, result) VALUES (?, '', 'idle', '') "
+                  "ON CONFLICT (name) DO NOTHING", (name,))
+        # Forced: anything but a live run; one 'running' for longer than the interval has died
+        due = "(status<>'running' OR last_run<=?)" if force else "last_run<=?"
+        cur = c.execute(f"UPDATE scheduled_runs SET last_run=?, status='running' WHERE name=? AND {due}",
+                        (now.isoformat(timespec="seconds"), name,
+                         (now - timedelta(seconds=interval)).isoformat(timespec="seconds")))
+        return cur.rowcount == 1
+
+def _finish(name, status, result):
+    storage.get_backend().execute("UPDATE scheduled_runs SET status=?, result=?, finished_at=? WHERE name=?",
+                                  (status, str(result)[:1000], datetime.now().isoformat(timespec="seconds"), name))
+
+def run_pending(names=None, force=False):
+    """Runs every due job (or the named ones); returns {name: result}, leaving out jobs that weren't claimed."""
+    ran = {}
+    for name, (interval, fn, hours) in list(JOBS.items()):
+        if names and name not in names: continue
+        now = datetime.now()
+        if not force and not in_window(hours, now): continue
+        if not _claim(name, interval, now, force): continue
+        try:
+            ran[name] = fn()
+            _finish(name, "ok", ran[name])
+        except Exception as e:
+            ran[name] = e
+            _finish(name, "failed", traceback.format_exc(limit=3))
+    return ran
+
+def _loop():
+    while True:
+        try: run_pending()
+        except Exception: traceback.print_exc()
+        time.sleep(POLL_SECONDS)
+
+def start():
+    """Starts the scheduler thread once per process."""
+    global _started
+    with _start_lock:
+        if _started or not JOBS: return
+        threading.Thread(target=_loop, name="portal-scheduler", daemon=True).start()
+        _started = True
+
+def job_status():
+    return storage.get_backend().read_df("SELECT * FROM scheduled_runs ORDER BY name")
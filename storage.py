@@ -0,0 +1,1456 @@
+"""
+Data layer for the portal.
+
+Every helper goes through a StorageBackend so the same code runs against the
+local SQLite file (default) or a shared PostgreSQL server when several
+Streamlit replicas sit behind a load balancer.
+
+Configuration (environment):
+    PORTAL_DB_BACKEND    sqlite | postgres          (default: sqlite)
+    PORTAL_DB_FILE       SQLite file path           (default: portal_v23_fixed.db)
+    PORTAL_DATABASE_URL  PostgreSQL DSN, e.g. postgresql://user:pw@localhost/portal
+    PORTAL_PG_POOL_MIN / PORTAL_PG_POOL_MAX  connection pool bounds (default 1 / 10)
+    PORTAL_READ_STALENESS_SECONDS  staleness allowed for analytics/export reads (default 0)
+    PORTAL_SHARD_BY      department | dev_code: split per-department tables into files (default: off)
+    PORTAL_SHARD_DIR     directory of the shard files (default: shards)
+
+SQL is written once with "?" placeholders and the portable
+"INSERT ... ON CONFLICT" form; the PostgreSQL backend rewrites placeholders.
+
+Every committed write bumps a per-table counter in table_generations, so
+caches can key on data_generation() and stay valid across processes.
+
+SQLite runs in WAL mode. Heavy reads (exports, analytics) go through
+backend.reader(): a query_only connection that never blocks writers.
+With PORTAL_READ_STALENESS_SECONDS > 0 it reads a snapshot copy of the file
+instead, refreshed once it is older than that. List screens (the KPI board,
+the resource list) must show edits at once, so they read through
+backend.live_reader(), which is always the query_only connection.
+PostgreSQL readers already get MVCC snapshots, so both are the backend
+itself there.
+
+With PORTAL_SHARD_BY set (SQLite only), tasks, the task archive, resources
+and training progress live in one file per department (or DEV code) under
+PORTAL_SHARD_DIR; see the SHARDING section. Everything else stays in the
+main file.
+"""
+import functools
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from auth import hash_password, hash_passwords, user_stamp, verify_password
+from ids import new_id, new_ids, is_new_style
+
+DB_FILE = os.environ.get("PORTAL_DB_FILE", "portal_v23_fixed.db")
+DB_BACKEND = os.environ.get("PORTAL_DB_BACKEND", "sqlite")
+DATABASE_URL = os.environ.get("PORTAL_DATABASE_URL", "")
+READ_STALENESS_SECONDS = float(os.environ.get("PORTAL_READ_STALENESS_SECONDS", 0))
+SHARD_BY = os.environ.get("PORTAL_SHARD_BY", "")
+SHARD_DIR = os.environ.get("PORTAL_SHARD_DIR", "shards")
+
+TASK_COLS = ['name_activity_pilot', 'task_name', 'date_of_receipt', 'actual_delivery_date',
+             'commitment_date_to_customer', 'status', 'ftr_customer', 'reference_part_number',
+             'ftr_internal', 'otd_internal', 'description_of_activity', 'activity_type',
+             'ftr_quality_gate_internal', 'date_of_clarity_in_input', 'start_date', 'otd_customer',
+             'customer_remarks', 'name_quality_gate_referent', 'project_lead', 'customer_manager_name']
+
+RESOURCE_COLS = ['employee_name', 'employee_id', 'dev_code', 'department', 'location',
+                 'reporting_manager', 'onboarding_date', 'experience_level', 'status',
+                 'po_details', 'remarks', 'effective_exit_date', 'backfill_status',
+                 'reason_for_leaving', 'hourly_rate', 'hardware_daily_cost']
+
+TRAINING_COLS = ['title', 'description', 'link', 'role_target', 'mandatory', 'created_by']
+
+USER_COLS = ['username', 'password', 'role', 'name', 'emp_id', 'img', 'created_at']
+PROGRESS_COLS = ['user_id', 'training_id', 'user_name', 'status', 'last_updated']
+
+# Low-cardinality text held as pandas categoricals, and numeric text parsed, by the readers
+CATEGORY_COLS = {'status', 'department', 'location', 'experience_level', 'dev_code', 'reporting_manager',
+                 'backfill_status', 'activity_type', 'ftr_customer', 'ftr_internal', 'ftr_quality_gate_internal',
+                 'otd_internal', 'otd_customer', 'name_activity_pilot', 'project_lead', 'customer_manager_name'}
+NUMERIC_COLS = {'hourly_rate', 'hardware_daily_cost'}
+
+# Explicit column lists; the integer user keys sit after the original columns
+TASK_INSERT_COLS = ['id'] + TASK_COLS + ['pilot_user_id']
+RESOURCE_INSERT_SQL = (f"INSERT INTO resource_tracker_v4 (id, {', '.join(RESOURCE_COLS)}) "
+                       f"VALUES ({','.join(['?'] * (len(RESOURCE_COLS) + 1))})")
+TRAINING_INSERT_SQL = (f"INSERT INTO training_repo (id, {', '.join(TRAINING_COLS)}) "
+                       f"VALUES ({','.join(['?'] * (len(TRAINING_COLS) + 1))})")
+
+TASK_DDL = '''id TEXT PRIMARY KEY, name_activity_pilot TEXT, task_name TEXT, date_of_receipt TEXT,
+            actual_delivery_date TEXT, commitment_date_to_customer TEXT, status TEXT,
+            ftr_customer TEXT, reference_part_number TEXT, ftr_internal TEXT, otd_internal TEXT,
+            description_of_activity TEXT, activity_type TEXT, ftr_quality_gate_internal TEXT,
+            date_of_clarity_in_input TEXT, start_date TEXT, otd_customer TEXT, customer_remarks TEXT,
+            name_quality_gate_referent TEXT, project_lead TEXT, customer_manager_name TEXT,
+            pilot_user_id INTEGER'''
+
+# Natural keys that make a CSV row "the same record" on re-import, per TABLES name.
+# Override with e.g. PORTAL_IMPORT_KEY_TASKS=reference_part_number,task_name
+IMPORT_KEYS = {name: os.environ.get(f"PORTAL_IMPORT_KEY_{name.upper()}", default).split(",")
+               for name, default in (('tasks', 'reference_part_number,task_name'),
+                                     ('resources', 'employee_id'), ('trainings', 'title'))}
+
+# Finished tasks older than this many days leave the hot tasks_v2 table
+ARCHIVE_AFTER_DAYS = int(os.environ.get("PORTAL_ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_STATUSES = ("Completed", "Cancelled")
+
+# Cycle-time histograms: one bucket per whole day, the last one open-ended
+CYCLE_METRICS = ('lead_time', 'in_progress', 'hold')
+STINT_METRICS = {'Inprogress': 'in_progress', 'Hold': 'hold'}
+CYCLE_MAX_DAYS = 365
+
+# ---------- BACKENDS ----------
+_WRITE_RE = re.compile(r"\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|REPLACE\s+INTO)\s+(\w+)", re.I)
+_BUMP_SQL = ("INSERT INTO table_generations (table_name, generation) VALUES (?, 1) "
+             "ON CONFLICT (table_name) DO UPDATE SET generation=table_generations.generation+1")
+
+def _note_write(touched, query, cur):
+    m = _WRITE_RE.match(query)
+    if m and cur.rowcount != 0: touched.add(m.group(1).lower())
+
+class StorageBackend:
+    """Common interface; subclasses provide connect()."""
+    name = "base"
+
+    @contextmanager
+    def connect(self):
+        """Yields a connection with execute()/executemany(); commits on success."""
+        raise NotImplementedError
+
+    def read_df(self, query, params=()):
+        with self.connect() as conn:
+            cur = conn.execute(query, params)
+            cols = [d[0] for d in cur.description]
+            return pd.DataFrame(cur.fetchall(), columns=cols)
+
+    def iter_df(self, query, params=(), chunksize=50000):
+        """Streams a large result as DataFrame chunks without loading it all."""
+        with self.connect() as conn:
+            cur = conn.stream(query, params, chunksize)
+            cols = None
+            while True:
+                rows = cur.fetchmany(chunksize)
+                if cols is None: cols = [d[0] for d in cur.description]
+                if not rows: break
+                yield pd.DataFrame(rows, columns=cols)
+
+    def execute(self, query, params=()):
+        with self.connect() as conn:
+            conn.execute(query, params)
+
+    def executemany(self, query, rows):
+        with self.connect() as conn:
+            conn.executemany(query, rows)
+
+    def scalar(self, query, params=()):
+        with self.connect() as conn:
+            row = conn.execute(query, params).fetchone()
+            return row[0] if row else None
+
+    def reader(self):
+        """Backend for heavy read-only queries (analytics, exports)."""
+        return self
+
+    def live_reader(self):
+        """Read-only backend that is never stale (list screens)."""
+        return self
+
+
+class _SQLiteConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.touched = set()
+        # Shard connections: tables outside this set live in the attached main database
+        self.local_tables = None
+
+    def execute(self, query, params=()):
+        cur = super().execute(query, params)
+        _note_write(self.touched, query, cur)
+        return cur
+
+    def executemany(self, query, rows):
+        cur = super().executemany(query, rows)
+        _note_write(self.touched, query, cur)
+        return cur
+
+    def bump_generations(self):
+        for table in sorted(self.touched - {'table_generations'}):
+            local = self.local_tables is None or table in self.local_tables
+            super().execute(_BUMP_SQL if local else _BUMP_SQL.replace("INTO table_generations", "INTO portal.table_generations"), (table,))
+        self.touched.clear()
+
+    def stream(self, query, params, chunksize):
+        cur = self.cursor()
+        cur.arraysize = chunksize
+        return cur.execute(query, params)
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path=DB_FILE, staleness=None):
+        self.path = path
+        self._wal = False
+        self._reader = self._live = None
+        self.staleness = READ_STALENESS_SECONDS if staleness is None else staleness
+
+    def _open(self, path):
+        return sqlite3.connect(path, factory=_SQLiteConnection)
+
+    @contextmanager
+    def connect(self):
+        conn = self._open(self.path)
+        if not self._wal:
+            # New files free pages incrementally (maintenance.py); existing ones switch over on a VACUUM
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # Persistent in the file; readers and the writer stop blocking each other
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._wal = True
+        try:
+            yield conn
+            conn.bump_generations()
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def reader(self):
+        if self._reader is None: self._reader = SQLiteReader(self, self.staleness)
+        return self._reader
+
+    def live_reader(self):
+        if self.staleness <= 0: return self.reader()
+        if self._live is None: self._live = SQLiteReader(self)
+        return self._live
+
+
+class SQLiteReader(StorageBackend):
+    """
+    Read-only side of a SQLiteBackend. staleness 0 reads the live file through a
+    query_only WAL connection; otherwise a snapshot copy (<db>.snapshot) that is
+    re-copied with the backup API once it is older than `staleness` seconds.
+    """
+    name = "sqlite"
+
+    def __init__(self, source, staleness=0):
+        self.source, self.staleness = source, staleness
+        self.path = source.path + ".snapshot" if staleness > 0 else source.path
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        try: return time.time() - os.path.getmtime(self.path) < self.staleness
+        except OSError: return False
+
+    def refresh(self):
+        """Re-copies the snapshot; the swap is atomic, so open readers keep the old copy."""
+        tmp = f"{self.path}.{os.getpid()}-{threading.get_ident()}.part"
+        src, dst = sqlite3.connect(self.source.path), sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close(); src.close()
+        os.replace(tmp, self.path)
+
+    @contextmanager
+    def connect(self):
+        if self.staleness > 0 and not self._fresh():
+            with self._lock:
+                if not self._fresh(): self.refresh()
+        conn = self.source._open(self.path)
+        try:
+            conn.execute("PRAGMA query_only=1")
+            yield conn
+        finally:
+            conn.close()
+
+    def reader(self):
+        return self
+
+    def live_reader(self):
+        return self if self.staleness <= 0 else self.source.live_reader()
+
+
+class SQLiteShard(SQLiteBackend):
+    """
+    One shard file holding SHARDED_TABLES. The main database is attached as
+    "portal", so users, training_repo & co. resolve by their plain names and
+    writes to them bump the main database's generations.
+    """
+    def __init__(self, path, main_path, staleness=None):
+        super().__init__(path, staleness)
+        self.main_path = main_path
+        self.shard_name = os.path.basename(path)[:-3]
+
+    def _open(self, path):
+        conn = super()._open(path)
+        conn.execute("ATTACH DATABASE ? AS portal", (self.main_path,))
+        conn.local_tables = SHARDED_TABLES
+        return conn
+
+
+def _to_pyformat(query):
+    # "?" -> "%s"; literal "%" must be doubled for psycopg2
+    return query.replace("%", "%%").replace("?", "%s")
+
+
+class _PgConnection:
+    """Wraps a pooled psycopg2 connection with the sqlite3-style call surface."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.touched = set()
+
+    def execute(self, query, params=()):
+        cur = self.raw.cursor()
+        cur.execute(_to_pyformat(query), tuple(params))
+        _note_write(self.touched, query, cur)
+        return cur
+
+    def executemany(self, query, rows):
+        from psycopg2.extras import execute_batch
+        cur = self.raw.cursor()
+        execute_batch(cur, _to_pyformat(query), [tuple(r) for r in rows], page_size=1000)
+        _note_write(self.touched, query, cur)
+        return cur
+
+    def bump_generations(self):
+        # Last statement before commit, so the counter row lock is held briefly
+        cur = self.raw.cursor()
+        for table in sorted(self.touched - {'table_generations'}):
+            cur.execute(_to_pyformat(_BUMP_SQL), (table,))
+        self.touched.clear()
+
+    def stream(self, query, params, chunksize):
+        # Named cursor = server-side cursor; rows arrive in itersize batches
+        cur = self.raw.cursor(name=f"portal_{uuid.uuid4().hex[:12]}")
+        cur.itersize = chunksize
+        cur.execute(_to_pyformat(query), tuple(params))
+        return cur
+
+
+class PostgresBackend(StorageBackend):
+    name = "postgres"
+
+    def __init__(self, dsn=DATABASE_URL):
+        try:
+            from psycopg2.pool import ThreadedConnectionPool
+        except ImportError as e:
+            raise RuntimeError("PORTAL_DB_BACKEND=postgres requires psycopg2 (pip install psycopg2-binary)") from e
+        if not dsn:
+            raise RuntimeError("PORTAL_DATABASE_URL must be set for the postgres backend")
+        self.dsn = dsn
+        self.pool = ThreadedConnectionPool(int(os.environ.get("PORTAL_PG_POOL_MIN", 1)),
+                                           int(os.environ.get("PORTAL_PG_POOL_MAX", 10)), dsn)
+
+    @contextmanager
+    def connect(self):
+        raw = self.pool.getconn()
+        try:
+            conn = _PgConnection(raw)
+            yield conn
+            conn.bump_generations()
+            raw.commit()
+        except:
+            raw.rollback()
+            raise
+        finally:
+            self.pool.putconn(raw)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def configure(backend=None, db_file=None, url=None):
+    """Overrides the environment settings (CLI / benchmarks) and resets the backend."""
+    global DB_BACKEND, DB_FILE, DATABASE_URL, _backend
+    with _backend_lock:
+        if backend: DB_BACKEND = backend
+        if db_file: DB_FILE = db_file
+        if url: DATABASE_URL = url
+        _backend = None
+        global _router
+        _router = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if DB_BACKEND == "postgres": _backend = PostgresBackend(DATABASE_URL)
+                elif DB_BACKEND == "sqlite": _backend = SQLiteBackend(DB_FILE)
+                else: raise RuntimeError(f"Unknown PORTAL_DB_BACKEND: {DB_BACKEND}")
+    return _backend
+
+def upsert_sql(table, cols, key_cols):
+    """INSERT ... ON CONFLICT DO UPDATE, valid on SQLite >= 3.24 and PostgreSQL."""
+    updates = ", ".join(f"{c}=excluded.{c}" for c in cols if c not in key_cols)
+    action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return (f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({','.join(['?'] * len(cols))}) "
+            f"ON CONFLICT ({', '.join(key_cols)}) {action}")
+
+# ---------- SHARDING ----------
+# Tables split per shard; a user's tasks and progress follow their resource row's shard
+SHARDED_TABLES = frozenset({'tasks_v2', 'tasks_archive', 'resource_tracker_v4', 'training_progress'})
+SHARD_WORKERS = int(os.environ.get("PORTAL_SHARD_WORKERS", 8))
+_router = None
+_shard_pool = None
+# Main files whose leftover rows init_db() has already moved into shards this process
+_distributed, _distribute_lock = set(), threading.Lock()
+
+def _shard_name(value):
+    name = re.sub(r"[^a-z0-9]+", "-", str(value or "").strip().lower()).strip("-")
+    return name or "default"
+
+class ShardRouter:
+    """Maps departments and users to shard files; shard_map (main) holds user_id -> shard."""
+    def __init__(self, main, column, directory):
+        self.main, self.column, self.directory = main, column, directory
+        self._shards, self._lock = {}, threading.Lock()
+
+    def shard(self, name):
+        name = _shard_name(name)
+        with self._lock:
+            if name not in self._shards:
+                os.makedirs(self.directory, exist_ok=True)
+                backend = SQLiteShard(os.path.join(self.directory, f"{name}.db"), self.main.path, self.main.staleness)
+                with backend.connect() as c: _init_shard(c)
+                self._shards[name] = backend
+            return self._shards[name]
+
+    def all(self):
+        names = {f[:-3] for f in os.listdir(self.directory) if f.endswith(".db")} if os.path.isdir(self.directory) else set()
+        return [self.shard(n) for n in sorted(names | set(self._shards))]
+
+    def for_user(self, user_id):
+        if user_id is None or pd.isna(user_id): return self.shard("default")
+        return self.shard(self.main.scalar("SELECT shard FROM shard_map WHERE user_id=?", (int(user_id),)))
+
+def get_router():
+    """The ShardRouter when PORTAL_SHARD_BY is set on the SQLite backend, else None."""
+    global _router
+    if _router is None and SHARD_BY and get_backend().name == "sqlite":
+        if SHARD_BY not in ('department', 'dev_code'): raise RuntimeError(f"Unknown PORTAL_SHARD_BY: {SHARD_BY}")
+        with _backend_lock:
+            if _router is None: _router = ShardRouter(get_backend(), SHARD_BY, SHARD_DIR)
+    return _router
+
+def shards():
+    """Backends holding SHARDED_TABLES: every shard, or just the main backend."""
+    return get_router().all() if get_router() else [get_backend()]
+
+def shard_for_user(user_id):
+    return get_router().for_user(user_id) if get_router() else get_backend()
+
+def shard_for_key(value):
+    return get_router().shard(value) if get_router() else get_backend()
+
+def fan_out(fn, backends=None):
+    """fn(backend) for each shard, in parallel on the shard pool; results in shard order."""
+    global _shard_pool
+    backends = shards() if backends is None else backends
+    if len(backends) == 1: return [fn(backends[0])]
+    if _shard_pool is None:
+        with _backend_lock:
+            if _shard_pool is None: _shard_pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+    return list(_shard_pool.map(fn, backends))
+
+def _pick(reader):
+    """reader=True: backend.reader() (may be a snapshot); 'live': backend.live_reader(); False: the backend."""
+    if reader == 'live': return lambda b: b.live_reader()
+    return (lambda b: b.reader()) if reader else (lambda b: b)
+
+def read_sharded(query, params=(), reader=True):
+    """read_df over every shard, merged; a plain (reader) read_df when unsharded."""
+    pick = _pick(reader)
+    frames = fan_out(lambda b: pick(b).read_df(query, params))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def iter_table(table, chunksize=50000):
+    """Streams a table as DataFrame chunks, shard after shard for SHARDED_TABLES."""
+    for backend in (shards() if table in SHARDED_TABLES else [get_backend()]):
+        yield from backend.reader().iter_df(f"SELECT * FROM {table}", chunksize=chunksize)
+
+def _shard_with_row(table, row_id):
+    """The shard holding the row with this id (or None); the main backend when unsharded."""
+    if not get_router(): return get_backend()
+    backends = shards()
+    hits = fan_out(lambda b: b.scalar(f"SELECT 1 FROM {table} WHERE id=?", (row_id,)), backends)
+    return next((b for b, hit in zip(backends, hits) if hit), None)
+
+def _move_rows(table, where, params, src, dst):
+    """Moves matching rows between shards (insert into dst, then delete from src); returns rows moved."""
+    df = src.read_df(f"SELECT * FROM {table} WHERE {where}", params)
+    if df.empty: return 0
+    dst.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(df.columns)}) VALUES ({','.join(['?'] * len(df.columns))})",
+                    df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    src.execute(f"DELETE FROM {table} WHERE {where}", params)
+    return len(df)
+
+def _execute_sharded(c, query, params=()):
+    """A write to SHARDED_TABLES: inside c's transaction when unsharded, else on every shard."""
+    if get_router(): fan_out(lambda b: b.execute(query, params))
+    else: c.execute(query, params)
+
+def _upsert_routed(table, df, key_cols, route, archive=None, after=None, on_write=None):
+    """
+    upsert_rows (then after(c)) in one transaction; when sharded, per shard in
+    parallel: a row goes to the shard already holding its key (or archived
+    key), else to the shard named by route(df). Returns the summed counts.
+    """
+    def write(backend, part):
+        with backend.connect() as c:
+            counts = upsert_rows(c, table, part, key_cols, archive=archive, on_write=on_write)
+            if after: after(c)
+        return counts
+    router = get_router()
+    if not router: return write(get_backend(), df)
+    dest = pd.Series(route(df), index=df.index).map(_shard_name)
+    keys = _key_frame(df, key_cols)
+    keys = keys[keys.ne('').any(axis=1)]
+    def holders(b):
+        with b.connect() as c:
+            found = pd.concat([_existing_keys(c, t, keys, key_cols, hash_col="NULL")[key_cols] for t in filter(None, (table, archive))])
+        return keys.reset_index().merge(found.drop_duplicates(), on=key_cols)['index']
+    backends = router.all()
+    for backend, idx in zip(backends, fan_out(holders, backends)): dest[idx.values] = backend.shard_name
+    parts = {name: df.loc[dest == name] for name in dest.unique()}
+    results = fan_out(lambda b: write(b, parts[b.shard_name]), [router.shard(n) for n in parts])
+    return {k: sum(r[k] for r in results) for k in ('inserted', 'updated', 'unchanged')}
+
+def _user_shards(user_ids):
+    """Shard names for a Series of user ids (shard_map; unmapped users -> default)."""
+    shard_of = dict(get_backend().read_df("SELECT user_id, shard FROM shard_map").itertuples(index=False, name=None))
+    return user_ids.map(lambda uid: "default" if pd.isna(uid) else shard_of.get(int(uid), "default"))
+
+def sync_shard_map():
+    """
+    Points every user with a resource row at that row's shard and moves their
+    tasks, archived tasks and training progress along. Returns users moved.
+    """
+    router = get_router()
+    if not router: return 0
+    backends = router.all()
+    found = fan_out(lambda b: b.read_df("SELECT DISTINCT user_id FROM resource_tracker_v4 WHERE user_id IS NOT NULL"), backends)
+    wanted = {}
+    for backend, df in zip(backends, found):
+        name = backend.shard_name
+        for uid in df['user_id'].astype('int64'): wanted[int(uid)] = min(wanted.get(int(uid), name), name)
+    current = dict(get_backend().read_df("SELECT user_id, shard FROM shard_map").itertuples(index=False, name=None))
+    moved = {uid: shard for uid, shard in wanted.items() if current.get(uid, "default") != shard}
+    for uid, shard in moved.items():
+        src, dst = router.shard(current.get(uid, "default")), router.shard(shard)
+        for table, col in (('tasks_v2', 'pilot_user_id'), ('tasks_archive', 'pilot_user_id'), ('training_progress', 'user_id')):
+            _move_rows(table, f"{col}=?", (uid,), src, dst)
+        get_backend().execute(upsert_sql("shard_map", ["user_id", "shard"], ["user_id"]), (uid, shard))
+    return len(moved)
+
+def distribute_to_shards():
+    """
+    Moves rows of SHARDED_TABLES still in the main file (data from before
+    sharding was enabled, or fresh seed data) into their shards. Returns rows moved.
+    """
+    router, main = get_router(), get_backend()
+    moved = 0
+    res = main.read_df(f"SELECT id, {router.column} FROM resource_tracker_v4")
+    for key, ids in res.groupby(res[router.column].map(_shard_name))['id']:
+        ids = ids.tolist()
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            moved += _move_rows("resource_tracker_v4", f"id IN ({','.join(['?'] * len(batch))})", batch, main, router.shard(key))
+    if moved: sync_shard_map()
+    shard_of = dict(main.read_df("SELECT user_id, shard FROM shard_map").itertuples(index=False, name=None))
+    for table, col in (('tasks_v2', 'pilot_user_id'), ('tasks_archive', 'pilot_user_id'), ('training_progress', 'user_id')):
+        for uid in main.read_df(f"SELECT DISTINCT {col} FROM {table}")[col]:
+            if pd.isna(uid): where, params, target = f"{col} IS NULL", (), "default"
+            else: where, params, target = f"{col}=?", (int(uid),), shard_of.get(int(uid), "default")
+            moved += _move_rows(table, where, params, main, router.shard(target))
+    return moved
+
+# ---------- SCHEMA & SEEDING ----------
+def _seed_empty(c, table):
+    """No rows in table here nor, when sharded, in any shard."""
+    if c.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone(): return False
+    return not get_router() or not any(fan_out(lambda b: b.scalar(f"SELECT 1 FROM {table} LIMIT 1")))
+
+def seed_data(c):
+    """
+    Only inserts what is missing, so existing passwords are never reset and
+    init_db() on every rerun doesn't pay for password hashing. Returns True
+    when it seeded a sharded table (the rows start out in the main file).
+    """
+    seeded = False
+
+    # 1. CREATE FIXED USERS (Only if they don't exist)
+    mandatory_users = [
+        ("admin", "admin123", "Super Admin", "System Admin", "ADM-000"),
+        ("leader", "123", "Team Leader", "Sarah Jenkins", "LDR-001"),
+        ("member", "123", "Team Member", "David Chen", "EMP-101")
+    ]
+
+    existing = {r[0] for r in c.execute("SELECT username FROM users WHERE username IN (?, ?, ?)",
+                                        [u[0] for u in mandatory_users]).fetchall()}
+    for u_user, u_pass, u_role, u_name, u_id in mandatory_users:
+        if u_user in existing: continue
+        # Empty img = initials avatar generated locally (avatars.py)
+        c.execute("INSERT INTO users (username, password, role, name, emp_id, img, created_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                  "ON CONFLICT (username) DO NOTHING",
+                  (u_user, hash_password(u_pass), u_role, u_name, u_id, '', str(date.today())))
+    _assign_user_ids(c)
+
+    # 2. FILL RANDOM KPI TASKS (Only if table empty)
+    if _seed_empty(c, "tasks_v2"):
+        seeded = True
+        pilots = c.execute("SELECT user_id, name FROM users WHERE role='Team Member'").fetchall()
+        if not pilots: pilots = [(None, "David Chen")]
+
+        for i in range(1, 21):
+            pilot_uid, pilot = random.choice(pilots)
+            status = random.choice(["Completed", "Inprogress", "Hold", "Cancelled"])
+            start = date.today() - timedelta(days=random.randint(10, 60))
+            due = start + timedelta(days=random.randint(5, 20))
+
+            actual, otd = "", "N/A"
+            if status == "Completed":
+                delay = random.choice([-2, -1, 0, 1, 5])
+                actual_dt = due + timedelta(days=delay)
+                actual = str(actual_dt)
+                otd = "OK" if actual_dt <= due else "NOT OK"
+
+            c.execute(f"INSERT INTO tasks_v2 ({', '.join(TASK_INSERT_COLS)}) VALUES ({','.join(['?'] * len(TASK_INSERT_COLS))})",
+                      (new_id(), pilot, f"Project Task {i:02d}", str(start), actual, str(due),
+                       status, "Yes", f"REF-{1000+i}", "Yes", otd,
+                       f"Description for task {i}", "Standard",
+                       "Yes", str(start), str(start), otd, "None", "QA-Ref", "Lead-X", "Mgr-Y", pilot_uid))
+
+    # 3. FILL TRAINING (Only if empty)
+    if c.execute("SELECT count(*) FROM training_repo").fetchone()[0] == 0:
+        topics = ["Python Basics", "Safety Protocols", "Leadership 101", "Agile", "Communication", "Data Privacy", "Cyber Security", "Excel Advanced", "Power BI", "SQL Funda"]
+        for t in topics:
+            c.execute(TRAINING_INSERT_SQL,
+                      (new_id(), t, f"Learn about {t}", "http://example.com",
+                       random.choice(["All", "Team Leader", "Team Member"]), random.choice([0, 1]), "System"))
+
+    # 4. FILL RESOURCES (Only if empty)
+    if _seed_empty(c, "resource_tracker_v4"):
+        seeded = True
+        depts = ["Engineering", "Quality", "Manufacturing"]
+        locs = ["Chennai", "Bangalore", "Pune"]
+        for i in range(10):
+            status = random.choice(["Active", "Active", "Inactive"])
+            exit_date = str(date.today()) if status == "Inactive" else ""
+            reason = "Resigned" if status == "Inactive" else ""
+            c.execute(RESOURCE_INSERT_SQL,
+                      (new_id(), f"Resource {i}", f"RES-{i}", "001",
+                       random.choice(depts), random.choice(locs), "Sarah Jenkins", str(date.today()),
+                       "MID", status, "PO-123", "", exit_date, "No", reason,
+                       str(random.randint(20, 50)), "5"))
+    return seeded
+
+def init_db():
+    with get_backend().connect() as c:
+        # Create Tables
+        c.execute('''CREATE TABLE IF NOT EXISTS table_generations (
+            table_name TEXT PRIMARY KEY, generation INTEGER)''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY, password TEXT, role TEXT, name TEXT,
+            emp_id TEXT, img TEXT, created_at TEXT, user_id INTEGER)''')
+        # Logins match case-insensitively
+        c.execute("CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))")
+
+        # Portal-wide settings (session signing key)
+        c.execute("CREATE TABLE IF NOT EXISTS portal_settings (key TEXT PRIMARY KEY, value TEXT)")
+
+        _create_sharded_tables(c)
+
+        # Overdue / due-soon tasks and their counts per scope, rebuilt by alerts.refresh_alerts()
+        c.execute('''CREATE TABLE IF NOT EXISTS task_alerts (
+            task_id TEXT PRIMARY KEY, pilot_user_id INTEGER, project_lead TEXT, kind TEXT, days_to_due INTEGER)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS alert_counts (
+            scope TEXT, key TEXT, overdue INTEGER, due_soon INTEGER, refreshed_at TEXT, PRIMARY KEY (scope, key))''')
+
+        # Every task status change; stint_days = time spent in from_status, lead_days = receipt -> delivery (first completion)
+        c.execute('''CREATE TABLE IF NOT EXISTS task_status_history (
+            task_id TEXT, from_status TEXT, to_status TEXT, changed_at TEXT, pilot_user_id INTEGER,
+            project_lead TEXT, stint_days REAL, lead_days REAL)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_task_status_history_task ON task_status_history (task_id, to_status, changed_at)")
+        # Day-bucket histograms of those durations per scope ('all', 'pilot', 'lead'), kept in step by _record_transition
+        c.execute('''CREATE TABLE IF NOT EXISTS cycle_time_hist (
+            scope TEXT, key TEXT, metric TEXT, days INTEGER, n INTEGER, total REAL,
+            PRIMARY KEY (scope, key, metric, days))''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS training_repo (
+            id TEXT PRIMARY KEY, title TEXT, description TEXT, link TEXT,
+            role_target TEXT, mandatory INTEGER, created_by TEXT, row_hash TEXT)''')
+
+        # user_id -> shard file of their resource row (PORTAL_SHARD_BY mode)
+        c.execute("CREATE TABLE IF NOT EXISTS shard_map (user_id INTEGER PRIMARY KEY, shard TEXT)")
+
+        c.execute('''CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id TEXT PRIMARY KEY, table_name TEXT, file_name TEXT, status TEXT,
+            rows_total INTEGER, rows_done INTEGER, rows_rejected INTEGER, error TEXT,
+            submitted_by TEXT, submitted_at TEXT, started_at TEXT, finished_at TEXT,
+            rows_inserted INTEGER, rows_updated INTEGER, rows_unchanged INTEGER, heartbeat_at TEXT, content_key TEXT)''')
+
+        # Last run of each scheduler.py job; claimed with a conditional UPDATE
+        c.execute('''CREATE TABLE IF NOT EXISTS scheduled_runs (
+            name TEXT PRIMARY KEY, last_run TEXT, status TEXT, result TEXT, finished_at TEXT)''')
+
+        # Size, free pages and row counts per database file, sampled by maintenance.py
+        c.execute('''CREATE TABLE IF NOT EXISTS db_telemetry (
+            taken_at TEXT, db TEXT, metric TEXT, value REAL, PRIMARY KEY (taken_at, db, metric))''')
+
+        migrate_user_keys(c)
+        migrate_import_keys(c)
+        seeded = seed_data(c)
+    router = get_router()
+    if router:
+        # Rows only land in main from before sharding or from seeding, so this
+        # runs once per process rather than on every rerun
+        with _distribute_lock:
+            if seeded or router.main.path not in _distributed:
+                distribute_to_shards()
+                _distributed.add(router.main.path)
+
+def _create_sharded_tables(c):
+    c.execute(f"CREATE TABLE IF NOT EXISTS tasks_v2 ({TASK_DDL}, row_hash TEXT)")
+    # Open-task scans by status and commitment date (alerts.py)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_v2_status_commitment ON tasks_v2 (status, commitment_date_to_customer)")
+
+    # Completed/Cancelled tasks past ARCHIVE_AFTER_DAYS, moved by archive_tasks()
+    c.execute(f"CREATE TABLE IF NOT EXISTS tasks_archive ({TASK_DDL}, archived_at TEXT)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_pilot ON tasks_archive (name_activity_pilot)")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS training_progress (
+        user_id INTEGER, training_id TEXT, user_name TEXT, status TEXT,
+        last_updated TEXT, PRIMARY KEY (user_id, training_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS resource_tracker_v4 (
+        id TEXT PRIMARY KEY, employee_name TEXT, employee_id TEXT, dev_code TEXT,
+        department TEXT, location TEXT, reporting_manager TEXT, onboarding_date TEXT,
+        experience_level TEXT, status TEXT, po_details TEXT, remarks TEXT,
+        effective_exit_date TEXT, backfill_status TEXT, reason_for_leaving TEXT,
+        hourly_rate TEXT, hardware_daily_cost TEXT, user_id INTEGER, row_hash TEXT)''')
+
+def _init_shard(c):
+    """Schema of a shard file: its own generation counters plus SHARDED_TABLES and their indexes."""
+    c.execute("CREATE TABLE IF NOT EXISTS main.table_generations (table_name TEXT PRIMARY KEY, generation INTEGER)")
+    _create_sharded_tables(c)
+    for table in ('tasks_v2', 'tasks_archive'):
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_pilot_user_id ON {table} (pilot_user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_resource_user_id ON resource_tracker_v4 (user_id)")
+    for table, cols in (('tasks_v2', IMPORT_KEYS['tasks']), ('tasks_archive', IMPORT_KEYS['tasks']),
+                        ('resource_tracker_v4', IMPORT_KEYS['resources'])):
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_key_{'_'.join(cols)} ON {table} ({', '.join(cols)})")
+
+# ---------- MIGRATIONS ----------
+def _columns(c, table):
+    return [d[0] for d in c.execute(f"SELECT * FROM {table} LIMIT 0").description]
+
+def _assign_user_ids(c):
+    """Gives every user that lacks one the next integer user_id."""
+    pending = [r[0] for r in c.execute("SELECT username FROM users WHERE user_id IS NULL ORDER BY created_at, username").fetchall()]
+    if pending:
+        start = c.execute("SELECT COALESCE(MAX(user_id), 0) FROM users").fetchone()[0]
+        c.executemany("UPDATE users SET user_id=? WHERE username=?", [(start + i + 1, u) for i, u in enumerate(pending)])
+
+# Duplicate display names resolve to the lowest user_id
+_USER_ID_BY_NAME = "(SELECT MIN(u.user_id) FROM users u WHERE u.name={})"
+
+def migrate_user_keys(c):
+    """
+    Tasks, training progress and resources reference users by integer user_id
+    instead of display name. Adds the columns/indexes to databases created
+    before the change and resolves existing names once; no-op afterwards.
+    """
+    if 'user_id' not in _columns(c, 'users'):
+        c.execute("ALTER TABLE users ADD COLUMN user_id INTEGER")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users (name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_emp_id ON users (emp_id)")
+    _assign_user_ids(c)
+
+    for table in ('tasks_v2', 'tasks_archive'):
+        if 'pilot_user_id' not in _columns(c, table):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN pilot_user_id INTEGER")
+            c.execute(f"UPDATE {table} SET pilot_user_id={_USER_ID_BY_NAME.format(table + '.name_activity_pilot')}")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_pilot_user_id ON {table} (pilot_user_id)")
+
+    if 'user_id' not in _columns(c, 'resource_tracker_v4'):
+        c.execute("ALTER TABLE resource_tracker_v4 ADD COLUMN user_id INTEGER")
+        c.execute("UPDATE resource_tracker_v4 SET user_id=(SELECT MIN(u.user_id) FROM users u WHERE u.emp_id=resource_tracker_v4.employee_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_resource_user_id ON resource_tracker_v4 (user_id)")
+
+    if 'user_id' not in _columns(c, 'training_progress'):
+        # Old primary key was (user_name, training_id); rebuild keyed on the integer id
+        c.execute('''CREATE TABLE training_progress_new (
+            user_id INTEGER, training_id TEXT, user_name TEXT, status TEXT,
+            last_updated TEXT, PRIMARY KEY (user_id, training_id))''')
+        c.execute(f"INSERT INTO training_progress_new ({', '.join(PROGRESS_COLS)}) "
+                  f"SELECT {_USER_ID_BY_NAME.format('p.user_name')}, p.training_id, p.user_name, p.status, p.last_updated "
+                  f"FROM training_progress p WHERE EXISTS (SELECT 1 FROM users u WHERE u.name=p.user_name) "
+                  f"ON CONFLICT (user_id, training_id) DO NOTHING")
+        # Rows whose user_name matches no user (renamed/deleted) are kept aside, not dropped
+        c.execute("CREATE TABLE training_progress_unresolved AS SELECT * FROM training_progress p "
+                  "WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.name=p.user_name)")
+        c.execute("DROP TABLE training_progress")
+        c.execute("ALTER TABLE training_progress_new RENAME TO training_progress")
+
+def migrate_import_keys(c):
+    """Adds row_hash, the natural-key indexes and the import_jobs outcome counters."""
+    for col, kind in (('rows_inserted', 'INTEGER'), ('rows_updated', 'INTEGER'), ('rows_unchanged', 'INTEGER'), ('heartbeat_at', 'TEXT'),
+                      ('content_key', 'TEXT')):
+        if col not in _columns(c, 'import_jobs'):
+            c.execute(f"ALTER TABLE import_jobs ADD COLUMN {col} {kind}")
+    for name, cols in IMPORT_KEYS.items():
+        table = TABLES[name]
+        if 'row_hash' not in _columns(c, table):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN row_hash TEXT")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_key_{'_'.join(cols)} ON {table} ({', '.join(cols)})")
+    # Task keys are also checked against the archive so archived tasks aren't re-imported
+    cols = IMPORT_KEYS['tasks']
+    c.execute(f"CREATE INDEX IF NOT EXISTS idx_tasks_archive_key_{'_'.join(cols)} ON tasks_archive ({', '.join(cols)})")
+
+# ---------- UTILS & HELPERS ----------
+
+def select_sql(table, columns, allowed):
+    """SELECT of the requested columns only (all when None); names are checked against the schema."""
+    if not columns: return f"SELECT * FROM {table}"
+    unknown = set(columns) - set(allowed)
+    if unknown: raise ValueError(f"Unknown columns for {table}: {sorted(unknown)}")
+    return f"SELECT {', '.join(columns)} FROM {table}"
+
+def compact_dtypes(df):
+    """Categoricals for repeated strings, floats for rates, nullable ints for user keys."""
+    for col in df.columns:
+        if col in CATEGORY_COLS: df[col] = df[col].astype('category')
+        elif col in NUMERIC_COLS: df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+        elif col.endswith('user_id'): df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int32')
+    return df
+
+def parse_dates(series):
+    """ISO dates as written by the app, then day-first for hand-typed CSV values; NaT otherwise."""
+    s = pd.Series(series).replace({'': None, 'None': None})
+    iso = pd.to_datetime(s, format='ISO8601', errors='coerce')
+    rest = iso.isna() & s.notna()
+    if rest.any():
+        iso[rest] = pd.to_datetime(s[rest], format='mixed', dayfirst=True, errors='coerce')
+    return iso
+
+def _generations(backend, tables):
+    with backend.connect() as c:
+        rows = dict(c.execute(f"SELECT table_name, generation FROM table_generations "
+                              f"WHERE table_name IN ({','.join(['?'] * len(tables))})", tables).fetchall())
+    return {t: rows.get(t, 0) for t in tables}
+
+def data_generation(*tables, reader=False):
+    """
+    Write counters for the given tables; any committed write changes the tuple.
+    Sharded tables sum their counters over the shards.
+    """
+    pick = _pick(reader)
+    gens = _generations(pick(get_backend()), tables)
+    split = [t for t in tables if t in SHARDED_TABLES]
+    if split and get_router():
+        per_shard = fan_out(lambda b: _generations(pick(b), split))
+        gens.update({t: sum(g[t] for g in per_shard) for t in split})
+    return tuple(gens[t] for t in tables)
+
+def cached_by_generation(*tables, maxsize=32, reader=False):
+    """
+    Memoizes a reader until one of the tables is written. Callers must not mutate
+    the result. reader=True for functions reading get_backend().reader(), so the
+    generation comes from the same (possibly snapshot) data.
+    """
+    def deco(fn):
+        cache, lock = {}, threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (id(get_backend()), args, tuple(sorted(kwargs.items())))
+            gen = data_generation(*tables, reader=reader)
+            with lock: hit = cache.get(key)
+            if hit and hit[0] == gen: return hit[1]
+            value = fn(*args, **kwargs)
+            with lock:
+                if len(cache) >= maxsize: cache.pop(next(iter(cache)))
+                cache[key] = (gen, value)
+            return value
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return deco
+
+def _row_hashes(df):
+    """Content fingerprint per row over df's columns (names included)."""
+    if df.empty: return []
+    text = df.astype(object).where(df.notna(), '\0').astype(str)
+    joined = text.iloc[:, 0].str.cat([text[c] for c in text.columns[1:]], sep='\x1f')
+    sig = "\x1f".join(df.columns) + "\n"
+    return [hashlib.blake2b((sig + s).encode(), digest_size=8).hexdigest() for s in joined]
+
+def _key_frame(df, key_cols):
+    return pd.DataFrame({k: (df[k] if k in df else pd.Series('', index=df.index)).fillna('').astype(str).str.strip()
+                         for k in key_cols}, index=df.index)
+
+def _existing_keys(c, table, keys, key_cols, hash_col="row_hash", batch=500):
+    """(_id, _hash, key columns) of table rows matching keys, looked up on the first key column (indexed)."""
+    found = []
+    first = keys[key_cols[0]].unique().tolist()
+    for i in range(0, len(first), batch):
+        vals = first[i:i + batch]
+        where = f"{key_cols[0]} IN ({','.join(['?'] * len(vals))})" + (f" OR {key_cols[0]} IS NULL" if '' in vals else "")
+        found.extend(c.execute(f"SELECT id, {hash_col}, {', '.join(key_cols)} FROM {table} WHERE {where}", vals).fetchall())
+    existing = pd.DataFrame(found, columns=['_id', '_hash', *key_cols])
+    existing = _key_frame(existing, key_cols).assign(_id=existing['_id'], _hash=existing['_hash'])
+    return existing.sort_values('_id', kind='stable').drop_duplicates(key_cols)
+
+def upsert_rows(c, table, df, key_cols, archive=None, batch=500, on_write=None):
+    """
+    Writes df (columns named as in the table, values ready to bind) on the
+    natural key: unseen keys are inserted with new ids, rows whose row_hash
+    differs are updated, identical rows are skipped. row_hash fingerprints
+    what was last imported, so re-uploading the same extract leaves edits
+    made in the app alone. Keys already moved to the `archive` table are
+    skipped too. Rows with an empty key can't be matched, so they are told
+    apart by row_hash: one already stored counts as unchanged.
+    on_write(c, written, old) runs after the writes with the inserted/updated
+    rows (with ids) and the stored rows they replaced.
+    Returns {'inserted', 'updated', 'unchanged'}.
+    """
+    allowed = set(_columns(c, table))
+    bad = [k for k in [*key_cols, *df.columns] if k not in allowed]
+    if bad: raise ValueError(f"Unknown column(s) for {table}: {bad}")
+    data_cols = [col for col in df.columns if col not in ('id', 'row_hash')]
+    df = df[data_cols].astype(object)
+    df = df.where(df.notna(), None)
+    df['row_hash'] = _row_hashes(df[data_cols])
+    keys = _key_frame(df, key_cols)
+    keyed = keys.ne('').any(axis=1)
+    # Last occurrence of a key within the file wins; keyless rows dedupe on content
+    df = df[~keys.assign(_hash=df['row_hash'].where(~keyed, '')).duplicated(keep='last')]
+    keys, keyed = keys.loc[df.index], keyed.loc[df.index]
+
+    existing = _existing_keys(c, table, keys[keyed], key_cols, batch=batch)
+    match = keys[keyed].reset_index().merge(existing, on=key_cols, how='left').set_index('index')
+    target_id = match['_id'].reindex(df.index)
+    same = (match['_hash'] == df.loc[match.index, 'row_hash']).reindex(df.index, fill_value=False)
+
+    ins_mask = target_id.isna()
+    if archive and (ins_mask & keyed).any():
+        fresh = keys[ins_mask & keyed]
+        archived = fresh.reset_index().merge(_existing_keys(c, archive, fresh, key_cols, hash_col="NULL", batch=batch),
+                                             on=key_cols)['index']
+        same.loc[archived.values] = True
+        ins_mask.loc[archived.values] = False
+    if (~keyed).any():
+        hashes = df.loc[~keyed, ['row_hash']]
+        stored = _existing_keys(c, table, hashes, ['row_hash'], hash_col="NULL", batch=batch)['row_hash']
+        seen = hashes.index[hashes['row_hash'].isin(stored)]
+        same.loc[seen] = True
+        ins_mask.loc[seen] = False
+
+    upd = df[target_id.notna() & ~same]
+    ins = df[ins_mask]
+    old = pd.DataFrame(columns=['id'])
+    if on_write and not upd.empty:
+        ids, rows = target_id[upd.index].tolist(), []
+        for i in range(0, len(ids), batch):
+            cur = c.execute(f"SELECT * FROM {table} WHERE id IN ({','.join(['?'] * len(ids[i:i + batch]))})", ids[i:i + batch])
+            rows += cur.fetchall()
+        old = pd.DataFrame(rows, columns=[d[0] for d in cur.description])
+    if not upd.empty:
+        cols = [*data_cols, 'row_hash']
+        c.executemany(f"UPDATE {table} SET {', '.join(f'{col}=?' for col in cols)} WHERE id=?",
+                      [(*row, rid) for row, rid in zip(upd[cols].itertuples(index=False, name=None), target_id[upd.index])])
+    if not ins.empty:
+        ins = ins.assign(id=new_ids(len(ins)))
+        cols = ['id', *data_cols, 'row_hash']
+        c.executemany(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({','.join(['?'] * len(cols))})",
+                      ins[cols].itertuples(index=False, name=None))
+    if on_write: on_write(c, pd.concat([upd.assign(id=target_id[upd.index].values), ins]), old)
+    return {'inserted': len(ins), 'updated': len(upd), 'unchanged': int(same.sum())}
+
+def generate_temp_password(length=8):
+    chars = string.ascii_letters + string.digits
+    return ''.join(random.choice(chars) for i in range(length))
+
+def get_all_users():
+    return get_backend().read_df("SELECT * FROM users")
+
+def get_pilots():
+    return get_backend().read_df("SELECT user_id, name FROM users WHERE role='Team Member' ORDER BY name")
+
+def resolve_user_ids(names):
+    """Maps display names to user_id (lowest id for duplicated names)."""
+    df = get_backend().read_df("SELECT name, MIN(user_id) AS user_id FROM users GROUP BY name")
+    return pd.Series(names).map(dict(zip(df['name'], df['user_id']))).astype("Int64")
+
+def authenticate(username, password):
+    """
+    Returns the users row as a dict (without the password, with its session
+    stamp), or None. A plaintext or outdated stored password is re-hashed on success.
+    """
+    df = get_backend().read_df("SELECT * FROM users WHERE LOWER(username)=?", (username.lower(),))
+    for row in df.to_dict('records'):
+        ok, rehash = verify_password(password, row['password'])
+        if not ok: continue
+        if rehash:
+            row['password'] = hash_password(password)
+            get_backend().execute("UPDATE users SET password=? WHERE username=?", (row['password'], row['username']))
+        row['stamp'] = user_stamp(row.pop('password'), row['role'])
+        return row
+    return None
+
+def session_user(username):
+    """{'stamp', 'img'} to check a restored session against; None if the user no longer exists."""
+    with get_backend().connect() as c:
+        row = c.execute("SELECT password, role, img FROM users WHERE username=?", (username,)).fetchone()
+    return {'stamp': user_stamp(row[0], row[1]), 'img': row[2]} if row else None
+
+def check_password(username, password):
+    """True if password matches the stored one for username."""
+    return verify_password(password, get_backend().scalar("SELECT password FROM users WHERE username=?", (username,)))[0]
+
+@functools.lru_cache(maxsize=8)
+def _session_secret(backend):
+    if os.environ.get("PORTAL_SESSION_SECRET"): return os.environ["PORTAL_SESSION_SECRET"]
+    with backend.connect() as c:
+        c.execute("INSERT INTO portal_settings (key, value) VALUES ('session_secret', ?) ON CONFLICT (key) DO NOTHING",
+                  (uuid.uuid4().hex + uuid.uuid4().hex,))
+        return c.execute("SELECT value FROM portal_settings WHERE key='session_secret'").fetchone()[0]
+
+def session_secret():
+    """Key for signing session tokens: PORTAL_SESSION_SECRET, else one generated and stored in portal_settings."""
+    return _session_secret(get_backend())
+
+def save_user_entry(data, is_update=False):
+    with get_backend().connect() as c:
+        if is_update:
+            # A blank password keeps the current one
+            if data.get('password'):
+                c.execute("UPDATE users SET password=? WHERE username=?", (hash_password(data['password']), data['username']))
+            c.execute("UPDATE users SET role=?, name=?, emp_id=?, img=? WHERE username=?",
+                      (data['role'], data['name'], data['emp_id'], data['img'], data['username']))
+            # Names are display-only copies; keep them in step with a rename
+            uid = c.execute("SELECT user_id FROM users WHERE username=?", (data['username'],)).fetchone()[0]
+            _execute_sharded(c, "UPDATE tasks_v2 SET name_activity_pilot=? WHERE pilot_user_id=?", (data['name'], uid))
+            _execute_sharded(c, "UPDATE tasks_archive SET name_activity_pilot=? WHERE pilot_user_id=?", (data['name'], uid))
+            _execute_sharded(c, "UPDATE training_progress SET user_name=? WHERE user_id=?", (data['name'], uid))
+        else:
+            c.execute(upsert_sql("users", USER_COLS, ["username"]),
+                      (data['username'], hash_password(data['password']), data['role'], data['name'], data['emp_id'], data['img'], str(date.today())))
+            _assign_user_ids(c)
+
+def hash_plaintext_passwords():
+    """Hashes every password still stored in plaintext; returns how many were updated."""
+    df = get_backend().read_df("SELECT username, password FROM users WHERE password NOT LIKE 'pbkdf2_sha256$%'")
+    if df.empty: return 0
+    get_backend().executemany("UPDATE users SET password=? WHERE username=?",
+                              list(zip(hash_passwords(df['password'].fillna('').tolist()), df['username'])))
+    return len(df)
+
+def delete_user(username):
+    get_backend().execute("DELETE FROM users WHERE username=?", (username,))
+
+def import_users_df(df):
+    # Hashed values (e.g. from an export) pass through; plaintext is hashed in parallel
+    hashed = hash_passwords(df['password'].tolist())
+    rows = [(row['username'], pw, row['role'], row['name'],
+             row.get('emp_id',''), row.get('img',''), str(date.today())) for pw, (_, row) in zip(hashed, df.iterrows())]
+    with get_backend().connect() as c:
+        names = list({r[0] for r in rows})
+        known = sum(c.execute(f"SELECT count(*) FROM users WHERE username IN ({','.join(['?'] * len(names[i:i + 500]))})",
+                              names[i:i + 500]).fetchone()[0] for i in range(0, len(names), 500))
+        c.executemany(upsert_sql("users", USER_COLS, ["username"]), rows)
+        _assign_user_ids(c)
+    return {'inserted': len(names) - known, 'updated': known, 'unchanged': 0}
+
+# --- NEW HELPERS FOR PROFILE ---
+def get_user_resource_details(emp_id):
+    """Fetches details from resource_tracker based on Employee ID (excluding costs)"""
+    try:
+        df = read_sharded("SELECT * FROM resource_tracker_v4 WHERE employee_id=?", (emp_id,), reader=False)
+    except:
+        df = pd.DataFrame()
+    return df
+
+def update_user_credentials(username, new_password=None, new_img=None):
+    with get_backend().connect() as c:
+        if new_password:
+            c.execute("UPDATE users SET password=? WHERE username=?", (hash_password(new_password), username))
+        if new_img is not None:
+            c.execute("UPDATE users SET img=? WHERE username=?", (new_img, username))
+
+# --- KPI HELPERS ---
+def get_kpi_data(columns=None, snapshot=False):
+    """The KPI board reads live; snapshot=True (exports) may read the stale reader copy."""
+    # Column validation raises; only the read itself falls back to an empty frame
+    query = select_sql("tasks_v2", columns, TASK_INSERT_COLS)
+    try: df = compact_dtypes(read_sharded(query, reader=True if snapshot else 'live'))
+    except: df = pd.DataFrame(columns=columns)
+    return df
+
+def get_task(task_id):
+    return read_sharded("SELECT * FROM tasks_v2 WHERE id=?", (task_id,), reader=False)
+
+def get_pilot_tasks(user_id, columns=None):
+    return compact_dtypes(shard_for_user(user_id).read_df(select_sql("tasks_v2", columns, TASK_INSERT_COLS) + " WHERE pilot_user_id=?", (user_id,)))
+
+def get_tasks_page(after_id=None, limit=200):
+    """Keyset pagination: ids sort by creation time, so the last id of a page is the next cursor."""
+    if after_id:
+        df = read_sharded("SELECT * FROM tasks_v2 WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit), reader=False)
+    else:
+        df = read_sharded("SELECT * FROM tasks_v2 ORDER BY id LIMIT ?", (limit,), reader=False)
+    # Each shard returns its own first page; keep the overall first `limit`
+    return df.sort_values('id', kind='stable').head(limit).reset_index(drop=True)
+
+def compute_otd(actual, commitment):
+    otd_val = "N/A"
+    try:
+        if actual and commitment and actual != 'None' and commitment != 'None':
+            a_dt, c_dt = parse_dates([actual, commitment])
+            if not pd.isna(a_dt) and not pd.isna(c_dt):
+                otd_val = "OK" if a_dt <= c_dt else "NOT OK"
+    except: pass
+    return otd_val
+
+def save_kpi_task(data, task_id=None):
+    otd_val = compute_otd(data.get("actual_delivery_date"), data.get("commitment_date_to_customer"))
+    data['otd_internal'] = otd_val; data['otd_customer'] = otd_val
+    vals = [str(data.get(k, '')) if data.get(k) is not None else '' for k in TASK_COLS]
+    pilot_uid = data.get('pilot_user_id')
+    if pilot_uid is None: pilot_uid = resolve_user_ids([data.get('name_activity_pilot')])[0]
+    vals.append(None if pd.isna(pilot_uid) else int(pilot_uid))
+
+    target = shard_for_user(vals[-1])
+    if task_id:
+        # A new pilot in another shard takes the task (and its row_hash) along
+        home = _shard_with_row("tasks_v2", task_id)
+        if home is not None and home is not target: _move_rows("tasks_v2", "id=?", (task_id,), home, target)
+    task = dict(zip(TASK_COLS + ['pilot_user_id'], vals))
+    with target.connect() as c:
+        if task_id:
+            old = c.execute("SELECT status FROM tasks_v2 WHERE id=?", (task_id,)).fetchone()
+            # Only the columns the caller gave; the rest (receipt date, lead, ...) keep their stored values
+            cols = [col for col in TASK_COLS if col in data] + ['pilot_user_id']
+            c.execute(f"UPDATE tasks_v2 SET {', '.join(f'{col}=?' for col in cols)} WHERE id=?",
+                      (*[task[col] for col in cols], task_id))
+            row = c.execute("SELECT date_of_receipt, project_lead FROM tasks_v2 WHERE id=?", (task_id,)).fetchone()
+            if row: task.update(date_of_receipt=row[0], project_lead=row[1])
+        else:
+            task_id, old = new_id(), None
+            c.execute(f"INSERT INTO tasks_v2 ({', '.join(TASK_INSERT_COLS)}) VALUES ({','.join(['?'] * len(TASK_INSERT_COLS))})",
+                      (task_id, *vals))
+        _record_transition(c, task_id, old[0] if old else None, task)
+
+def update_task_status(task_id, status, actual_delivery_date):
+    with (_shard_with_row("tasks_v2", task_id) or get_backend()).connect() as c:
+        row = c.execute("SELECT status, pilot_user_id, project_lead, date_of_receipt FROM tasks_v2 WHERE id=?", (task_id,)).fetchone()
+        c.execute("UPDATE tasks_v2 SET status=?, actual_delivery_date=? WHERE id=?", (status, actual_delivery_date, task_id))
+        if row:
+            _record_transition(c, task_id, row[0], {'status': status, 'pilot_user_id': row[1], 'project_lead': row[2],
+                                                    'date_of_receipt': row[3], 'actual_delivery_date': actual_delivery_date})
+
+_HIST_SQL = ("INSERT INTO cycle_time_hist (scope, key, metric, days, n, total) VALUES (?,?,?,?,1,?) "
+             "ON CONFLICT (scope, key, metric, days) DO UPDATE SET n=cycle_time_hist.n+1, total=cycle_time_hist.total+excluded.total")
+
+def cycle_scopes(pilot_user_id, project_lead):
+    """(scope, key) pairs a transition counts towards."""
+    return ([('all', '')] + ([('pilot', str(int(pilot_user_id)))] if pilot_user_id is not None else [])
+            + ([('lead', project_lead)] if project_lead else []))
+
+def _record_transition(c, task_id, old_status, task, when=None):
+    """
+    Appends a status change to task_status_history (in the caller's
+    transaction) and adds its durations to cycle_time_hist: the stint in
+    Inprogress/Hold it ends, and receipt-to-delivery on the first completion.
+    """
+    new_status = task.get('status')
+    if old_status == new_status: return
+    when = when or datetime.now()
+    uid = task.get('pilot_user_id')
+    uid = None if uid in (None, '') or pd.isna(uid) else int(uid)
+    lead = task.get('project_lead') or ''
+    stint = lead_days = None
+    if old_status in STINT_METRICS:
+        entered = c.execute("SELECT MAX(changed_at) FROM task_status_history WHERE task_id=? AND to_status=?",
+                            (task_id, old_status)).fetchone()[0]
+        if entered: stint = max((when - datetime.fromisoformat(entered)).total_seconds() / 86400, 0)
+    if new_status == 'Completed' and not c.execute(
+            "SELECT 1 FROM task_status_history WHERE task_id=? AND to_status='Completed'", (task_id,)).fetchone():
+        received, delivered = parse_dates([task.get('date_of_receipt'), task.get('actual_delivery_date') or str(when.date())])
+        if not (pd.isna(received) or pd.isna(delivered)): lead_days = float(max((delivered - received).days, 0))
+    c.execute("INSERT INTO task_status_history (task_id, from_status, to_status, changed_at, pilot_user_id, project_lead, "
+              "stint_days, lead_days) VALUES (?,?,?,?,?,?,?,?)",
+              (task_id, old_status, new_status, when.isoformat(timespec="seconds"), uid, lead, stint, lead_days))
+    samples = [(m, d) for m, d in ((STINT_METRICS.get(old_status), stint), ('lead_time', lead_days)) if d is not None]
+    if samples:
+        c.executemany(_HIST_SQL, [(scope, key, m, min(int(d), CYCLE_MAX_DAYS), d)
+                                  for m, d in samples for scope, key in cycle_scopes(uid, lead)])
+
+def import_kpi_df(df):
+    """Upserts tasks on IMPORT_KEYS['tasks']; returns inserted/updated/unchanged counts."""
+    if 'pilot_user_id' not in df.columns and 'name_activity_pilot' in df.columns:
+        df = df.assign(pilot_user_id=resolve_user_ids(df['name_activity_pilot'].tolist()).values)
+    cols = [c for c in TASK_COLS + ['pilot_user_id'] if c in df.columns]
+    return _upsert_routed("tasks_v2", df[cols], IMPORT_KEYS['tasks'], archive="tasks_archive", on_write=_import_transitions,
+                          route=lambda d: _user_shards(d['pilot_user_id']) if 'pilot_user_id' in d else "default")
+
+def _import_transitions(c, written, old):
+    """Status changes made by an import are recorded like edits in the app."""
+    if 'status' not in written: return
+    before = {r['id']: r for r in old.to_dict('records')}
+    for row in written.to_dict('records'):
+        if row['status'] is None: continue
+        prev = before.get(row['id'], {})
+        _record_transition(c, row['id'], prev.get('status'), {**prev, **row})
+
+# --- TASK ARCHIVE ---
+def archive_tasks(max_age_days=None, batch_size=500):
+    """Moves Completed/Cancelled tasks older than max_age_days into tasks_archive; returns rows moved."""
+    max_age_days = ARCHIVE_AFTER_DAYS if max_age_days is None else max_age_days
+    return sum(fan_out(lambda b: _archive_tasks(b, max_age_days, batch_size)))
+
+def _archive_tasks(backend, max_age_days, batch_size):
+    df = backend.read_df(
+        f"SELECT id, actual_delivery_date, commitment_date_to_customer FROM tasks_v2 "
+        f"WHERE status IN ({','.join(['?'] * len(ARCHIVE_STATUSES))})", ARCHIVE_STATUSES)
+    if df.empty: return 0
+    # Age from delivery, falling back to the commitment date (cancelled tasks have no delivery)
+    done_on = parse_dates(df['actual_delivery_date'])
+    due_on = parse_dates(df['commitment_date_to_customer'])
+    cutoff = pd.Timestamp(date.today() - timedelta(days=max_age_days))
+    ids = df.loc[done_on.fillna(due_on) < cutoff, 'id'].tolist()
+    cols = ", ".join(TASK_INSERT_COLS)
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        marks = ",".join(["?"] * len(batch))
+        with backend.connect() as c:
+            c.execute(f"INSERT INTO tasks_archive ({cols}, archived_at) SELECT {cols}, ? FROM tasks_v2 WHERE id IN ({marks})",
+                      (str(date.today()), *batch))
+            c.execute(f"DELETE FROM tasks_v2 WHERE id IN ({marks})", batch)
+    return len(ids)
+
+def search_archive(text="", pilot_user_id=None, limit=500):
+    query, params = "SELECT * FROM tasks_archive WHERE 1=1", []
+    if text:
+        query += " AND (LOWER(task_name) LIKE ? OR LOWER(reference_part_number) LIKE ?)"
+        params += [f"%{text.lower()}%"] * 2
+    if pilot_user_id is not None:
+        query += " AND pilot_user_id=?"; params.append(int(pilot_user_id))
+    query += " ORDER BY archived_at DESC LIMIT ?"; params.append(limit)
+    df = read_sharded(query, params)
+    return df.sort_values('archived_at', ascending=False, kind='stable').head(limit).reset_index(drop=True)
+
+# --- TRAINING HELPERS ---
+def add_training(title, desc, link, role, mandatory, creator):
+    tid = new_id()
+    get_backend().execute(TRAINING_INSERT_SQL,
+                          (tid, title, desc, link, role, 1 if mandatory else 0, creator))
+
+def delete_training(tid):
+    get_backend().execute("DELETE FROM training_repo WHERE id=?", (tid,))
+
+def delete_all_trainings():
+    with get_backend().connect() as c:
+        c.execute("DELETE FROM training_repo")
+        _execute_sharded(c, "DELETE FROM training_progress")
+
+def get_trainings(user_id=None):
+    repo = get_backend().read_df("SELECT * FROM training_repo")
+    if user_id is not None:
+        prog = shard_for_user(user_id).read_df("SELECT * FROM training_progress WHERE user_id=?", (user_id,))
+        if not repo.empty:
+            merged = pd.merge(repo, prog, left_on='id', right_on='training_id', how='left')
+            merged['status'] = merged['status'].fillna('Not Started')
+            return merged
+    return repo
+
+def update_training_status(user_id, training_id, status, user_name=''):
+    update_training_statuses(user_id, {training_id: status}, user_name)
+
+def update_training_statuses(user_id, statuses, user_name=''):
+    """Upserts {training_id: status} for one user in a single batched statement."""
+    if not statuses: return
+    today = str(date.today())
+    shard_for_user(user_id).executemany(upsert_sql("training_progress", PROGRESS_COLS, ["user_id", "training_id"]),
+                              [(user_id, tid, user_name, status, today) for tid, status in statuses.items()])
+
+def import_training_df(df):
+    """Upserts trainings on IMPORT_KEYS['trainings']; returns inserted/updated/unchanged counts."""
+    get = lambda col, default: df[col].fillna(default) if col in df else pd.Series(default, index=df.index)
+    rows = pd.DataFrame({'title': get('title', 'No Title'), 'description': get('description', ''),
+                         'link': get('link', '#'), 'role_target': get('role_target', 'All'),
+                         'mandatory': get('mandatory', 0).astype(int), 'created_by': 'Imported'})
+    with get_backend().connect() as c:
+        return upsert_rows(c, "training_repo", rows, IMPORT_KEYS['trainings'])
+
+# --- RESOURCE TRACKER HELPERS ---
+def get_resource_list(columns=None, snapshot=False):
+    query = select_sql("resource_tracker_v4", columns, ['id', 'user_id'] + RESOURCE_COLS)
+    try: df = compact_dtypes(read_sharded(query, reader=True if snapshot else 'live'))
+    except: df = pd.DataFrame(columns=columns)
+    return df
+
+def get_resource(res_id):
+    return compact_dtypes(read_sharded("SELECT * FROM resource_tracker_v4 WHERE id=?", (res_id,), reader=False))
+
+def save_resource_entry(data, res_id=None):
+    vals = [str(data.get(k, '')) for k in RESOURCE_COLS]
+    target = shard_for_key(data.get(SHARD_BY, ''))
+
+    if res_id:
+        # Update existing; a department change moves the row (and sync_shard_map the person's data)
+        home = _shard_with_row("resource_tracker_v4", res_id)
+        if home is not None and home is not target: _move_rows("resource_tracker_v4", "id=?", (res_id,), home, target)
+        set_clause = ", ".join([f"{col}=?" for col in RESOURCE_COLS])
+        target.execute(f"UPDATE resource_tracker_v4 SET {set_clause} WHERE id=?", (*vals, res_id))
+        sync_shard_map()
+        return None
+
+    created = _create_resource(target, data, vals)
+    sync_shard_map()
+    return created
+
+def _create_resource(target, data, vals):
+    with target.connect() as c:
+        # Create new
+        rid = new_id()
+        c.execute(RESOURCE_INSERT_SQL, (rid, *vals))
+
+        # --- AUTO CREATE USER LOGIN ---
+        # Logic: username = empid_lowercase, password = auto-generated
+        emp_id = data.get('employee_id', 'unknown')
+        username = emp_id.lower().replace(" ", "")
+        temp_pass = generate_temp_password()
+        name = data.get('employee_name', 'New User')
+        role = "Team Member"
+        img = ''  # initials avatar
+
+        # Insert user only if username doesn't exist
+        created = None
+        if c.execute("SELECT count(*) FROM users WHERE username=?", (username,)).fetchone()[0] == 0:
+            c.execute(f"INSERT INTO users ({', '.join(USER_COLS)}) VALUES (?,?,?,?,?,?,?)",
+                      (username, hash_password(temp_pass), role, name, emp_id, img, str(date.today())))
+            _assign_user_ids(c)
+            created = f"User: {username} | Pass: {temp_pass}"
+        c.execute("UPDATE resource_tracker_v4 SET user_id=(SELECT MIN(user_id) FROM users WHERE emp_id=?) WHERE id=?", (emp_id, rid))
+        return created
+
+def import_resource_df(df):
+    """Upserts resources on IMPORT_KEYS['resources']; returns inserted/updated/unchanged counts."""
+    rows = pd.DataFrame({k: df[k].fillna('').astype(str) if k in df else '' for k in RESOURCE_COLS}, index=df.index)
+    link = lambda c: c.execute("UPDATE resource_tracker_v4 SET user_id=(SELECT MIN(u.user_id) FROM users u WHERE u.emp_id=resource_tracker_v4.employee_id) "
+                               "WHERE user_id IS NULL")
+    counts = _upsert_routed("resource_tracker_v4", rows, IMPORT_KEYS['resources'], route=lambda d: d[SHARD_BY], after=link)
+    sync_shard_map()
+    return counts
+
+# ---------- MAINTENANCE ----------
+TABLES = {'tasks': 'tasks_v2', 'resources': 'resource_tracker_v4', 'trainings': 'training_repo',
+          'progress': 'training_progress', 'users': 'users', 'archive': 'tasks_archive',
+          'status_history': 'task_status_history'}
+
+IMPORTERS = {'tasks': import_kpi_df, 'resources': import_resource_df,
+             'trainings': import_training_df, 'users': import_users_df}
+
+# name -> callable(); registered by modules that maintain summary tables
+AGGREGATE_BUILDERS = {}
+
+def register_aggregate(name):
+    def deco(fn):
+        AGGREGATE_BUILDERS[name] = fn
+        return fn
+    return deco
+
+def rebuild_aggregates(names=None):
+    done = {}
+    for name, fn in AGGREGATE_BUILDERS.items():
+        if names and name not in names: continue
+        done[name] = fn()
+    return done
+
+# table -> (column that orders legacy rows, [(referencing table, column)])
+_ID_TABLES = {
+    'tasks_v2': ('date_of_receipt', [('task_status_history', 'task_id')]),
+    'tasks_archive': ('date_of_receipt', [('task_status_history', 'task_id')]),
+    'training_repo': (None, [('training_progress', 'training_id')]),
+    'resource_tracker_v4': ('onboarding_date', []),
+}
+
+def migrate_legacy_ids(tables=None):
+    """
+    Re-keys rows still carrying the old 8-character random ids with ids.py ids,
+    oldest first, updating references. Returns {table: rows re-keyed}.
+    """
+    done = {}
+    for table, (order_col, refs) in _ID_TABLES.items():
+        if tables and table not in tables: continue
+        done[table] = 0
+        for backend in (shards() if table in SHARDED_TABLES else [get_backend()]):
+            df = backend.read_df(f"SELECT id{', ' + order_col if order_col else ''} FROM {table}")
+            df = df.loc[~df['id'].map(is_new_style).astype(bool)]
+            if order_col:
+                df = df.assign(k=parse_dates(df[order_col])).sort_values('k', kind='stable')
+            mapping = list(zip(new_ids(len(df)), df['id']))
+            if mapping:
+                with backend.connect() as c:
+                    c.executemany(f"UPDATE {table} SET id=? WHERE id=?", mapping)
+                    for ref_table, ref_col in refs:
+                        if ref_table in SHARDED_TABLES and get_router():
+                            fan_out(lambda b: b.executemany(f"UPDATE {ref_table} SET {ref_col}=? WHERE {ref_col}=?", mapping))
+                        else:
+                            c.executemany(f"UPDATE {ref_table} SET {ref_col}=? WHERE {ref_col}=?", mapping)
+            done[table] += len(mapping)
+    return done
+
+def recompute_derived_fields():
+    """Recomputes otd_internal/otd_customer for every task; returns rows changed."""
+    return sum(fan_out(_recompute_derived_fields))
+
+def _recompute_derived_fields(backend):
+    df = backend.read_df("SELECT id, actual_delivery_date, commitment_date_to_customer, otd_customer FROM tasks_v2")
+    if df.empty: return 0
+    a_dt = parse_dates(df['actual_delivery_date'])
+    c_dt = parse_dates(df['commitment_date_to_customer'])
+    otd = pd.Series("N/A", index=df.index)
+    both = a_dt.notna() & c_dt.notna()
+    otd[both] = (a_dt[both] <= c_dt[both]).map({True: "OK", False: "NOT OK"})
+    changed = df[otd != df['otd_customer']]
+    backend.executemany("UPDATE tasks_v2 SET otd_internal=?, otd_customer=? WHERE id=?",
+                              [(otd[i], otd[i], tid) for i, tid in changed['id'].items()])
+    return len(changed)
+
+def vacuum_analyze():
+    backend = get_backend()
+    if backend.name == "sqlite":
+        for path in [backend.path] + ([b.path for b in shards()] if get_router() else []):
+            conn = sqlite3.connect(path, isolation_level=None)
+            try:
+                conn.execute("VACUUM"); conn.execute("ANALYZE")
+            finally: conn.close()
+    else:
+        # VACUUM cannot run inside a transaction block
+        raw = backend.pool.getconn()
+        try:
+            raw.autocommit = True
+            raw.cursor().execute("VACUUM ANALYZE")
+        finally:
+            raw.autocommit = False
+            backend.pool.putconn(raw)